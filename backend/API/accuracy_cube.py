@@ -0,0 +1,156 @@
+"""
+Precomputed accuracy cube
+
+One row per (ticker, timeframe, window_days, threshold, filter_rating) in table `accuracy_cube`,
+computed from the ticker's rating_accuracy rows with the same rules as
+/history-with-accuracy/{ticker} (calculate_accuracy_matching_frontend over the history items),
+for the window ending at the ticker's latest row.
+
+- window_days = 0 means the whole history (what the endpoint returns by default)
+- filter_rating = "" means all ratings; otherwise only rows whose current rating matches
+- Maintained per ticker: save_accuracy_to_db_new marks the ticker dirty and the writer
+  flushes its dirty tickers just before committing (market close, startup population,
+  backfill), so the cube is updated in the same transaction as rating_accuracy.
+
+Imports only accuracy_engine so accuracy_rebuild.py can refresh the cube too.
+"""
+from datetime import datetime
+
+import numpy as np
+
+import accuracy_engine
+
+CUBE_WINDOWS = (0, 30, 60, 90, 180)
+CUBE_THRESHOLDS = (1.0, 2.0, 3.0, 5.0)
+CUBE_FILTERS = ("", "Strong Buy", "Buy", "Sell", "Strong Sell")
+
+# dirty tickers per connection: a writer only flushes what it wrote itself (inside its own transaction)
+_dirty_tickers = {}
+
+
+def ensure_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS accuracy_cube (
+            ticker TEXT NOT NULL,
+            timeframe TEXT NOT NULL,
+            window_days INTEGER NOT NULL,
+            threshold REAL NOT NULL,
+            filter_rating TEXT NOT NULL,
+            correct INTEGER NOT NULL,
+            incorrect INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            accuracy REAL NOT NULL,
+            as_of TEXT,
+            updated_at TEXT,
+            PRIMARY KEY (ticker, timeframe, window_days, threshold, filter_rating)
+        )
+    """)
+
+
+def mark_dirty(cur, ticker: str):
+    if ticker:
+        _dirty_tickers.setdefault(id(cur.connection), set()).add(ticker.upper())
+
+
+def compute_ticker_cube(ticker: str, rows) -> list:
+    """
+    Cube cells for one ticker.
+    rows: rating_accuracy rows sorted by timestamp ASC as
+          (timestamp, daily_rating, daily_prev, weekly_rating, weekly_prev, change_pct, open, price)
+    Returns [(timeframe, window_days, threshold, filter_rating, correct, incorrect, total, accuracy), ...]
+    """
+    if not rows:
+        return []
+    n = len(rows)
+    cells = []
+    for timeframe, (r_idx, p_idx) in (("1D", (1, 2)), ("1W", (3, 4))):
+        # same item shape as /history-with-accuracy: prev defaults to "Unknown", missing numbers to 0
+        h = accuracy_engine.build_arrays([
+            (ticker, r[0], r[r_idx], r[p_idx] or "Unknown", r[5] or 0, r[6] or 0, None, r[7] or 0)
+            for r in rows
+        ])
+        norm_rating = [(r[r_idx] or "").lower().strip() for r in rows]
+        starts = {0: 0}
+        for w in CUBE_WINDOWS:
+            if w:
+                starts[w] = int(accuracy_engine.window_starts(h, w)[-1])
+
+        for threshold in CUBE_THRESHOLDS:
+            with_nb, alone = accuracy_engine.row_outcomes(h, method="matching_frontend", threshold=threshold)
+            for flt in CUBE_FILTERS:
+                if flt:
+                    mask = np.array([x == flt.lower() for x in norm_rating], dtype=bool)
+                    w_f, a_f = np.where(mask, with_nb, 0), np.where(mask, alone, 0)
+                else:
+                    w_f, a_f = with_nb, alone
+                for w in CUBE_WINDOWS:
+                    s = starts[w]
+                    seg = w_f[s:n]
+                    # oldest row of the window has no neighbour
+                    correct = int((seg == 1).sum()) - int(w_f[s] == 1) + int(a_f[s] == 1)
+                    incorrect = int((seg == -1).sum()) - int(w_f[s] == -1) + int(a_f[s] == -1)
+                    total = correct + incorrect
+                    cells.append((timeframe, w, threshold, flt, correct, incorrect, total,
+                                  accuracy_engine.accuracy_value(correct, incorrect)))
+    return cells
+
+
+def refresh_tickers(cur, tickers) -> int:
+    """Recompute and store the cube for `tickers` (uses the caller's transaction)."""
+    ensure_table(cur)
+    now = datetime.now().isoformat()
+    written = 0
+    for ticker in sorted({t.upper() for t in tickers if t}):
+        cur.execute("""
+            SELECT timestamp, daily_rating, daily_prev, weekly_rating, weekly_prev, change_pct, open, price
+            FROM rating_accuracy
+            WHERE ticker=?
+            ORDER BY timestamp ASC
+        """, (ticker,))
+        rows = cur.fetchall()
+        cur.execute("DELETE FROM accuracy_cube WHERE ticker=?", (ticker,))
+        if not rows:
+            continue
+        as_of = rows[-1][0]
+        cells = compute_ticker_cube(ticker, rows)
+        cur.executemany("""
+            INSERT INTO accuracy_cube
+            (ticker, timeframe, window_days, threshold, filter_rating, correct, incorrect, total, accuracy, as_of, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(ticker, *c, as_of, now) for c in cells])
+        written += len(cells)
+    return written
+
+
+def flush_dirty(cur) -> int:
+    """Refresh the tickers this connection marked dirty; call right before its commit."""
+    tickers = _dirty_tickers.pop(id(cur.connection), None)
+    if not tickers:
+        return 0
+    return refresh_tickers(cur, tickers)
+
+
+def refresh_missing(cur) -> int:
+    """Build the cube for tickers that have rating_accuracy rows but no cube yet (first run / new tickers)."""
+    ensure_table(cur)
+    cur.execute("""
+        SELECT DISTINCT a.ticker FROM rating_accuracy a
+        WHERE NOT EXISTS (SELECT 1 FROM accuracy_cube c WHERE c.ticker = a.ticker)
+    """)
+    return refresh_tickers(cur, [r[0] for r in cur.fetchall()])
+
+
+def lookup(cur, ticker: str, timeframe: str, window_days: int, threshold: float):
+    """{filter_rating or "all": {accuracy, correct, incorrect, total}} or None when not built yet."""
+    cur.execute("""
+        SELECT filter_rating, accuracy, correct, incorrect, total, as_of
+        FROM accuracy_cube
+        WHERE ticker=? AND timeframe=? AND window_days=? AND threshold=?
+    """, (ticker.upper(), timeframe, int(window_days), float(threshold)))
+    rows = cur.fetchall()
+    if not rows:
+        return None
+    return {
+        (r[0] or "all"): {"accuracy": r[1], "correct": r[2], "incorrect": r[3], "total": r[4], "as_of": r[5]}
+        for r in rows
+    }
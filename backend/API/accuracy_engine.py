@@ -0,0 +1,405 @@
+"""
+Vectorized accuracy engine (NumPy)
+
+คำนวณ accuracy ของทุก ticker / ทุก window ในครั้งเดียว แทนการวน loop ทีละแถวใน Python
+ผลลัพธ์ต้องตรงกับฟังก์ชันเดิมใน ratings_api_dynamic ทุกตัว:
+
+- method="matching_frontend"  -> calculate_accuracy_matching_frontend (threshold 2%, open-based change)
+- method="rating_change"      -> calculate_accuracy_from_rating_change (change_pct only)
+- method="frontend_logic"     -> calculate_accuracy_from_frontend_logic (score 1-5, sign of change)
+
+Flow:
+    h = load_history(con, timeframe="daily")         # rating_history -> arrays (sorted ticker, timestamp)
+    with_nb, alone = row_outcomes(h)                  # +1 correct / -1 incorrect / 0 not counted, per row
+    start = window_starts(h, 90)                      # first row of the 90-day window ending at each row
+    correct, incorrect = window_counts(h, with_nb, alone, start)
+
+Rating strings are encoded once per distinct value (not per row). A window ending at row i
+holds the same rows as `timestamp >= datetime(ts_i, '-N days') AND timestamp <= ts_i`.
+
+Backtest (forward returns): backtest_grid(h, thresholds, horizons) scores every rating change
+against the price N snapshots later.
+
+ตัวทดสอบ golden อยู่ที่ test_accuracy_engine.py
+"""
+
+import numpy as np
+
+CHANGE_THRESHOLD = 2.0
+
+# strength ที่ใช้ใน calculate_accuracy_matching_frontend / calculate_accuracy_from_rating_change
+_STRENGTH_MAP = {
+    "strong sell": -2,
+    "sell": -1,
+    "neutral": 0,
+    "buy": 1,
+    "strong buy": 2,
+}
+# score ที่ใช้ใน get_rating_score / calculate_accuracy_from_frontend_logic
+_SCORE_MAP = {
+    "strong buy": 5,
+    "buy": 4,
+    "neutral": 3,
+    "sell": 2,
+    "strong sell": 1,
+}
+NO_STRENGTH = -9
+
+
+def _strength(text):
+    if not text:
+        return NO_STRENGTH
+    rl = text.lower().strip()
+    if rl in _STRENGTH_MAP:
+        return _STRENGTH_MAP[rl]
+    if "strong" in rl and "sell" in rl:
+        return _STRENGTH_MAP["strong sell"]
+    if "strong" in rl and "buy" in rl:
+        return _STRENGTH_MAP["strong buy"]
+    if "sell" in rl:
+        return _STRENGTH_MAP["sell"]
+    if "buy" in rl:
+        return _STRENGTH_MAP["buy"]
+    if "neutral" in rl:
+        return _STRENGTH_MAP["neutral"]
+    return NO_STRENGTH
+
+
+def encode_ratings(values):
+    """
+    Encode rating strings once per distinct value.
+
+    Returns dict of arrays (one entry per input value):
+      present  - value is a non-empty string
+      strength - strength -2..2 (NO_STRENGTH when unknown)
+      norm     - code of value.lower().strip() (for "rating not changed" checks)
+      lower    - code of value.lower() (frontend_logic filter compare)
+      score    - get_rating_score() value 0..5
+    plus "lower_text": list mapping `lower` codes back to text.
+    """
+    codes = {}
+    idx = np.fromiter((codes.setdefault(v, len(codes)) for v in values), dtype=np.int64, count=len(values))
+    uniq = list(codes)
+
+    present = np.array([bool(v) for v in uniq], dtype=bool)
+    strength = np.array([_strength(str(v)) if v else NO_STRENGTH for v in uniq], dtype=np.int8)
+    norm_codes, lower_codes = {}, {}
+    norm = np.array([norm_codes.setdefault(str(v).lower().strip() if v else "", len(norm_codes)) for v in uniq], dtype=np.int64)
+    lower = np.array([lower_codes.setdefault(str(v).lower() if v else "", len(lower_codes)) for v in uniq], dtype=np.int64)
+    score = np.array([_SCORE_MAP.get(str(v).lower(), 0) if v else 0 for v in uniq], dtype=np.int8)
+
+    if not uniq:
+        idx = np.zeros(0, dtype=np.int64)
+        present = np.zeros(0, dtype=bool)
+        strength = np.zeros(0, dtype=np.int8)
+        norm = lower = np.zeros(0, dtype=np.int64)
+        score = np.zeros(0, dtype=np.int8)
+        return {"present": present, "strength": strength, "norm": norm, "lower": lower, "score": score, "lower_text": []}
+
+    return {
+        "present": present[idx],
+        "strength": strength[idx],
+        "norm": norm[idx],
+        "lower": lower[idx],
+        "score": score[idx],
+        "lower_text": list(lower_codes),
+    }
+
+
+def _floats(values):
+    return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+
+
+def build_arrays(rows):
+    """
+    Build engine arrays from rows already sorted by (ticker, timestamp ASC).
+    Each row: (ticker, timestamp, rating, prev, change_pct, open, open_prev, price).
+    """
+    n = len(rows)
+    tickers = []
+    ticker_idx = np.empty(n, dtype=np.int64)
+    last = None
+    for i, r in enumerate(rows):
+        if r[0] != last:
+            tickers.append(r[0])
+            last = r[0]
+        ticker_idx[i] = len(tickers) - 1
+
+    # rating + prev share one encoding so their text codes are comparable
+    enc = encode_ratings([r[2] for r in rows] + [r[3] for r in rows])
+    rating = {k: (v[:n] if k != "lower_text" else v) for k, v in enc.items()}
+    prev = {k: (v[n:] if k != "lower_text" else v) for k, v in enc.items()}
+
+    return {
+        "tickers": tickers,
+        "ticker_idx": ticker_idx,
+        "ts": np.array([r[1] for r in rows], dtype=str) if n else np.zeros(0, dtype=str),
+        "rating": rating,
+        "prev": prev,
+        "change_pct": _floats([r[4] for r in rows]),
+        "open": _floats([r[5] for r in rows]),
+        "open_prev": _floats([r[6] for r in rows]),
+        "price": _floats([r[7] for r in rows]),
+    }
+
+
+def load_history(con, timeframe="daily", table="rating_history", tickers=None):
+    """Load rating rows as arrays sorted by ticker, timestamp (ASC)."""
+    cur = con.cursor()
+    cur.execute(f"PRAGMA table_info({table})")
+    cols = {r[1] for r in cur.fetchall()}
+    open_col = "open" if "open" in cols else "NULL"
+    open_prev_col = "open_prev" if "open_prev" in cols else "NULL"
+    price_col = "price" if "price" in cols else "NULL"
+
+    where = ""
+    params = []
+    if tickers:
+        where = f"WHERE ticker IN ({','.join('?' for _ in tickers)})"
+        params = [t.upper() for t in tickers]
+    cur.execute(f"""
+        SELECT ticker, timestamp, {timeframe}_rating, {timeframe}_prev, change_pct, {open_col}, {open_prev_col}, {price_col}
+        FROM {table}
+        {where}
+        ORDER BY ticker, timestamp ASC
+    """, params)
+    return build_arrays(cur.fetchall())
+
+
+def neighbour_open(h):
+    """open of the next older row of the same ticker (NaN for a ticker's first row)."""
+    nb = np.full(len(h["open"]), np.nan)
+    if len(nb) > 1:
+        same = h["ticker_idx"][1:] == h["ticker_idx"][:-1]
+        nb[1:] = np.where(same, h["open"][:-1], np.nan)
+    return nb
+
+
+def _matching_frontend_outcome(h, nb_open, threshold):
+    r, p = h["rating"], h["prev"]
+    open_curr, open_prev = h["open"], h["open_prev"]
+
+    # change: open-based when open/open_prev known, otherwise change_pct
+    has_open_info = ~np.isnan(open_curr) | ~np.isnan(open_prev)
+    op = np.where(np.isnan(open_prev), nb_open, open_prev)
+    oc = np.where(np.isnan(open_curr), h["price"], open_curr)
+    use_open = has_open_info & ~np.isnan(op) & ~np.isnan(oc) & (op != 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = np.where(use_open, (oc - op) / op * 100, h["change_pct"])
+
+    s_now = r["strength"].astype(np.int64)
+    s_prev = p["strength"].astype(np.int64)
+    valid = (~np.isnan(change) & r["present"] & p["present"]
+             & (s_now != NO_STRENGTH) & (s_prev != NO_STRENGTH))
+    # skip when rating not changed and price not changed
+    valid &= ~((r["norm"] == p["norm"]) & (np.abs(change) < 0.01))
+
+    delta = s_now - s_prev
+    direction = np.where(delta != 0, np.sign(delta), np.sign(s_now))
+    counted = valid & (direction != 0)
+    correct = counted & (((direction > 0) & (change >= threshold)) | ((direction < 0) & (change <= -threshold)))
+    return np.where(correct, 1, np.where(counted, -1, 0)).astype(np.int8)
+
+
+def _rating_change_outcome(h, threshold):
+    r, p = h["rating"], h["prev"]
+    change = h["change_pct"]
+    s_now = r["strength"].astype(np.int64)
+    s_prev = p["strength"].astype(np.int64)
+    valid = (~np.isnan(change) & r["present"] & p["present"]
+             & (s_now != NO_STRENGTH) & (s_prev != NO_STRENGTH))
+    delta = s_now - s_prev
+    direction = np.where(delta != 0, np.sign(delta), np.sign(s_now))
+    counted = valid & (direction != 0)
+    correct = counted & (((direction > 0) & (change >= threshold)) | ((direction < 0) & (change <= -threshold)))
+    return np.where(correct, 1, np.where(counted, -1, 0)).astype(np.int8)
+
+
+def _frontend_logic_outcome(h, filter_rating=None):
+    r, p = h["rating"], h["prev"]
+    change = h["change_pct"]
+    valid = r["present"] & p["present"] & ~np.isnan(change)
+    if filter_rating:
+        target = filter_rating.lower()
+        lower_text = r["lower_text"]
+        code = lower_text.index(target) if target in lower_text else -1
+        valid &= r["lower"] == code
+
+    curr_score = r["score"].astype(np.int64)
+    direction = curr_score - p["score"].astype(np.int64)
+    positive = curr_score >= 4
+    same = np.where(positive, change > 0, change < 0)
+    moved = ((direction > 0) & (change > 0)) | ((direction < 0) & (change < 0))
+    correct = valid & np.where(direction == 0, same, moved)
+    return np.where(correct, 1, np.where(valid, -1, 0)).astype(np.int8)
+
+
+def row_outcomes(h, method="matching_frontend", threshold=CHANGE_THRESHOLD, filter_rating=None):
+    """
+    Per-row outcome (+1 correct, -1 incorrect, 0 not counted) as (with_neighbour, alone).
+
+    Only matching_frontend depends on the neighbouring (older) row: when open_prev is missing it
+    uses the older row's open. The oldest row of a window has no neighbour, so window_counts()
+    uses `alone` for it. For the other methods both arrays are the same.
+    """
+    if method == "matching_frontend":
+        with_nb = _matching_frontend_outcome(h, neighbour_open(h), threshold)
+        alone = _matching_frontend_outcome(h, np.full(len(h["open"]), np.nan), threshold)
+        return with_nb, alone
+    if method == "rating_change":
+        out = _rating_change_outcome(h, threshold)
+    elif method == "frontend_logic":
+        out = _frontend_logic_outcome(h, filter_rating)
+    else:
+        raise ValueError(f"Unknown accuracy method: {method}")
+    return out, out
+
+
+def window_starts(h, window_days):
+    """
+    Index of the first row in the `window_days` window ending at each row:
+    rows of the same ticker with timestamp >= datetime(ts, '-N days') (SQLite text compare).
+    """
+    n = len(h["ts"])
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    base = h["ts"].astype("U19").astype("datetime64[s]")
+    cutoff = np.char.replace(np.datetime_as_string(base - np.timedelta64(int(window_days), "D"), unit="s"), "T", " ")
+
+    # rank timestamp and cutoff strings together so text order becomes integer order
+    _, inv = np.unique(np.concatenate([h["ts"], cutoff]), return_inverse=True)
+    inv = inv.reshape(-1)
+    span = int(inv.max()) + 1
+    key = h["ticker_idx"] * span + inv[:n]
+    return np.searchsorted(key, h["ticker_idx"] * span + inv[n:], side="left")
+
+
+def _ticker_starts(h):
+    n = len(h["ticker_idx"])
+    first = np.ones(n, dtype=bool)
+    if n > 1:
+        first[1:] = h["ticker_idx"][1:] != h["ticker_idx"][:-1]
+    return np.maximum.accumulate(np.where(first, np.arange(n), 0)) if n else np.zeros(0, dtype=np.int64)
+
+
+def window_counts(h, with_nb, alone, start=None):
+    """
+    (correct, incorrect) for the window [start[i], i] ending at every row.
+    `start=None` means the whole history of the ticker up to the row.
+    """
+    if start is None:
+        start = _ticker_starts(h)
+    out = []
+    for value in (1, -1):
+        hit = (with_nb == value).astype(np.int64)
+        csum = np.concatenate([[0], np.cumsum(hit)])
+        idx = np.arange(len(hit))
+        total = csum[idx + 1] - csum[start]
+        # oldest row of each window has no neighbour
+        total += (alone[start] == value).astype(np.int64) - hit[start] if len(hit) else 0
+        out.append(total)
+    return out[0], out[1]
+
+
+def accuracy_value(correct, incorrect, method="matching_frontend"):
+    """Accuracy rounded the same way as the Python function for `method`."""
+    total = correct + incorrect
+    accuracy = (correct / total * 100) if total > 0 else 0
+    if method == "matching_frontend":
+        return round(accuracy)
+    return round(float(accuracy), 2)
+
+
+def latest_by_ticker(h, correct, incorrect, method="matching_frontend"):
+    """Result of the window ending at each ticker's latest row: {ticker: {accuracy, correct, incorrect, total}}."""
+    result = {}
+    if not len(h["ticker_idx"]):
+        return result
+    last = np.ones(len(h["ticker_idx"]), dtype=bool)
+    last[:-1] = h["ticker_idx"][1:] != h["ticker_idx"][:-1]
+    for i in np.flatnonzero(last):
+        c, inc = int(correct[i]), int(incorrect[i])
+        result[h["tickers"][h["ticker_idx"][i]]] = {
+            "accuracy": accuracy_value(c, inc, method),
+            "correct": c,
+            "incorrect": inc,
+            "total": c + inc,
+        }
+    return result
+
+
+def accuracy_all_tickers(con, window_days=90, method="matching_frontend", timeframe="daily",
+                         table="rating_history", threshold=CHANGE_THRESHOLD, filter_rating=None):
+    """Latest-window accuracy for every ticker in one pass. window_days=None -> whole history."""
+    h = load_history(con, timeframe=timeframe, table=table)
+    with_nb, alone = row_outcomes(h, method=method, threshold=threshold, filter_rating=filter_rating)
+    start = window_starts(h, window_days) if window_days else None
+    correct, incorrect = window_counts(h, with_nb, alone, start)
+    return latest_by_ticker(h, correct, incorrect, method)
+
+
+# ---------- Backtest: rating change vs forward return ----------
+
+def change_signals(h):
+    """
+    Direction of every rating change (+1 upgrade, -1 downgrade, 0 no signal).
+    Only rows where the rating text changed and both ratings have a strength count.
+    """
+    r, p = h["rating"], h["prev"]
+    s_now = r["strength"].astype(np.int64)
+    s_prev = p["strength"].astype(np.int64)
+    valid = (r["present"] & p["present"] & (r["norm"] != p["norm"])
+             & (s_now != NO_STRENGTH) & (s_prev != NO_STRENGTH))
+    return np.where(valid, np.sign(s_now - s_prev), 0).astype(np.int8)
+
+
+def forward_returns(h, horizon):
+    """% change from price at row i to price `horizon` snapshots later (same ticker), NaN past the end."""
+    n = len(h["price"])
+    out = np.full(n, np.nan)
+    if horizon <= 0 or n <= horizon:
+        return out
+    same = h["ticker_idx"][horizon:] == h["ticker_idx"][:-horizon]
+    base = h["price"][:-horizon]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ret = (h["price"][horizon:] - base) / base * 100
+    out[:-horizon] = np.where(same & (base != 0), ret, np.nan)
+    return out
+
+
+def backtest_grid(h, thresholds, horizons):
+    """
+    Score rating changes for every (horizon, threshold):
+    correct when the return from the change row to the row exactly `horizon` snapshots later
+    (forward_returns, point-to-point — not the best/worst excursion in between) is >= threshold
+    for an upgrade (<= -threshold for a downgrade). Changes without a row `horizon` snapshots
+    ahead are not counted. Returns (cells, per_ticker) where each cell is
+    {horizon, threshold, correct, incorrect, total, accuracy} and per_ticker maps ticker -> cells.
+    """
+    direction = change_signals(h)
+    n_tickers = len(h["tickers"])
+    cells = []
+    per_ticker = {t: [] for t in h["tickers"]}
+    for horizon in horizons:
+        fwd = forward_returns(h, int(horizon))
+        counted = (direction != 0) & ~np.isnan(fwd)
+        for threshold in thresholds:
+            hit = counted & (((direction > 0) & (fwd >= threshold)) | ((direction < 0) & (fwd <= -threshold)))
+            correct_t = np.bincount(h["ticker_idx"], weights=hit, minlength=n_tickers).astype(np.int64)
+            total_t = np.bincount(h["ticker_idx"], weights=counted, minlength=n_tickers).astype(np.int64)
+            c, total = int(correct_t.sum()), int(total_t.sum())
+            cells.append(_backtest_cell(horizon, threshold, c, total))
+            for i, t in enumerate(h["tickers"]):
+                per_ticker[t].append(_backtest_cell(horizon, threshold, int(correct_t[i]), int(total_t[i])))
+    return cells, per_ticker
+
+
+def _backtest_cell(horizon, threshold, correct, total):
+    return {
+        "horizon": int(horizon),
+        "threshold": float(threshold),
+        "correct": correct,
+        "incorrect": total - correct,
+        "total": total,
+        "accuracy": round(correct / total * 100, 2) if total else 0.0,
+    }
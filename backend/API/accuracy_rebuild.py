@@ -0,0 +1,292 @@
+"""
+Parallel rating_accuracy rebuild
+
+Usage:
+    py accuracy_rebuild.py                      # all tickers, one worker per core
+    py accuracy_rebuild.py --workers 4 --tickers AAPL,NVDA
+
+Recomputes every rating_accuracy row derived from rating_history (same values as running
+calculate_and_save_accuracy_for_ticker for every pair oldest-first), sharded by ticker
+across a ProcessPoolExecutor:
+
+- The live DB is copied once with the SQLite online backup API; workers only read that
+  snapshot, so every shard sees the same point in time.
+- Each worker derives its rows and window aggregates (accuracy_engine, NumPy) on its own
+  and returns plain tuples.
+- The parent is the single writer: INSERT OR REPLACE per shard (+ the shard's accuracy
+  cube), one commit per shard.
+
+Workers import only this module + accuracy_engine (not ratings_api_dynamic), so spawning
+them is cheap on Windows too. The same job is exposed through POST /ratings/api/admin/accuracy/rebuild.
+
+Note: run this from `backend/API` folder so relative imports work.
+"""
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import accuracy_cube
+import accuracy_engine
+
+DB_FILE = "ratings.sqlite"
+ACCURACY_WINDOW_DAYS = 90
+SHARDS_PER_WORKER = 4
+
+# Progress of the current/last run (read by the admin status endpoint)
+_rebuild_state = {
+    "running": False,
+    "phase": "idle",
+    "workers": 0,
+    "tickers": 0,
+    "shards": 0,
+    "done_shards": 0,
+    "rows_written": 0,
+    "started_at": None,
+    "finished_at": None,
+    "elapsed_sec": None,
+    "error": None,
+}
+
+_INSERT_SQL = """
+    INSERT OR REPLACE INTO rating_accuracy
+    (ticker, timestamp, price, price_prev, open_prev, open, change_pct, currency, high, low, window_day,
+     daily_rating, daily_prev, samplesize_daily, correct_daily, incorrect_daily, accuracy_daily,
+     weekly_rating, weekly_prev, samplesize_weekly, correct_weekly, incorrect_weekly, accuracy_weekly)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def get_rebuild_status() -> dict:
+    return dict(_rebuild_state)
+
+
+def snapshot_database(db_file: str, dst_dir: str = None) -> str:
+    """Consistent point-in-time copy of the DB (online backup; the live DB stays writable)."""
+    fd, path = tempfile.mkstemp(prefix="ratings_snapshot_", suffix=".sqlite", dir=dst_dir)
+    os.close(fd)
+    src = sqlite3.connect(db_file, timeout=30)
+    dst = sqlite3.connect(path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+    return path
+
+
+def _derive_rows(history, window_cutoffs, window_days):
+    """
+    rating_accuracy base values for one ticker's history rows (sorted ASC), following
+    calculate_and_save_accuracy_for_ticker: skip the first row, rows without price and
+    rows whose previous price is missing or zero.
+    """
+    derived = []
+    for i, h in enumerate(history):
+        ticker, ts, price, change_pct, currency, high, low, opn, d_rating, d_prev, w_rating, w_prev = h
+        if i == 0:
+            continue
+        prev = history[i - 1]
+        price_prev = prev[2]
+        if price_prev is None or price is None or price_prev == 0:
+            continue
+        try:
+            calc_change = ((price - price_prev) / price_prev) * 100
+        except Exception:
+            calc_change = 0.0
+        # open_prev only when the previous row is inside the window (history query is windowed)
+        cutoff = window_cutoffs[i]
+        open_prev = prev[7] if cutoff is not None and prev[1] >= cutoff else None
+        derived.append({
+            "ticker": ticker,
+            "timestamp": ts,
+            "price": price,
+            "price_prev": price_prev,
+            "open_prev": open_prev,
+            "open": opn,
+            "change_pct": calc_change,
+            "currency": currency or "",
+            "high": high,
+            "low": low,
+            "window_day": window_days,
+            "daily_rating": d_rating,
+            "daily_prev": d_prev,
+            "weekly_rating": w_rating if w_rating is not None else "Unknown",
+            "weekly_prev": w_prev if w_prev is not None else "Unknown",
+        })
+    return derived
+
+
+def _rebuild_shard(snapshot_path: str, tickers: list, window_days: int = ACCURACY_WINDOW_DAYS) -> list:
+    """Worker: compute final rating_accuracy tuples for `tickers` from the snapshot."""
+    con = sqlite3.connect(f"file:{snapshot_path}?mode=ro", uri=True)
+    try:
+        cur = con.cursor()
+        marks = ",".join("?" for _ in tickers)
+        cur.execute(f"""
+            SELECT ticker, timestamp, price, change_pct, currency, high, low, open,
+                   daily_rating, daily_prev, weekly_rating, weekly_prev,
+                   datetime(timestamp, '-{int(window_days)} days')
+            FROM rating_history
+            WHERE ticker IN ({marks})
+            ORDER BY ticker, timestamp ASC
+        """, tickers)
+        history_by_ticker = {}
+        cutoffs_by_ticker = {}
+        for r in cur.fetchall():
+            history_by_ticker.setdefault(r[0], []).append(r[:12])
+            cutoffs_by_ticker.setdefault(r[0], []).append(r[12])
+
+        # Existing rows that are not re-derived stay in the table and still count in windows
+        cur.execute(f"""
+            SELECT ticker, timestamp, daily_rating, daily_prev, weekly_rating, weekly_prev, change_pct, open, open_prev
+            FROM rating_accuracy
+            WHERE ticker IN ({marks})
+        """, tickers)
+        existing = {}
+        for r in cur.fetchall():
+            existing.setdefault(r[0], []).append(r)
+    finally:
+        con.close()
+
+    out = []
+    for ticker in tickers:
+        derived = _derive_rows(history_by_ticker.get(ticker, []), cutoffs_by_ticker.get(ticker, []), window_days)
+        if not derived:
+            continue
+        derived_ts = {d["timestamp"] for d in derived}
+
+        # union of derived rows and untouched rows, sorted by timestamp (text order like SQLite)
+        rows = [(d["timestamp"], d["daily_rating"], d["daily_prev"], d["weekly_rating"], d["weekly_prev"],
+                 d["change_pct"], d["open"], d["open_prev"], d) for d in derived]
+        rows += [(e[1], e[2], e[3], e[4], e[5], e[6], e[7], e[8], None)
+                 for e in existing.get(ticker, []) if e[1] not in derived_ts]
+        rows.sort(key=lambda r: r[0])
+
+        counts = {}
+        for key, r_idx, p_idx in (("daily", 1, 2), ("weekly", 3, 4)):
+            h = accuracy_engine.build_arrays([(ticker, r[0], r[r_idx], r[p_idx], r[5], r[6], r[7], None) for r in rows])
+            with_nb, alone = accuracy_engine.row_outcomes(h, method="matching_frontend", threshold=2.0)
+            start = accuracy_engine.window_starts(h, window_days)
+            counts[key] = accuracy_engine.window_counts(h, with_nb, alone, start)
+
+        for i, r in enumerate(rows):
+            d = r[8]
+            if d is None:
+                continue
+            agg = []
+            for key in ("daily", "weekly"):
+                c, inc = int(counts[key][0][i]), int(counts[key][1][i])
+                agg.append((c + inc, c, inc, accuracy_engine.accuracy_value(c, inc)))
+            out.append((
+                d["ticker"], d["timestamp"], d["price"], d["price_prev"], d["open_prev"], d["open"],
+                d["change_pct"], d["currency"], d["high"], d["low"], d["window_day"],
+                d["daily_rating"], d["daily_prev"], *agg[0],
+                d["weekly_rating"], d["weekly_prev"], *agg[1],
+            ))
+    return out
+
+
+def _shard(tickers: list, n: int) -> list:
+    """Round-robin tickers into n shards (sorted input keeps shard sizes even)."""
+    shards = [tickers[i::n] for i in range(n)]
+    return [s for s in shards if s]
+
+
+def rebuild_all(db_file: str = DB_FILE, workers: int = None, tickers: list = None,
+                window_days: int = ACCURACY_WINDOW_DAYS, commit=None) -> dict:
+    """
+    Parallel full rebuild of rating_accuracy. Blocking; returns the final status.
+    commit(con, shard_tickers) replaces writer.commit() per shard (the API passes
+    ratings_api_dynamic.commit_and_bump so its own writes are not seen as external).
+    """
+    st = _rebuild_state
+    if st["running"]:
+        raise RuntimeError("An accuracy rebuild is already running")
+    workers = max(1, int(workers or os.cpu_count() or 1))
+    t0 = time.time()
+    st.update({"running": True, "phase": "snapshot", "workers": workers, "tickers": 0, "shards": 0,
+               "done_shards": 0, "rows_written": 0, "started_at": datetime.now().isoformat(),
+               "finished_at": None, "elapsed_sec": None, "error": None})
+    snapshot_path = None
+    try:
+        snapshot_path = snapshot_database(db_file, os.path.dirname(os.path.abspath(db_file)))
+
+        con = sqlite3.connect(snapshot_path)
+        all_tickers = [r[0] for r in con.execute("SELECT DISTINCT ticker FROM rating_history ORDER BY ticker")]
+        con.close()
+        if tickers:
+            wanted = {t.strip().upper() for t in tickers}
+            all_tickers = [t for t in all_tickers if t in wanted]
+        # calculate_and_save_accuracy_for_ticker queries by ticker.upper()
+        all_tickers = [t for t in all_tickers if t and t == t.upper()]
+        shards = _shard(all_tickers, workers * SHARDS_PER_WORKER)
+        st.update({"phase": "computing", "tickers": len(all_tickers), "shards": len(shards)})
+        print(f"[AccuracyRebuild] {len(all_tickers)} tickers in {len(shards)} shards on {workers} workers")
+
+        # single writer: results are written as shards complete
+        writer = sqlite3.connect(db_file, timeout=30)
+        writer.execute("PRAGMA busy_timeout=30000")
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_rebuild_shard, snapshot_path, shard, window_days): shard for shard in shards}
+                for fut in as_completed(futures):
+                    shard = futures[fut]
+                    rows = fut.result()
+                    writer.executemany(_INSERT_SQL, rows)
+                    # window state ของ ticker เหล่านี้ไม่ตรงแล้ว -> ให้ rebuild ตอนใช้ครั้งถัดไป
+                    try:
+                        writer.execute(
+                            f"DELETE FROM accuracy_window_state WHERE ticker IN ({','.join('?' for _ in shard)})", shard
+                        )
+                    except sqlite3.OperationalError:
+                        pass  # older DB without the state table
+                    accuracy_cube.refresh_tickers(writer.cursor(), shard)
+                    if commit:
+                        commit(writer, shard)
+                    else:
+                        writer.commit()
+                    st["done_shards"] += 1
+                    st["rows_written"] += len(rows)
+        finally:
+            writer.close()
+        st["phase"] = "done"
+    except Exception as e:
+        st["phase"] = "error"
+        st["error"] = str(e)
+        print(f"[AccuracyRebuild] Error: {e}")
+        raise
+    finally:
+        st["running"] = False
+        st["finished_at"] = datetime.now().isoformat()
+        st["elapsed_sec"] = round(time.time() - t0, 2)
+        if snapshot_path:
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(snapshot_path + suffix)
+                except OSError:
+                    pass
+    print(f"[AccuracyRebuild] Wrote {st['rows_written']} rows in {st['elapsed_sec']}s")
+    return get_rebuild_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild rating_accuracy in parallel (one process per core)")
+    parser.add_argument("--db", default=DB_FILE, help="SQLite DB file (default: ratings.sqlite)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--tickers", default=None, help="Comma-separated tickers (default: all)")
+    parser.add_argument("--window-days", type=int, default=ACCURACY_WINDOW_DAYS,
+                        help=f"Accuracy window (anything but {ACCURACY_WINDOW_DAYS} only with --db on a copy)")
+    args = parser.parse_args()
+    if args.window_days != ACCURACY_WINDOW_DAYS and os.path.abspath(args.db) == os.path.abspath(DB_FILE):
+        # would overwrite the live 90-day rows that the server's updater / cube / leaderboard read
+        parser.error(f"--window-days {args.window_days} needs --db pointing at a copy of {DB_FILE}")
+    tickers = [t for t in args.tickers.split(",") if t.strip()] if args.tickers else None
+    rebuild_all(args.db, workers=args.workers, tickers=tickers, window_days=args.window_days)
+
+
+if __name__ == "__main__":
+    main()
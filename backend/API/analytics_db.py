@@ -0,0 +1,200 @@
+"""
+Analytics database (website tracking), separate from ratings.sqlite
+
+Page views used to be written into ratings.sqlite, so every tracking flush competed for the
+same WAL writer lock as background_updater / fetch_market_history. Analytics now live in
+their own file (ANALYTICS_DB_FILE, default analytics.sqlite) with their own writer:
+
+- init(ratings_db_file): create tables; one-time move of the analytics tables that still sit
+  in ratings.sqlite (copied only into empty destination tables, then dropped from the source,
+  so an interrupted move is finished on the next start without duplicating rows)
+- writer(): the single long-lived write connection (used by tracking_ingest.flush)
+- connect(): short-lived read connections for the Stats endpoints
+- retention_cutoff() / delete_expired_batch() / vacuum(): retention for raw user_tracking rows
+  + incremental vacuum, driven by tracking_ingest.maintain() (rollups are kept)
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+import analytics_rollup
+
+DB_FILE = os.getenv("ANALYTICS_DB_FILE", "analytics.sqlite")
+# raw events older than this are deleted (aggregates stay in analytics_rollup); 0 = keep forever
+RETENTION_DAYS = int(os.getenv("ANALYTICS_RETENTION_DAYS", "180"))
+RETENTION_BATCH = 5000
+VACUUM_PAGES = 2000
+
+# tables moved out of ratings.sqlite (the last three are legacy, not written anymore)
+MIGRATE_TABLES = ("user_tracking", "user_page_analytics", "analytics_rollup",
+                  "user_behavior", "visitor_stats")
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _open(timeout=30):
+    con = sqlite3.connect(DB_FILE, timeout=timeout, check_same_thread=False)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    return con
+
+
+def connect(timeout=5):
+    """Read connection for the Stats endpoints."""
+    return sqlite3.connect(DB_FILE, timeout=timeout)
+
+
+def writer():
+    """The analytics writer connection (callers serialize on their own lock)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = _open()
+        return _writer
+
+
+def _ensure_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_tracking (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip_address TEXT,
+            session_id TEXT,
+            event_type TEXT,
+            event_data TEXT,
+            page_path TEXT,
+            timestamp TEXT,
+            user_agent TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Check and migrate user_tracking if it has old schema (user_id instead of ip_address)
+    try:
+        cur.execute("PRAGMA table_info(user_tracking)")
+        ut_cols = [r[1] for r in cur.fetchall()]
+        if "user_id" in ut_cols:
+            print("⚠️ Migrating user_tracking to match user_behavior schema...")
+            cur.execute("ALTER TABLE user_tracking RENAME TO user_tracking_old")
+            cur.execute("""
+                CREATE TABLE user_tracking (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ip_address TEXT,
+                    session_id TEXT,
+                    event_type TEXT,
+                    event_data TEXT,
+                    page_path TEXT,
+                    timestamp TEXT,
+                    user_agent TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # Restore data (set ip_address to 'migrated')
+            cur.execute("""
+                INSERT INTO user_tracking (session_id, event_type, event_data, page_path, timestamp, user_agent, created_at, ip_address)
+                SELECT session_id, event_type, event_data, page_path, timestamp, user_agent, created_at, 'migrated'
+                FROM user_tracking_old
+            """)
+            cur.execute("DROP TABLE user_tracking_old")
+            print("   -> user_tracking migrated successfully.")
+    except Exception as e:
+        print(f"⚠️ Error check/migrating user_tracking: {e}")
+
+    # retention deletes by created_at
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_tracking_created_at ON user_tracking(created_at)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_page_analytics (
+            ip_address TEXT,
+            page_path TEXT,
+            view_count INTEGER,
+            PRIMARY KEY (ip_address, page_path)
+        )
+    """)
+    analytics_rollup.ensure_table(cur)
+
+
+def _move_from_ratings(con, ratings_db_file) -> dict:
+    """Copy MIGRATE_TABLES from ratings.sqlite into this DB (if still there), then drop them there."""
+    moved = {}
+    if not ratings_db_file or not os.path.exists(ratings_db_file):
+        return moved
+    src = sqlite3.connect(ratings_db_file, timeout=30)
+    try:
+        present = {
+            r[0]: r[1] for r in src.execute(
+                f"SELECT name, sql FROM sqlite_master WHERE type='table' AND name IN ({','.join('?' for _ in MIGRATE_TABLES)})",
+                MIGRATE_TABLES,
+            )
+        }
+    finally:
+        src.close()
+    if not present:
+        return moved
+
+    cur = con.cursor()
+    cur.execute("ATTACH DATABASE ? AS src", (ratings_db_file,))
+    try:
+        for name in MIGRATE_TABLES:
+            if name not in present:
+                continue
+            cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,))
+            if not cur.fetchone():
+                cur.execute(present[name])  # same schema as in ratings.sqlite
+            cur.execute(f"SELECT 1 FROM main.{name} LIMIT 1")
+            if not cur.fetchone():
+                cur.execute(f"INSERT INTO main.{name} SELECT * FROM src.{name}")
+                moved[name] = cur.rowcount
+            else:
+                moved[name] = 0  # copied by an earlier (interrupted) run
+            con.commit()
+            cur.execute(f"DROP TABLE src.{name}")
+            con.commit()
+    finally:
+        cur.execute("DETACH DATABASE src")
+    return moved
+
+
+def init(ratings_db_file: str = None):
+    """Create the analytics DB (and move tables out of ratings.sqlite on first run)."""
+    new_file = not os.path.exists(DB_FILE)
+    con = sqlite3.connect(DB_FILE, timeout=30)
+    try:
+        if new_file:
+            # must be set before the first table; lets maintain() give space back in small steps
+            con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        con.execute("PRAGMA journal_mode=WAL")
+        moved = _move_from_ratings(con, ratings_db_file)
+        if moved:
+            print(f"[INFO] Moved analytics tables from {ratings_db_file} to {DB_FILE}: {moved}")
+        cur = con.cursor()
+        _ensure_tables(cur)
+        backfilled = analytics_rollup.backfill(cur)
+        if backfilled:
+            print(f"[INFO] Built analytics rollups from {backfilled} user_tracking rows.")
+        con.commit()
+    finally:
+        con.close()
+
+
+def retention_cutoff(now: datetime = None) -> str | None:
+    """created_at cutoff for RETENTION_DAYS, or None when retention is disabled."""
+    if RETENTION_DAYS <= 0:
+        return None
+    # created_at is CURRENT_TIMESTAMP (UTC)
+    return ((now or datetime.now(timezone.utc)) - timedelta(days=RETENTION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def delete_expired_batch(cur, cutoff: str) -> int:
+    """Delete at most RETENTION_BATCH raw events older than cutoff. Caller commits; loop until < RETENTION_BATCH."""
+    cur.execute("""
+        DELETE FROM user_tracking WHERE id IN (
+            SELECT id FROM user_tracking WHERE created_at < ? LIMIT ?
+        )
+    """, (cutoff, RETENTION_BATCH))
+    return cur.rowcount
+
+
+def vacuum(cur):
+    """Return up to VACUUM_PAGES free pages to the OS (auto_vacuum=INCREMENTAL)."""
+    cur.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()  # frees one page per step
@@ -0,0 +1,240 @@
+"""
+Analytics rollups (Stats page)
+
+Table `analytics_rollup`, one row per (granularity, bucket, page):
+- granularity: "minute" (bucket YYYY-MM-DDTHH:MM), "hour" (YYYY-MM-DDTHH), "day" (YYYY-MM-DD)
+  and "all" (bucket "") for lifetime totals
+- page: normalized page ("home", "drlist", ...) or "*" for all pages
+- page_views / events counters and `visitors`, a HyperLogLog sketch of client IPs
+  (zlib-compressed registers) so unique visitors can be merged across buckets
+
+Updated by tracking_ingest.flush in the same transaction as user_tracking (buckets use the
+server's local time at flush); the Stats endpoints only read these rows.
+Minute rows are pruned after MINUTE_RETENTION_HOURS.
+"""
+import hashlib
+import math
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+
+HLL_P = 12  # 4096 registers, ~1.6% standard error
+HLL_M = 1 << HLL_P
+MINUTE_RETENTION_HOURS = int(os.getenv("ANALYTICS_MINUTE_RETENTION_HOURS", "48"))
+
+GRANULARITY_FORMATS = {
+    "minute": "%Y-%m-%dT%H:%M",
+    "hour": "%Y-%m-%dT%H",
+    "day": "%Y-%m-%d",
+}
+
+_last_prune = None
+
+
+class HyperLogLog:
+    """Minimal HyperLogLog (64-bit blake2b hash), mergeable by register-wise max."""
+
+    def __init__(self, registers: bytes = None):
+        self.registers = bytearray(registers) if registers else bytearray(HLL_M)
+
+    def add(self, value: str):
+        h = int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+        idx = h >> (64 - HLL_P)
+        rest = h & ((1 << (64 - HLL_P)) - 1)
+        rho = (64 - HLL_P) - rest.bit_length() + 1
+        if rho > self.registers[idx]:
+            self.registers[idx] = rho
+
+    def merge(self, other: "HyperLogLog"):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / HLL_M)
+        estimate = alpha * HLL_M * HLL_M / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * HLL_M and zeros:
+            estimate = HLL_M * math.log(HLL_M / zeros)  # linear counting for small cardinalities
+        return int(round(estimate))
+
+    def to_blob(self) -> bytes:
+        return zlib.compress(bytes(self.registers), 6)
+
+    @classmethod
+    def from_blob(cls, blob):
+        return cls(zlib.decompress(blob)) if blob else cls()
+
+
+def normalize_page(page_path: str) -> str:
+    """'/ratings/drlist/' -> 'drlist' (last path segment, 'home' for '/')."""
+    parts = [p for p in (page_path or "").strip().lower().split("/") if p]
+    return parts[-1] if parts else "home"
+
+
+def ensure_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS analytics_rollup (
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            page TEXT NOT NULL,
+            page_views INTEGER NOT NULL DEFAULT 0,
+            events INTEGER NOT NULL DEFAULT 0,
+            visitors BLOB,
+            PRIMARY KEY (granularity, bucket, page)
+        )
+    """)
+
+
+def _aggregate(events, bucket_time_of):
+    """{(granularity, bucket, page): [page_views, events, set(ip)]} incl. page "*" and lifetime rows."""
+    agg = {}
+    for ev in events:
+        ip, event_type, page_path = ev[0], ev[2], ev[4]
+        page = normalize_page(page_path)
+        at = bucket_time_of(ev)
+        buckets = [(g, at.strftime(fmt)) for g, fmt in GRANULARITY_FORMATS.items()] + [("all", "")]
+        for g, b in buckets:
+            for p in (page, "*"):
+                cell = agg.setdefault((g, b, p), [0, 0, set()])
+                cell[0] += event_type == "page_view"
+                cell[1] += 1
+                if ip:
+                    cell[2].add(ip)
+    return agg
+
+
+def _write(cur, agg):
+    for (g, b, p), (views, events, ips) in agg.items():
+        cur.execute("SELECT visitors FROM analytics_rollup WHERE granularity=? AND bucket=? AND page=?", (g, b, p))
+        row = cur.fetchone()
+        hll = HyperLogLog.from_blob(row[0] if row else None)
+        for ip in ips:
+            hll.add(ip)
+        cur.execute("""
+            INSERT INTO analytics_rollup (granularity, bucket, page, page_views, events, visitors)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(granularity, bucket, page) DO UPDATE SET
+                page_views = page_views + excluded.page_views,
+                events = events + excluded.events,
+                visitors = excluded.visitors
+        """, (g, b, p, views, events, hll.to_blob()))
+
+
+def apply(cur, events, now: datetime = None):
+    """
+    Add a flushed batch to the rollups (caller commits).
+    events: tracking_ingest queue tuples (ip, session_id, event_type, event_data, page_path, timestamp, user_agent)
+    """
+    global _last_prune
+    now = now or datetime.now()
+    ensure_table(cur)
+    _write(cur, _aggregate(events, lambda ev: now))
+
+    if _last_prune is None or now - _last_prune > timedelta(hours=1):
+        cutoff = (now - timedelta(hours=MINUTE_RETENTION_HOURS)).strftime(GRANULARITY_FORMATS["minute"])
+        cur.execute("DELETE FROM analytics_rollup WHERE granularity='minute' AND bucket < ?", (cutoff,))
+        _last_prune = now
+
+
+def _event_time(timestamp, created_at):
+    """Local time of a stored user_tracking row (client ISO timestamp, else created_at in UTC)."""
+    for value, assume_utc in ((timestamp, False), (created_at, True)):
+        try:
+            dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except (TypeError, ValueError):
+            continue
+        if dt.tzinfo is None and assume_utc:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.astimezone().replace(tzinfo=None) if dt.tzinfo else dt
+    return None
+
+
+def backfill(cur, chunk_size: int = 5000) -> int:
+    """One-time build from existing user_tracking rows (when the rollup table is still empty)."""
+    ensure_table(cur)
+    cur.execute("SELECT 1 FROM analytics_rollup LIMIT 1")
+    if cur.fetchone():
+        return 0
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_tracking'")
+    if not cur.fetchone():
+        return 0
+
+    read = cur.connection.cursor()
+    read.execute("""
+        SELECT ip_address, session_id, event_type, event_data, page_path, timestamp, user_agent, created_at
+        FROM user_tracking ORDER BY id
+    """)
+    now = datetime.now()
+    agg = {}
+    total = 0
+    while True:
+        rows = read.fetchmany(chunk_size)
+        if not rows:
+            break
+        total += len(rows)
+        part = _aggregate(rows, lambda ev: _event_time(ev[5], ev[7]) or now)
+        for key, (views, events, ips) in part.items():
+            cell = agg.setdefault(key, [0, 0, set()])
+            cell[0] += views
+            cell[1] += events
+            cell[2] |= ips
+
+    # lifetime events per page: user_page_analytics keeps counts older than user_tracking rows
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_page_analytics'")
+    if cur.fetchone():
+        cur.execute("SELECT page_path, SUM(view_count) FROM user_page_analytics GROUP BY page_path")
+        lifetime = {}
+        for page_path, views in cur.fetchall():
+            page = normalize_page(page_path)
+            lifetime[page] = lifetime.get(page, 0) + (views or 0)
+        if lifetime:
+            for key, cell in agg.items():
+                if key[0] == "all" and key[2] != "*":
+                    cell[1] = lifetime.get(key[2], 0)
+            for page, events in lifetime.items():
+                agg.setdefault(("all", "", page), [0, 0, set()])[1] = events
+            agg.setdefault(("all", "", "*"), [0, 0, set()])[1] = sum(lifetime.values())
+    cutoff =(now - timedelta(hours=MINUTE_RETENTION_HOURS)).strftime(GRANULARITY_FORMATS["minute"])
+    _write(cur, {k: v for k, v in agg.items() if k[0] != "minute" or k[1] >= cutoff})
+    return total
+
+
+# ---------- Reads (Stats endpoints) ----------
+
+def totals(cur) -> dict:
+    """Lifetime {page_views, events, unique_visitors} over all pages."""
+    cur.execute("SELECT page_views, events, visitors FROM analytics_rollup WHERE granularity='all' AND page='*'")
+    row = cur.fetchone()
+    if not row:
+        return {"page_views": 0, "events": 0, "unique_visitors": 0}
+    return {"page_views": row[0], "events": row[1], "unique_visitors": HyperLogLog.from_blob(row[2]).count()}
+
+
+def page_totals(cur) -> dict:
+    """Lifetime {page: {"page_views", "events"}} per page."""
+    cur.execute("""
+        SELECT page, page_views, events FROM analytics_rollup
+        WHERE granularity='all' AND page != '*' AND events > 0
+    """)
+    return {r[0]: {"page_views": r[1], "events": r[2]} for r in cur.fetchall()}
+
+
+def page_views_between(cur, start_day: str, end_day: str) -> dict:
+    """{page: page_views} from day buckets start_day..end_day (YYYY-MM-DD, inclusive)."""
+    cur.execute("""
+        SELECT page, SUM(page_views) FROM analytics_rollup
+        WHERE granularity='day' AND bucket >= ? AND bucket <= ? AND page != '*'
+        GROUP BY page
+    """, (start_day, end_day))
+    return {r[0]: r[1] for r in cur.fetchall()}
+
+
+def unique_visitors_between(cur, granularity: str, start_bucket: str, end_bucket: str) -> int:
+    """Unique visitors across a bucket range (HLL union of the '*' rows)."""
+    cur.execute("""
+        SELECT visitors FROM analytics_rollup
+        WHERE granularity=? AND bucket >= ? AND bucket <= ? AND page='*'
+    """, (granularity, start_bucket, end_bucket))
+    hll = HyperLogLog()
+    for (blob,) in cur.fetchall():
+        hll.merge(HyperLogLog.from_blob(blob))
+    return hll.count()
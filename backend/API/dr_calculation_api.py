@@ -1,6 +1,6 @@
 import os
 from typing import Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import asyncio
@@ -12,10 +12,11 @@ import json
 from contextlib import suppress
 import uvicorn
 
+import dr_universe
+
 app = FastAPI(title="DR Calculation API (Cache + Background Refresh + Symbol Map)")
 
 IDEATRADE_BASE = "https://api.ideatrade1.com"
-DR_LIST_FILE = os.path.join(os.path.dirname(__file__), "dr_list.json")
 TV_SCAN_URL = "https://scanner.tradingview.com/global/scan"
 
 # -----------------------------
@@ -37,6 +38,9 @@ TV_BACKOFF_BASE_SEC = 1.0
 TV_COOLDOWN_ON_429_SEC = 180          # โดน 429 → พักทั้งระบบ 3 นาที
 TV_CONCURRENCY = 1                    # สำคัญสุด: ยิงทีละ 1 กันโดนลิมิต
 _tv_sem = asyncio.Semaphore(TV_CONCURRENCY)
+TV_SCAN_COLUMNS = ["last", "close", "open"]
+TV_BATCH_WINDOW_MS = 20               # miss ที่มาภายใน 20ms รวมเป็น scan request เดียว
+TV_BATCH_MAX_TICKERS = 200            # ticker ต่อ 1 request
 # Timestamp (epoch seconds) until which TradingView requests are blocked (set on 429)
 # Initialize to 0 so checks like `_now() < _tv_block_until` are safe.
 _tv_block_until: float = 0.0
@@ -268,152 +272,185 @@ def _trim_warm_keys():
 _tv_client: httpx.AsyncClient | None = None
 _idea_client: httpx.AsyncClient | None = None
 
-# ✅ แก้หลัก: fallback columns + debug log ตอน error
-async def tv_scan_close(tv_ticker: str) -> float:
-    columns = ["last", "close", "open"]
+def _to_price(x):
+    if x is None:
+        return None
+    try:
+        f = float(x)
+        if f == f and f > 0:
+            return f
+    except Exception:
+        return None
+    return None
+
+async def _tv_post_scan(tickers: list[str]) -> dict:
+    """ยิง /global/scan 1 ครั้ง (หลาย ticker) + retry 429 → {"SYMBOL": [last, close, open]}"""
     assert _tv_client is not None
     global _tv_block_until
 
-    def to_float(x):
-        if x is None:
-            return None
-        try:
-            f = float(x)
-            if f == f and f > 0:
-                return f
-        except Exception:
-            return None
-        return None
+    if _now() < _tv_block_until:
+        raise HTTPException(503, f"TradingView cooldown until {_tv_block_until:.0f}")
 
-    async def _post_once(ticker: str):
-        payload = {
-            "symbols": {"tickers": [ticker], "query": {"types": []}},
-            "columns": columns,
-        }
-
-        # ✅ จับ semaphore แค่ตอนยิงจริง
-        async with _tv_sem:
-            r = await _tv_client.post(TV_SCAN_URL, json=payload)
+    payload = {
+        "symbols": {"tickers": tickers, "query": {"types": []}},
+        "columns": TV_SCAN_COLUMNS,
+    }
+    last_text = ""
+    for attempt in range(1, TV_MAX_RETRIES + 1):
+        try:
+            # ✅ จับ semaphore แค่ตอนยิงจริง (upstream ยังเห็นทีละ 1 request)
+            async with _tv_sem:
+                r = await _tv_client.post(TV_SCAN_URL, json=payload)
+        except httpx.HTTPError as e:
+            print("TV_SCAN_HTTP_ERROR tickers=", len(tickers), "err=", repr(e))
+            raise HTTPException(502, f"TradingView request failed ({len(tickers)} tickers)")
 
         status = r.status_code
-        text = (r.text or "")[:300]
+        last_text = (r.text or "")[:300]
 
         if status == 429:
-            return 429, text, None
-
-        r.raise_for_status()
-        try:
-            return status, text, r.json()
-        except Exception:
-            print("TV_SCAN_NONJSON ticker=", ticker, "status=", status, "text=", text)
-            raise HTTPException(502, f"TradingView returned non-JSON for {ticker}")
-
-    async def _fetch_with_retry(ticker: str) -> dict:
-        global _tv_block_until
-
-        if _now() < _tv_block_until:
-            raise HTTPException(503, f"TradingView cooldown until {_tv_block_until:.0f}")
-
-        last_text = ""
-        for attempt in range(1, TV_MAX_RETRIES + 1):
-            status, text, data = await _post_once(ticker)
-            last_text = text
-
-            if status != 429:
-                return data  # type: ignore
-
             wait = TV_BACKOFF_BASE_SEC * (2 ** (attempt - 1))  # 1,2,4,8
-            print("TV_SCAN_429 ticker=", ticker, "attempt=", attempt, "sleep=", wait)
+            print("TV_SCAN_429 tickers=", len(tickers), "attempt=", attempt, "sleep=", wait)
             await asyncio.sleep(wait)
+            continue
 
-        _tv_block_until = _now() + TV_COOLDOWN_ON_429_SEC
-        print("TV_SCAN_COOLDOWN_SET until=", _tv_block_until, "ticker=", ticker, "last_text=", last_text)
-        raise HTTPException(429, f"TradingView rate limited for {ticker}")
-
-    data = None
-    used_ticker = tv_ticker
-
-    try:
-        # 1) ยิงด้วย ticker เดิมก่อน
-        data = await _fetch_with_retry(tv_ticker)
-
-        # 2) fallback ด้วย TV_SYMBOL_OVERRIDES (สำคัญ)
-        if not data.get("data"):
-            override = TV_SYMBOL_OVERRIDES.get(tv_ticker)
-            if override and override != tv_ticker:
-                data2 = await _fetch_with_retry(override)
-                if data2.get("data"):
-                    data = data2
-                    used_ticker = override
-
-        # 3) fallback NYSEARCA → AMEX / ARCA / BATS
-        if not data.get("data"):
-            if tv_ticker.startswith("NYSEARCA:"):
-                sym = tv_ticker.split(":", 1)[1]
-                candidates = [f"AMEX:{sym}", f"ARCA:{sym}", f"BATS:{sym}"]
-
-                for alt in candidates:
-                    data2 = await _fetch_with_retry(alt)
-                    if data2.get("data"):
-                        data = data2
-                        used_ticker = alt
-                        break
-
-                if not data.get("data"):
-                    print("TV_SCAN_NOT_FOUND ticker=", tv_ticker, "override=", TV_SYMBOL_OVERRIDES.get(tv_ticker), "candidates=", candidates)
-                    print("TV_SCAN_RESPONSE=", data)
-                    raise HTTPException(404, f"TradingView ticker not found or no data returned: {tv_ticker}")
-            else:
-                print("TV_SCAN_NOT_FOUND ticker=", tv_ticker)
-                print("TV_SCAN_RESPONSE=", data)
-                raise HTTPException(404, f"TradingView ticker not found or no data returned: {tv_ticker}")
+        if status >= 400:
+            print("TV_SCAN_HTTP_ERROR tickers=", len(tickers), "status=", status, "text=", last_text)
+            raise HTTPException(502, f"TradingView request failed ({len(tickers)} tickers)")
+        try:
+            data = r.json()
+        except Exception:
+            print("TV_SCAN_NONJSON tickers=", tickers[:5], "status=", status, "text=", last_text)
+            raise HTTPException(502, "TradingView returned non-JSON")
 
-        # 4) ดึงราคา last → close → open
-        d = data["data"][0]["d"]
-        for v in d:
-            fv = to_float(v)
-            if fv is not None:
-                return fv
+        rows = (data or {}).get("data") or []
+        out = {str(row.get("s", "")).upper(): row.get("d") or [] for row in rows}
+        # ticker เดียว: ไม่ต้องสน "s" ที่ TV ตอบกลับมา (เหมือนพฤติกรรมเดิม)
+        if len(tickers) == 1 and len(rows) == 1:
+            out = {tickers[0].upper(): rows[0].get("d") or []}
+        return out
 
-        raise HTTPException(500, f"No usable price fields for {used_ticker} (tried {columns})")
+    _tv_block_until = _now() + TV_COOLDOWN_ON_429_SEC
+    print("TV_SCAN_COOLDOWN_SET until=", _tv_block_until, "tickers=", len(tickers), "last_text=", last_text)
+    raise HTTPException(429, "TradingView rate limited")
 
-    except HTTPException:
-        raise
+async def tv_scan_many(tv_tickers: list[str]) -> dict[str, float | Exception]:
+    """
+    ราคา last → close → open ของหลาย ticker ใน request เดียว
+    - ตัวที่ไม่เจอ: รอบ 2 ลอง TV_SYMBOL_OVERRIDES, รอบ 3 ลอง NYSEARCA → AMEX / ARCA / BATS (รวมเป็น request เดียวต่อรอบ)
+    - คืน ticker -> price หรือ HTTPException (ของตัวนั้นตัวเดียว)
+    """
+    tickers = list(dict.fromkeys(tv_tickers))
+    found = await _tv_post_scan(tickers)
+    rows = {t: found[t.upper()] for t in tickers if t.upper() in found}
+
+    # 2) fallback ด้วย TV_SYMBOL_OVERRIDES (สำคัญ)
+    overrides = {
+        t: TV_SYMBOL_OVERRIDES[t] for t in tickers
+        if t not in rows and TV_SYMBOL_OVERRIDES.get(t, t) != t
+    }
+    if overrides:
+        found = await _tv_post_scan(list(dict.fromkeys(overrides.values())))
+        for t, alt in overrides.items():
+            if alt.upper() in found:
+                rows[t] = found[alt.upper()]
+
+    # 3) fallback NYSEARCA → AMEX / ARCA / BATS
+    alternates = {
+        t: [f"{p}:{t.split(':', 1)[1]}" for p in ("AMEX", "ARCA", "BATS")]
+        for t in tickers if t not in rows and t.startswith("NYSEARCA:")
+    }
+    if alternates:
+        found = await _tv_post_scan([a for alts in alternates.values() for a in alts])
+        for t, alts in alternates.items():
+            for alt in alts:
+                if alt.upper() in found:
+                    rows[t] = found[alt.upper()]
+                    break
+
+    # 4) ดึงราคา last → close → open
+    results: dict[str, float | Exception] = {}
+    for t in tickers:
+        if t not in rows:
+            print("TV_SCAN_NOT_FOUND ticker=", t, "override=", TV_SYMBOL_OVERRIDES.get(t), "candidates=", alternates.get(t))
+            results[t] = HTTPException(404, f"TradingView ticker not found or no data returned: {t}")
+            continue
+        price = next((p for p in map(_to_price, rows[t]) if p is not None), None)
+        if price is None:
+            results[t] = HTTPException(500, f"No usable price fields for {t} (tried {TV_SCAN_COLUMNS})")
+        else:
+            results[t] = price
+    return results
 
-    except httpx.HTTPError as e:
-        # (จริง ๆ ส่วนใหญ่จะถูกดักใน _post_once แล้ว)
+# -----------------------------
+# Micro-batching: miss ที่เข้ามาภายใน TV_BATCH_WINDOW_MS รวมเป็น scan เดียว
+# -----------------------------
+_scan_waiters: dict[str, list[asyncio.Future]] = {}
+_scan_batch_task: asyncio.Task | None = None
+_scan_stats = {"requests": 0, "tickers": 0}
+
+async def _scan_batch_loop():
+    while _scan_waiters:
+        await asyncio.sleep(TV_BATCH_WINDOW_MS / 1000)
+        tickers = list(_scan_waiters)[:TV_BATCH_MAX_TICKERS]
+        waiters = {t: _scan_waiters.pop(t) for t in tickers}
+        _scan_stats["requests"] += 1
+        _scan_stats["tickers"] += len(tickers)
         try:
-            status = getattr(e.response, "status_code", None)
-            text = getattr(e.response, "text", "")
-        except Exception:
-            status, text = None, ""
-        print("TV_SCAN_HTTP_ERROR ticker=", used_ticker, "status=", status, "err=", repr(e), "text=", (text or "")[:300])
-        raise HTTPException(502, f"TradingView request failed for {used_ticker}")
-
-    except Exception as e:
-        print("TV_SCAN_ERROR ticker=", used_ticker)
-        print("TV_SCAN_ERROR response=", data)
-        raise HTTPException(500, f"Cannot fetch close for {used_ticker}: {type(e).__name__}")
+            results = await tv_scan_many(tickers)
+        except asyncio.CancelledError:
+            for futs in waiters.values():
+                for fut in futs:
+                    fut.cancel()
+            raise
+        except Exception as e:
+            if not isinstance(e, HTTPException):
+                print("TV_SCAN_ERROR tickers=", tickers[:5], "err=", repr(e))
+                e = HTTPException(500, f"Cannot fetch close: {type(e).__name__}")
+            results = {t: e for t in tickers}
+
+        for t, futs in waiters.items():
+            res = results.get(t)
+            for fut in futs:
+                if fut.done():
+                    continue
+                if isinstance(res, Exception):
+                    fut.set_exception(res)
+                else:
+                    fut.set_result(res)
 
-async def get_price_cached(kind: str, tv_ticker: str, ttl: int = CACHE_TTL_SECONDS) -> float:
+async def tv_scan_close(tv_ticker: str) -> float:
+    """ราคาล่าสุดของ tv_ticker (รอเข้า batch ถัดไปของ _scan_batch_loop)"""
+    global _scan_batch_task
+    fut = asyncio.get_running_loop().create_future()
+    _scan_waiters.setdefault(tv_ticker, []).append(fut)
+    if _scan_batch_task is None or _scan_batch_task.done():
+        _scan_batch_task = asyncio.create_task(_scan_batch_loop())
+    return await fut
+
+async def get_price_cached(kind: str, tv_ticker: str, ttl: int = CACHE_TTL_SECONDS, warm: bool = True) -> float:
     key = f"{kind}|{tv_ticker}"
-    mark_warm(key)
-    _trim_warm_keys()
+    if warm:
+        mark_warm(key)
+        _trim_warm_keys()
 
     # 1) fresh
     v = cache_get(key, allow_stale=False)
     if v is not None:
         return v
 
-    # 2) single-flight
+    # 2) single-flight (รอ future นอก lock ไม่งั้น miss ตัวอื่นเข้า batch เดียวกันไม่ได้)
     async with _inflight_lock:
         fut = _inflight.get(key)
-        if fut:
-            return await fut
-
-        loop = asyncio.get_event_loop()
-        fut = loop.create_future()
-        _inflight[key] = fut
+        if fut is None:
+            loop = asyncio.get_event_loop()
+            fut = loop.create_future()
+            _inflight[key] = fut
+            owner = True
+        else:
+            owner = False
+    if not owner:
+        return await asyncio.shield(fut)
 
     try:
         if _now() < _tv_block_until:
@@ -459,23 +496,6 @@ def choose_best_row(candidates: list) -> dict:
         return (is_open, tv, vol)
     return sorted(candidates, key=score, reverse=True)[0]
 
-def pick_dr_row(rows: list, query_symbol: str) -> dict:
-    q = _norm(query_symbol)
-
-    exact_symbol = [r for r in rows if _norm(str(r.get("symbol", ""))) == q]
-    if exact_symbol:
-        return exact_symbol[0]
-
-    exact_underlying = [r for r in rows if _norm(str(r.get("underlying", ""))) == q]
-    if exact_underlying:
-        return choose_best_row(exact_underlying)
-
-    contains_underlying = [r for r in rows if q and q in _norm(str(r.get("underlying", "")))]
-    if contains_underlying:
-        return choose_best_row(contains_underlying)
-
-    raise HTTPException(404, f"No matching DR found for '{query_symbol}'")
-
 def _strip_tv_suffix(sym: str) -> str:
     return re.sub(r"\.(HK|SS|SZ|T)\s*$", "", (sym or "").strip(), flags=re.I)
 
@@ -634,6 +654,215 @@ def map_to_tv_symbol_and_currency(dr: dict, underlying_tv_map: dict[str, str]) -
 
     return tv_symbol, currency
 
+# -----------------------------
+# DR index (สร้างครั้งเดียวต่อ version ของ dr_universe → ต่อ request เหลือแค่ dict lookup)
+# -----------------------------
+def _build_dr_index(snap: dict) -> dict:
+    """
+    entries:       (row, (tv_symbol, currency, None)) หรือ (row, (None, None, (status_code, detail))) ถ้า map_to_tv_symbol_and_currency error
+    by_symbol:     _norm(symbol) -> entry (แถวแรก)
+    by_underlying: _norm(underlying) -> entry ที่ดีที่สุด (choose_best_row)
+    groups:        _norm(underlying) -> [(position, entry)] ไว้ใช้กับ contains fallback
+    """
+    rows = snap["rows"]
+    underlying_tv_map = build_underlying_tv_map(rows)
+
+    entries = []
+    by_symbol = {}
+    groups: dict[str, list] = {}
+    for i, dr in enumerate(rows):
+        try:
+            mapped = (*map_to_tv_symbol_and_currency(dr, underlying_tv_map), None)
+        except HTTPException as e:
+            # เก็บแค่ status/detail ไม่เก็บ exception instance (traceback/context จะติดไปทุก request)
+            mapped = (None, None, (e.status_code, e.detail))
+        entry = (dr, mapped)
+        entries.append(entry)
+        by_symbol.setdefault(_norm(str(dr.get("symbol", ""))), entry)
+        groups.setdefault(_norm(str(dr.get("underlying", ""))), []).append((i, entry))
+
+    by_underlying = {u: _best_entry(g) for u, g in groups.items()}
+    return {"entries": entries, "by_symbol": by_symbol, "by_underlying": by_underlying, "groups": groups}
+
+def _best_entry(candidates: list) -> tuple:
+    best = choose_best_row([e[0] for _, e in candidates])
+    return next(e for _, e in candidates if e[0] is best)
+
+def dr_index() -> dict:
+    return dr_universe.derived("calc_dr_index", _build_dr_index)
+
+def lookup_dr(query_symbol: str) -> tuple[dict, str, str]:
+    """
+    เลือก row: symbol ตรง → underlying ตรง (best row) → underlying ที่มีคำค้น (best row)
+    คืน (row, tv_symbol, currency)
+    """
+    idx = dr_index()
+    q = _norm(query_symbol)
+
+    entry = idx["by_symbol"].get(q) or idx["by_underlying"].get(q)
+    if entry is None and q:
+        matched = sorted(c for u, g in idx["groups"].items() if q in u for c in g)
+        if matched:
+            entry = _best_entry(matched)
+    if entry is None:
+        raise HTTPException(404, f"No matching DR found for '{query_symbol}'")
+
+    dr, (tv_symbol, currency, err) = entry
+    if err is not None:
+        raise HTTPException(err[0], err[1])
+    return dr, tv_symbol, currency
+
+# -----------------------------
+# Whole-universe valuation (ตาราง fair value ทุก DR, คำนวณใหม่ทุกรอบ refresher)
+# -----------------------------
+_valuation_table: dict = {"version": 0, "computed_at": 0.0, "count": 0, "body": None}
+_valuation_lock = asyncio.Lock()
+# last / bid / offer ของ DR มาจาก feed สด (แหล่งเดียวกับ /ratings/dr-list) ไม่ใช่ snapshot ของ dr_universe
+DR_QUOTES_URL = os.getenv("DR_LIST_URL") or f"{IDEATRADE_BASE}/caldr"
+_dr_quotes: dict = {"by_symbol": {}, "fetched_at": None}
+
+def parse_conversion_ratio(value) -> float | None:
+    """'340 : 1' / '1,000 : 1' -> จำนวน DR ต่อหุ้นแม่ 1 หุ้น (None ถ้า parse ไม่ได้)"""
+    parts = str(value or "").replace(",", "").split(":")
+    try:
+        left = float(parts[0])
+        right = float(parts[1]) if len(parts) > 1 and parts[1].strip() else 1.0
+    except ValueError:
+        return None
+    if left > 0 and right > 0:
+        return left / right
+    return None
+
+def _premium_pct(price, fair) -> float | None:
+    try:
+        price = float(price or 0)
+    except (TypeError, ValueError):
+        return None
+    if price <= 0 or not fair:
+        return None
+    return round((price - fair) / fair * 100, 4)
+
+async def _price_or_stale(kind: str, tv_ticker: str, ttl: int):
+    """(price, is_stale) หรือ (None, error) — ไม่ให้ตัวเดียวพังทั้งตาราง"""
+    try:
+        # warm=False: ทั้ง universe ไม่ควรเบียด WARM_KEYS ของ user (ตารางนี้ refresh เองทุกรอบอยู่แล้ว)
+        return await get_price_cached(kind, tv_ticker, ttl=ttl, warm=False), False
+    except HTTPException as e:
+        v = cache_get(f"{kind}|{tv_ticker}", allow_stale=True)
+        if v is not None:
+            return v, True
+        return None, e.detail
+
+async def _fetch_dr_quotes() -> tuple[dict, float | None, bool]:
+    """
+    (symbol -> row ของ feed สด, fetched_at, is_stale)
+    feed ล่ม -> ใช้ชุดล่าสุดที่ดึงได้ (is_stale=True) หรือ {} ถ้ายังไม่เคยดึงได้เลย
+    """
+    global _dr_quotes
+    try:
+        r = await _idea_client.get(DR_QUOTES_URL, timeout=10)
+        r.raise_for_status()
+        rows = r.json().get("rows")
+        if not isinstance(rows, list):
+            raise ValueError("unexpected DR list payload")
+    except Exception as e:
+        print("CALC_ALL_QUOTES_FAIL", DR_QUOTES_URL, type(e).__name__, str(e))
+        return _dr_quotes["by_symbol"], _dr_quotes["fetched_at"], True
+
+    by_symbol = {}
+    for row in rows:
+        by_symbol.setdefault(_norm(str(row.get("symbol", ""))), row)
+    _dr_quotes = {"by_symbol": by_symbol, "fetched_at": _now()}
+    return by_symbol, _dr_quotes["fetched_at"], False
+
+async def refresh_valuation_table() -> dict:
+    """
+    คำนวณ fair value ของทุก DR: underlying * fx / ratio แล้วเทียบกับ last / bid / offer ของ DR
+    ราคา underlying + FX ดึงพร้อมกันทั้งหมด (cache hit ไม่ยิง, miss รวมเป็น batch scan)
+    พร้อมกับ quote ของ DR จาก feed สด (DR_QUOTES_URL)
+    """
+    global _valuation_table
+    async with _valuation_lock:
+        await dr_universe.refresh(_idea_client)
+
+        mapped = []
+        for dr, (tv_symbol, currency, map_err) in dr_index()["entries"]:
+            if map_err is not None:
+                mapped.append((dr, None, None, None, map_err[1]))
+                continue
+            fx_pair = FX_PAIR_MAP.get(currency)
+            err = None if fx_pair else f"Unsupported currency (FX map missing): {currency}"
+            mapped.append((dr, tv_symbol, currency, fx_pair, err))
+
+        u_keys = sorted({m[1] for m in mapped if not m[4]})
+        f_keys = sorted({m[3] for m in mapped if not m[4]})
+        (quotes, quotes_at, quotes_stale), *fetched = await asyncio.gather(
+            _fetch_dr_quotes(),
+            *(_price_or_stale("U", t, CACHE_TTL_SECONDS) for t in u_keys),
+            *(_price_or_stale("F", f"FX_IDC:{p}", FX_CACHE_TTL_SECONDS) for p in f_keys),
+        )
+        u_prices = dict(zip(u_keys, fetched[:len(u_keys)]))
+        fx_rates = dict(zip(f_keys, fetched[len(u_keys):]))
+
+        out = []
+        for dr, tv_symbol, currency, fx_pair, err in mapped:
+            ratio = parse_conversion_ratio(dr.get("conversionRatio"))
+            und, und_stale = u_prices.get(tv_symbol, (None, False))
+            fx, fx_stale = fx_rates.get(fx_pair, (None, False))
+            if err is None and und is None:
+                err = und_stale
+            if err is None and fx is None:
+                err = fx_stale
+            if err is None and ratio is None:
+                err = f"Cannot parse conversionRatio: {dr.get('conversionRatio')}"
+
+            fair = (und * fx / ratio) if err is None else None
+            quote = quotes.get(_norm(str(dr.get("symbol", ""))))
+            if quote is None:
+                quote = {}
+                if err is None:
+                    err = "DR quote unavailable (live DR list)" if quotes_at else "Live DR list unavailable"
+            last, bid, offer = quote.get("last"), quote.get("bidPrice"), quote.get("offerPrice")
+            out.append({
+                "symbol": dr.get("symbol"),
+                "underlying": dr.get("underlying"),
+                "underlyingExchange": dr.get("underlyingExchange"),
+                "tv_symbol": tv_symbol,
+                "currency": currency,
+                "fx_pair": fx_pair,
+                "conversion_ratio": ratio,
+                "underlying_price": und if fair is not None else None,
+                "fx_rate": fx if fair is not None else None,
+                "is_stale": bool(fair is not None and (und_stale or fx_stale or (quote and quotes_stale))),
+                "fair_value": fair,
+                "last": last,
+                "bid": bid,
+                "offer": offer,
+                "premium_pct": _premium_pct(last, fair),          # + = DR แพงกว่า fair (premium), - = discount
+                "bid_premium_pct": _premium_pct(bid, fair),
+                "offer_premium_pct": _premium_pct(offer, fair),
+                "error": err,
+            })
+
+        computed_at = _now()
+        payload = {
+            "count": len(out),
+            "priced": sum(1 for r in out if r["fair_value"] is not None),
+            "computed_at": computed_at,
+            "universe_version": dr_universe.version(),
+            "quotes_fetched_at": quotes_at,
+            "quotes_stale": quotes_stale,
+            "refresh_interval_sec": REFRESH_INTERVAL_SECONDS,
+            "rows": out,
+        }
+        _valuation_table = {
+            "version": _valuation_table["version"] + 1,
+            "computed_at": computed_at,
+            "count": len(out),
+            "body": json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+        }
+        return _valuation_table
+
 # -----------------------------
 # Background refresher
 # -----------------------------
@@ -650,25 +879,34 @@ async def refresher_loop():
                 await asyncio.sleep(max(1.0, _tv_block_until - _now()))
                 continue
 
+            due = []
             for key in keys:
                 if "|" not in key:
                     continue
 
+                kind, tv_ticker = key.split("|", 1)
+                ttl = FX_CACHE_TTL_SECONDS if kind == "F" else CACHE_TTL_SECONDS
+
                 item = _price_cache.get(key)
                 near_exp = (not item) or (item["exp"] - _now() < ttl * 0.3)
                 if not near_exp:
                     continue
 
-                kind, tv_ticker = key.split("|", 1)
-
                 # ทำให้ FX รีช้ากว่า underlying ตาม FX_REFRESH_MULT
                 if kind == "F" and FX_REFRESH_MULT > 1:
                     if tick % FX_REFRESH_MULT != 0:
                         continue
 
-                v = await tv_scan_close(tv_ticker)
-                ttl = FX_CACHE_TTL_SECONDS if kind == "F" else CACHE_TTL_SECONDS
-                cache_set(key, v, ttl=ttl)
+                due.append((key, tv_ticker, ttl))
+
+            # ✅ ยิงพร้อมกัน → เข้า micro-batch เดียวกัน (1 scan request)
+            prices = await asyncio.gather(*(tv_scan_close(t) for _, t, _ in due), return_exceptions=True)
+            for (key, _, ttl), v in zip(due, prices):
+                if not isinstance(v, BaseException):
+                    cache_set(key, v, ttl=ttl)
+
+            # ✅ ตาราง fair value ทั้ง universe (/api/calc/all)
+            await refresh_valuation_table()
 
         except asyncio.CancelledError:
             raise
@@ -694,10 +932,11 @@ async def shutdown_service():
     global _tv_client, _idea_client, _refresher_task
     print("[CalcAPI] Shutting down services...")
     
-    if _refresher_task:
-        _refresher_task.cancel()
-        with suppress(asyncio.CancelledError):
-            await _refresher_task
+    for task in (_refresher_task, _scan_batch_task):
+        if task:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
     
     if _cache_dirty:
         await save_cache_to_file()
@@ -723,33 +962,21 @@ app.router.lifespan_context = lifespan
 async def calculate_dr(dr_symbol: str):
     """
     - ดึง DR list จาก ideatrade (snapshot)
-    - เลือก row ให้ถูก
-    - map เป็น tv symbol + currency (มี map ช่วย)
+    - เลือก row ให้ถูก + map เป็น tv symbol + currency (precomputed ใน dr_index)
     - ดึง underlying + fx ผ่าน cache (เร็ว)
     """
     try:
         assert _idea_client is not None
 
 
-        rows = []
-        if os.path.exists(DR_LIST_FILE):
-             with open(DR_LIST_FILE, "r", encoding="utf-8") as f:
-                 rows = json.load(f).get("rows", [])
-        else:
-             # Fallback (may fail if offline)
-             r = await _idea_client.get(f"{IDEATRADE_BASE}/caldr")
-             r.raise_for_status()
-             rows = r.json().get("rows", [])
+        # DR list จาก shared universe (local file by mtime / ideatrade by ETag) ไม่ต้อง parse ทุก request
+        rows = (await dr_universe.refresh(_idea_client))["rows"]
         
         if not rows:
             raise HTTPException(404, "DR list is empty")
 
-        # ✅ build map จาก ideatrade rows ก่อน
-        underlying_tv_map = build_underlying_tv_map(rows)
-
-        dr = pick_dr_row(rows, dr_symbol)
-
-        tv_symbol, currency = map_to_tv_symbol_and_currency(dr, underlying_tv_map)
+        # ✅ row + tv symbol + currency จาก index (สร้างครั้งเดียวต่อ version ของ DR list)
+        dr, tv_symbol, currency = lookup_dr(dr_symbol)
 
         fx_pair = FX_PAIR_MAP.get(currency)
         if not fx_pair:
@@ -825,6 +1052,23 @@ async def calculate_dr(dr_symbol: str):
         print("CALC_CRASH", "dr_symbol=", dr_symbol, "err=", type(e).__name__, str(e))
         raise HTTPException(500, f"Unhandled error: {type(e).__name__}")
 
+@app.get("/api/calc/all")
+async def calculate_all():
+    """
+    Fair value / premium-discount ของทุก DR ในครั้งเดียว
+    อ่านจากตารางที่ refresher คำนวณไว้ (คำนวณใหม่เฉพาะตอนยังไม่มีหรือเก่าเกิน 2 รอบ)
+    last / bid / offer มาจาก feed สด ณ quotes_fetched_at (quotes_stale=True ถ้า feed ล่มแล้วใช้ชุดก่อนหน้า)
+    """
+    table = _valuation_table
+    if table["body"] is None or _now() - table["computed_at"] > REFRESH_INTERVAL_SECONDS * 2:
+        try:
+            table = await refresh_valuation_table()
+        except Exception as e:
+            print("CALC_ALL_ERROR", type(e).__name__, str(e))
+            if table["body"] is None:
+                raise HTTPException(502, f"Valuation table unavailable: {type(e).__name__}")
+    return Response(content=table["body"], media_type="application/json")
+
 @app.get("/api/caldr")
 async def calculate_dr(date: Optional[str] = None,
                        number_date: Optional[int] = None):
@@ -0,0 +1,494 @@
+"""
+DR Universe - shared in-memory DR list
+
+Loads the DR list once per process and keeps precomputed indexes that every API module
+(ratings, earnings, calculation, history scripts) queries instead of loading and parsing
+the list itself.
+
+Source:
+- the upstream caldr URL (DR_UNIVERSE_URL), revalidated with ETag / If-None-Match every
+  REMOTE_TTL_SECONDS by `await refresh()`; the committed `dr_list.json` is only a fallback
+  until the first successful fetch (or while upstream is down and nothing was fetched yet), or
+- only the local `dr_list.json` (reloaded when its mtime changes) with DR_UNIVERSE_LOCAL_FILE=1
+  (offline / dev).
+
+Indexes (rebuilt on every reload, `version` increments):
+- by_symbol:        DR symbol (upper) -> row
+- by_underlying:    underlying code -> [rows]
+- underlying_items: one fetch item per underlying {u_code, u_name, u_exch, dr_sym, market, tv_symbol}
+- market_items:     market code -> [fetch items] (deduped per market, same rule as fetch_market_history)
+"""
+import os
+import re
+import json
+import time
+import httpx
+
+DR_LIST_FILE = os.path.join(os.path.dirname(__file__), "dr_list.json")
+# Upstream list (not DR_LIST_URL: that one points back at our own /caldr proxy)
+DR_UNIVERSE_URL = os.getenv("DR_UNIVERSE_URL") or "https://api.ideatrade1.com/caldr"
+# 1 = serve dr_list.json only (never fetch upstream)
+LOCAL_FILE_ONLY = (os.getenv("DR_UNIVERSE_LOCAL_FILE") or "").lower() in ("1", "true", "yes")
+# How often the local file mtime is checked / the remote list is revalidated
+MTIME_CHECK_SECONDS = float(os.getenv("DR_UNIVERSE_MTIME_CHECK_SECONDS") or "5")
+REMOTE_TTL_SECONDS = float(os.getenv("DR_UNIVERSE_REMOTE_TTL_SECONDS") or "300")
+
+_EMPTY = {
+    "version": 0,
+    "source": None,
+    "loaded_at": 0.0,
+    "payload": {"count": 0, "rows": []},
+    "rows": [],
+    "by_symbol": {},
+    "by_underlying": {},
+    "underlying_items": [],
+    "market_items": {},
+    "exchanges": set(),
+}
+
+_snapshot = _EMPTY
+_file_mtime = None
+_last_mtime_check = 0.0
+_remote_etag = None
+_last_remote_check = 0.0
+_derived_cache = {}  # (name, version) -> value, for lazily built views (earnings whitelist etc.)
+
+
+# ---------- Symbol / market helpers ----------
+
+def construct_tv_symbol(ticker: str, name: str, exchange: str, dr_symbol: str):
+    ticker = ticker.strip().upper()
+    exchange = " ".join(exchange.upper().split()) if exchange else ""
+    name = name.strip() if name else ""
+    dr_symbol = dr_symbol.strip().upper() if dr_symbol else ""
+
+    real_ticker = ticker
+    # If ticker looks like numeric with an exchange suffix (e.g. 3692.HK, 3692-HK, 3692:HKEX),
+    # strip the suffix so TradingView receives just the numeric code (e.g. 3692).
+    m_num_suffix = re.match(r'^([0-9]+)[\.\:\-].*$', real_ticker)
+    if m_num_suffix:
+        real_ticker = m_num_suffix.group(1)
+
+    match = re.search(r'\(([A-Z0-9.\-_]+)\)$', name)
+    if match:
+        matched = match.group(1)
+        # If matched begins with digits (numeric HK/TW style), strip suffix like '.HK' -> '3692'
+        if re.match(r'^\d+', matched):
+            real_ticker = re.sub(r'[\.\:\-].*$', '', matched)
+        else:
+            # Preserve non-numeric tickers including class suffixes (e.g. 'BRK.B' or 'NOVO-B')
+            real_ticker = matched
+    else:
+        if dr_symbol:
+            # Normalize dr_symbol by removing common suffixes (.HK, -HK, :HKEX)
+            dr_clean = re.sub(r'[\.\:\-].*$', '', dr_symbol).strip()
+            if len(dr_clean) >= 1:
+                real_ticker = dr_clean
+
+    if any(k in exchange for k in ("MILAN", "MIL")): return f"MIL:{real_ticker}"
+    if any(k in exchange for k in ("COPENHAGEN", "OMX")): return f"OMXCOP:{real_ticker.replace('-', '_')}"
+    if any(k in exchange for k in ("EURONEXT", "PARIS", "AMSTERDAM", "BRUSSELS", "FRANCE", "NETHERLANDS")): return f"EURONEXT:{real_ticker}"
+    if any(k in exchange for k in ("SHANGHAI", "SSE", "SHANGHAI STOCK EXCHANGE")): return f"SSE:{real_ticker}"
+    if any(k in exchange for k in ("SHENZHEN", "SZSE")): return f"SZSE:{real_ticker}"
+    if any(k in exchange for k in ("HONG", "HK", "HKEX")): return f"HKEX:{real_ticker}"
+    if any(k in exchange for k in ("VIET", "HOCHIMINH", "HOSE", "HNX")): return f"HOSE:{real_ticker}"
+    if any(k in exchange for k in ("TOKYO", "JAPAN", "TSE", "JP")): return f"TSE:{real_ticker}"
+    if any(k in exchange for k in ("SINGAPORE", "SGX", "SG")): return f"SGX:{real_ticker}"
+    if any(k in exchange for k in ("TAIWAN", "TWSE", "TW")): return f"TWSE:{real_ticker}"
+    if "NASDAQ" in exchange: return f"NASDAQ:{real_ticker}"
+    if any(k in exchange for k in ("NEW YORK", "NYSE", "NY")):
+        if any(sub_k in exchange for sub_k in ("ARCHIPELAGO", "ARCA", "AMEX")): return f"AMEX:{real_ticker}"
+        return f"NYSE:{real_ticker}"
+    if re.match(r'^\d+$', real_ticker): return f"HKEX:{real_ticker}"
+    return f"NASDAQ:{real_ticker}"
+
+
+def market_code_from_exchange(exchange: str) -> str:
+    """
+    Map exchange/market description from DR API to high-level market code
+    used in MARKET_CLOSE_CONFIG.
+    """
+    if not exchange:
+        return "US"
+
+    ex = exchange.upper()
+
+    # ใช้การ map แบบเดียวกับ frontend (DRList.jsx) - ตรวจสอบแบบเต็มก่อน
+    ex_lower = ex.lower()
+
+    # Europe - ตรวจสอบแบบเต็มตาม frontend
+    if "euronext amsterdam" in ex_lower:
+        return "NL"
+    if "euronext milan" in ex_lower:
+        return "IT"
+    if "euronext paris" in ex_lower:
+        return "FR"
+    if "nasdaq copenhagen" in ex_lower:
+        return "DK"
+
+    if ("ho chi minh" in ex_lower or "hochiminh" in ex_lower or
+        "hanoi" in ex_lower or "hnx" in ex_lower):
+        return "VN"
+
+    if "shenzhen" in ex_lower or "shanghai" in ex_lower:
+        return "CN"
+
+    if "singapore exchange" in ex_lower or "sgx" in ex_lower:
+        return "SG"
+
+    if "taiwan stock exchange" in ex_lower:
+        return "TW"
+
+    if "stock exchange of hong kong" in ex_lower or "hkex" in ex_lower:
+        return "HK"
+
+    if "tokyo stock exchange" in ex_lower:
+        return "JP"
+
+    if ("nasdaq global select market" in ex_lower or
+        "nasdaq stock market" in ex_lower or
+        "new york stock exchange archipelago" in ex_lower or  # ตรวจสอบ Archipelago ก่อน (เพราะมี "new york stock exchange" อยู่ด้วย)
+        "new york stock exchange" in ex_lower or
+        "nyse" in ex_lower or
+        "nasdaq" in ex_lower):
+        return "US"
+
+    # Fallback: ตรวจสอบแบบย่อสำหรับกรณีที่ไม่ได้ระบุแบบเต็ม
+    if any(k in ex for k in ("COPENHAGEN", "DENMARK", "OMXCOP", "DK")):
+        return "DK"
+    if any(k in ex for k in ("AMSTERDAM", "NETHERLANDS")):
+        return "NL"
+    if any(k in ex for k in ("PARIS", "FRANCE")):
+        return "FR"
+    if any(k in ex for k in ("MILAN", "ITALY", "BORSA ITALIANA")):
+        return "IT"
+    if any(k in ex for k in ("VIET", "VIETNAM", "HOCHIMINH", "HOSE", "HNX", "VN")):
+        return "VN"
+    if any(k in ex for k in ("SHANGHAI", "SSE", "SZSE", "SHENZHEN", "CHINA", "CN")):
+        return "CN"
+    if any(k in ex for k in ("SINGAPORE", "SGX", "SG")):
+        return "SG"
+    if any(k in ex for k in ("TAIWAN", "TWSE", "TW")):
+        return "TW"
+    if any(k in ex for k in ("HONG", "HKEX", "HONG KONG", "HK")):
+        return "HK"
+    if any(k in ex for k in ("TOKYO", "JAPAN", "TSE", "JP")):
+        return "JP"
+    if any(k in ex for k in ("NASDAQ", "NYSE", "NEW YORK", "AMEX", "ARCHIPELAGO", "ARCA")):
+        return "US"
+    # Note: ไม่มี TH (Thailand) เพราะระบบไม่มีหุ้นไทย
+
+    # Default: treat as US if ไม่แมตช์
+    return "US"
+
+
+def underlying_code(row: dict) -> str:
+    """Canonical underlying code (the `ticker` key of every rating table)."""
+    u_code = row.get("underlying") or (row.get("symbol") or "").replace("80", "").replace("19", "")
+    return u_code.strip().upper() if u_code else ""
+
+
+# Exchange keywords used to pick one DR row per underlying inside a market
+_MARKET_EXCHANGE_KEYWORDS = {
+    "HK": ["HONG", "HK", "HKEX", "SEHK"],
+    "US": ["NASDAQ", "NYSE", "AMEX"],
+    "NL": ["EURONEXT", "AMSTERDAM", "MILAN", "PARIS", "COPENHAGEN"],
+    "FR": ["EURONEXT", "AMSTERDAM", "MILAN", "PARIS", "COPENHAGEN"],
+    "IT": ["EURONEXT", "AMSTERDAM", "MILAN", "PARIS", "COPENHAGEN"],
+    "DK": ["EURONEXT", "AMSTERDAM", "MILAN", "PARIS", "COPENHAGEN"],
+    "JP": ["TSE", "TYO", "TOKYO"],
+    "SG": ["SGX", "SINGAPORE"],
+    "CN": ["SSE", "SHANGHAI", "SZSE", "SHENZHEN"],
+}
+
+
+def _pick_market_item(market_code: str, candidates: list) -> dict:
+    # Prefer item that has a DR symbol, then an exchange keyword match, then first occurrence
+    for it in candidates:
+        if it.get("dr_sym"):
+            return it
+    for kw in _MARKET_EXCHANGE_KEYWORDS.get(market_code, []):
+        found = next((it for it in candidates if kw in (it.get("u_exch") or "").upper()), None)
+        if found:
+            return found
+    return candidates[0]
+
+
+# ---------- Build / load ----------
+
+def _build_snapshot(payload: dict, source: str, version: int) -> dict:
+    rows = payload.get("rows", []) if isinstance(payload, dict) else []
+
+    by_symbol = {}
+    by_underlying = {}
+    underlying_map = {}
+    per_market = {}
+    exchanges = set()
+
+    for row in rows:
+        sym = (row.get("symbol") or "").strip().upper()
+        if sym and sym not in by_symbol:
+            by_symbol[sym] = row
+
+        u_code = underlying_code(row)
+        if not u_code:
+            continue
+        by_underlying.setdefault(u_code, []).append(row)
+
+        exchange = row.get("underlyingExchange", "") or ""
+        if exchange:
+            exchanges.add(exchange)
+        market = market_code_from_exchange(exchange)
+        item = {
+            "u_code": u_code,
+            "u_name": row.get("underlyingName", ""),
+            "u_exch": exchange,
+            "dr_sym": row.get("symbol", ""),
+            "market": market,
+        }
+        # One item per underlying: first row, replaced only if it had no exchange and this one does
+        if u_code not in underlying_map or (not underlying_map[u_code]["u_exch"] and exchange):
+            underlying_map[u_code] = item
+        per_market.setdefault(market, {}).setdefault(u_code, []).append(item)
+
+    for item in underlying_map.values():
+        item["tv_symbol"] = construct_tv_symbol(item["u_code"], item["u_name"], item["u_exch"], item["dr_sym"])
+
+    market_items = {}
+    for market, grouped in per_market.items():
+        lst = []
+        for code, candidates in grouped.items():
+            it = dict(_pick_market_item(market, candidates))
+            it["tv_symbol"] = construct_tv_symbol(it["u_code"], it["u_name"], it["u_exch"], it["dr_sym"])
+            lst.append(it)
+        market_items[market] = lst
+
+    return {
+        "version": version,
+        "source": source,
+        "loaded_at": time.time(),
+        "payload": payload,
+        "rows": rows,
+        "by_symbol": by_symbol,
+        "by_underlying": by_underlying,
+        "underlying_items": list(underlying_map.values()),
+        "market_items": market_items,
+        "exchanges": exchanges,
+    }
+
+
+def _install(payload: dict, source: str):
+    global _snapshot
+    _snapshot = _build_snapshot(payload, source, _snapshot["version"] + 1)
+    print(f"[DRUniverse] Loaded {len(_snapshot['rows'])} DR rows from {source} (version {_snapshot['version']})")
+
+
+def _check_local_file():
+    """Reload from dr_list.json if its mtime changed. Returns True if a local file exists."""
+    global _file_mtime, _last_mtime_check
+    now = time.time()
+    if _snapshot["version"] and now - _last_mtime_check < MTIME_CHECK_SECONDS and _file_mtime is not None:
+        return True
+    _last_mtime_check = now
+    try:
+        mtime = os.path.getmtime(DR_LIST_FILE)
+    except OSError:
+        return False
+    if mtime != _file_mtime:
+        try:
+            with open(DR_LIST_FILE, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+            _file_mtime = mtime
+            _install(payload, f"file:{os.path.basename(DR_LIST_FILE)}")
+        except Exception as e:
+            # keep serving the previous snapshot if the file is mid-write / broken
+            print(f"[DRUniverse] Failed to load {DR_LIST_FILE}: {e}")
+    return True
+
+
+def _serving_local() -> bool:
+    """True while the snapshot should follow dr_list.json (local mode, or no upstream list loaded yet)."""
+    return LOCAL_FILE_ONLY or not _snapshot["version"] or (_snapshot["source"] or "").startswith("file:")
+
+
+def get_snapshot() -> dict:
+    """Current snapshot (sync). Upstream revalidation needs `await refresh()`; until then the local file is used."""
+    if _serving_local():
+        _check_local_file()
+    return _snapshot
+
+
+async def refresh(client: httpx.AsyncClient = None, force: bool = False) -> dict:
+    """Ensure the snapshot is current: the upstream URL by ETag (local file as fallback / with DR_UNIVERSE_LOCAL_FILE)."""
+    global _remote_etag, _last_remote_check
+    if LOCAL_FILE_ONLY:
+        _check_local_file()
+        return _snapshot
+
+    now = time.time()
+    if not force and _snapshot["version"] and now - _last_remote_check < REMOTE_TTL_SECONDS:
+        return _snapshot
+    _last_remote_check = now
+
+    from_remote = _snapshot["version"] and not _serving_local()
+    headers = {"If-None-Match": _remote_etag} if _remote_etag and from_remote else {}
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient()
+    try:
+        r = await client.get(DR_UNIVERSE_URL, headers=headers, timeout=20)
+        if r.status_code == 304:
+            return _snapshot
+        r.raise_for_status()
+        payload = r.json()
+        if not isinstance(payload, dict) or not isinstance(payload.get("rows"), list):
+            raise ValueError("unexpected DR list payload")
+        _remote_etag = r.headers.get("ETag")
+        _install(payload, DR_UNIVERSE_URL)
+    except Exception as e:
+        print(f"[DRUniverse] Could not refresh DR list from {DR_UNIVERSE_URL}: {e}")
+        if not from_remote:
+            # ยังไม่เคยโหลดจาก upstream ได้ -> ใช้ dr_list.json ไปก่อน (ลองใหม่หลัง REMOTE_TTL_SECONDS)
+            _check_local_file()
+    finally:
+        if own_client:
+            await client.aclose()
+    return _snapshot
+
+
+# ---------- Queries ----------
+
+def version() -> int:
+    return get_snapshot()["version"]
+
+
+def rows() -> list:
+    return get_snapshot()["rows"]
+
+
+def get_by_symbol(symbol: str):
+    return get_snapshot()["by_symbol"].get((symbol or "").strip().upper())
+
+
+def rows_for_underlying(code: str) -> list:
+    return get_snapshot()["by_underlying"].get((code or "").strip().upper(), [])
+
+
+def underlying_items() -> list:
+    """One fetch item per underlying (background ratings updater)."""
+    return get_snapshot()["underlying_items"]
+
+
+def market_items(market_code: str) -> list:
+    """Fetch items for one market, deduped per underlying (history snapshots)."""
+    return get_snapshot()["market_items"].get(market_code, [])
+
+
+def derived(name: str, builder):
+    """
+    Memoize a view derived from the current snapshot (rebuilt once per version).
+    `builder(snapshot)` must not mutate the snapshot.
+    """
+    snap = get_snapshot()
+    key = (name, snap["version"])
+    if key not in _derived_cache:
+        for k in [k for k in _derived_cache if k[0] == name]:
+            _derived_cache.pop(k, None)
+        _derived_cache[key] = builder(snap)
+    return _derived_cache[key]
+
+
+# ---------- Earnings whitelist ----------
+
+def _earnings_code(item: dict):
+    """
+    Ticker code used to match TradingView earnings rows. Returns (code, source) or (None, skip_reason).
+    Priority: "(TICKER)" in underlyingName -> underlying -> symbol without 80/19, with cleanup of
+    full names (ETF/FUND suffix, trailing digits of the DR symbol).
+    """
+    underlying_name = item.get("underlyingName") or ""
+    match = re.search(r'\(([A-Z0-9.\-_]+)\)$', underlying_name)
+    if match:
+        u_code, source = match.group(1), "underlyingName"
+    else:
+        u_code = item.get("underlying")
+        source = "underlying"
+        if not u_code:
+            sym = item.get("symbol") or ""
+            if "80" in sym:
+                u_code, source = sym.replace("80", ""), "symbol(80)"
+            elif "19" in sym:
+                u_code, source = sym.replace("19", ""), "symbol(19)"
+    if not u_code:
+        return None, None
+
+    u_code = u_code.strip().upper()
+    if not u_code:
+        return None, None
+
+    if ' ' in u_code:
+        # ถ้ามี space แสดงว่าเป็นชื่อเต็ม ให้ลอง extract ticker จากหลายวิธี
+        resolved = None
+        name_match_alt = re.search(r'\(([A-Z0-9.\-_]+)\)', underlying_name.upper())
+        if name_match_alt:
+            alt_ticker = name_match_alt.group(1).strip()
+            if alt_ticker and ' ' not in alt_ticker and len(alt_ticker) <= 15:
+                resolved = (alt_ticker, "underlyingName(alt)")
+        if resolved is None:
+            u_code_clean = re.sub(r'\s+(ETF|DIAMOND ETF|FUND|TRUST).*$', '', u_code, flags=re.IGNORECASE).strip()
+            if u_code_clean and ' ' not in u_code_clean and len(u_code_clean) <= 15:
+                resolved = (u_code_clean, "underlying(clean)")
+        if resolved is None:
+            sym = item.get("symbol") or ""
+            sym_clean = re.sub(r'\d+$', '', sym).strip() if sym else ""
+            if sym_clean and 2 <= len(sym_clean) <= 15:
+                resolved = (sym_clean.upper(), "symbol(clean)")
+        if resolved is None:
+            return None, "has_space"
+        u_code, source = resolved
+
+    if len(u_code) > 15:
+        return None, "too_long"
+    return u_code, source
+
+
+def _build_earnings_whitelist(snap: dict) -> dict:
+    valid = set()
+    mapping = {}
+    skipped = {}
+    skipped_items = []
+    for item in snap["rows"]:
+        u_code, reason = _earnings_code(item)
+        if not u_code:
+            if reason:
+                skipped[reason] = skipped.get(reason, 0) + 1
+                skipped_items.append({
+                    'symbol': item.get('symbol', 'N/A'),
+                    'underlyingName': (item.get("underlyingName") or "")[:50],
+                    'reason': reason,
+                })
+            continue
+        valid.add(u_code)
+        mapping[u_code] = u_code
+
+        # alias จาก symbol (เช่น "JPM80" -> "JPM")
+        sym_clean = (item.get("symbol") or "").strip().upper()
+        if sym_clean and sym_clean != u_code:
+            sym_no_suffix = sym_clean.replace("80", "").replace("19", "").strip()
+            if sym_no_suffix and sym_no_suffix != u_code and len(sym_no_suffix) <= 15 and ' ' not in sym_no_suffix:
+                mapping[sym_no_suffix] = u_code
+
+        # alias จาก underlyingName เช่น "บริษัท JP MORGAN CHASE & CO. (JPM)" -> "JPM"
+        underlying_name = item.get("underlyingName") or ""
+        if underlying_name:
+            name_match = re.search(r'\(([A-Z0-9.\-_]+)\)', underlying_name.upper())
+            if name_match:
+                name_ticker = name_match.group(1).strip()
+                if name_ticker and name_ticker != u_code and len(name_ticker) <= 15 and ' ' not in name_ticker:
+                    mapping[name_ticker] = u_code
+    return {"valid_tickers": valid, "ticker_mapping": mapping, "skipped": skipped, "skipped_items": skipped_items}
+
+
+def earnings_whitelist() -> dict:
+    """{valid_tickers: set, ticker_mapping: {tv_ticker: code}, skipped: {reason: count}, skipped_items: [...]}"""
+    return derived("earnings_whitelist", _build_earnings_whitelist)
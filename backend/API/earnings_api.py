@@ -14,6 +14,8 @@ from dotenv import load_dotenv
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
 
+import dr_universe
+
 # Silence prints from this module by default. Set ENABLE_EARNINGS_LOGS=1 in env to enable.
 try:
     ENABLE_EARNINGS_LOGS = os.getenv("ENABLE_EARNINGS_LOGS", "0") == "1"
@@ -27,8 +29,7 @@ if not ENABLE_EARNINGS_LOGS:
 
 # ================= CONFIG =================
 TRADINGVIEW_SCAN_URL = os.getenv("TRADINGVIEW_SCAN_URL") or "https://scanner.tradingview.com/{market}/scan?label-product=screener-stock-old"
-# ✅ เพิ่ม DR_LIST_URL เพื่อใช้ดึงรายชื่อหุ้นที่มี DR
-DR_LIST_URL = "https://api.ideatrade1.com/caldr"
+# รายชื่อหุ้นที่มี DR มาจาก dr_universe (โหลดครั้งเดียว ใช้ร่วมกันทุก API)
 # ✅ เพิ่มการตั้งค่าเปิด-ปิดฟิลเตอร์ DR (True = กรองเฉพาะหุ้นที่มี DR, False = เอาหุ้นทั้งหมด)
 ENABLE_DR_FILTER = os.getenv("ENABLE_DR_FILTER", "True").lower() == "true"
 CACHE_FILE = "earnings_cache.json"
@@ -359,192 +360,21 @@ async def background_updater():
             valid_dr_tickers = None
             ticker_mapping = {}  # Mapping table: {ticker_from_tv: underlying_code}
             if ENABLE_DR_FILTER:
-                valid_dr_tickers = set()
-                skipped_count = 0
-                skipped_reasons = {}
-                skipped_items = []  # เก็บรายการที่ถูก skip เพื่อ debug
                 try:
-                    async with httpx.AsyncClient() as client:
-                        r_dr = await client.get(DR_LIST_URL, timeout=10)
-                        dr_rows = r_dr.json().get("rows", [])
-                        print(f"  [Background] Total DR rows from API: {len(dr_rows)}")
-                        for item in dr_rows:
-                            u_code = None
-                            source = None
-                            
-                            # ✅ ลำดับความสำคัญ: 1) extract จาก underlyingName ที่มี format "(TICKER)" ก่อน
-                            underlying_name = item.get("underlyingName") or ""
-                            match = re.search(r'\(([A-Z0-9.\-_]+)\)$', underlying_name)
-                            if match:
-                                u_code = match.group(1)
-                                source = "underlyingName"
-                            else:
-                                # 2) ใช้ underlying field (ถ้ามี)
-                                u_code = item.get("underlying")
-                                if u_code:
-                                    source = "underlying"
-                                else:
-                                    # 3) extract จาก symbol (เช่น "JPM80" -> "JPM")
-                                    sym = item.get("symbol") or ""
-                                    if "80" in sym: 
-                                        u_code = sym.replace("80", "")
-                                        source = "symbol(80)"
-                                    elif "19" in sym: 
-                                        u_code = sym.replace("19", "")
-                                        source = "symbol(19)"
-                            
-                            if u_code:
-                                u_code = u_code.strip().upper()
-                                # ✅ กรองเฉพาะ ticker symbol (ไม่ใช่ชื่อเต็มที่มี space หลายตัว)
-                                # เช่น "JPM", "BAC", "CNSEMI" ผ่าน แต่ "CNSEMI ETF" ไม่ผ่าน
-                                # อนุญาตให้มี dash/underscore/dot ได้ (เช่น "A-B", "A_B", "A.B")
-                                if u_code and len(u_code) > 0:
-                                    # ถ้ามี space แสดงว่าเป็นชื่อเต็ม ให้ลอง extract ticker จากหลายวิธี
-                                    if ' ' in u_code:
-                                        # วิธี 1: ลอง extract ticker จาก underlyingName อีกครั้ง (อาจมี format อื่น)
-                                        name_match_alt = re.search(r'\(([A-Z0-9.\-_]+)\)', underlying_name.upper())
-                                        if name_match_alt:
-                                            alt_ticker = name_match_alt.group(1).strip()
-                                            if alt_ticker and ' ' not in alt_ticker and len(alt_ticker) <= 15:
-                                                u_code = alt_ticker
-                                                source = "underlyingName(alt)"
-                                            else:
-                                                # วิธี 2: ลอง extract ticker จาก underlying โดยลบคำว่า "ETF", "DIAMOND ETF" ฯลฯ
-                                                u_code_clean = re.sub(r'\s+(ETF|DIAMOND ETF|FUND|TRUST).*$', '', u_code, flags=re.IGNORECASE).strip()
-                                                if u_code_clean and ' ' not in u_code_clean and len(u_code_clean) <= 15:
-                                                    u_code = u_code_clean
-                                                    source = "underlying(clean)"
-                                                else:
-                                                    # วิธี 3: ลองใช้ symbol โดยลบ suffix (เช่น "E1VFVN3001" -> "E1VFVN30", "FUEVFVND01" -> "FUEVFVND")
-                                                    sym = item.get("symbol") or ""
-                                                    if sym:
-                                                        # ลบ suffix ตัวเลขท้าย (เช่น "01", "24", "3001")
-                                                        sym_clean = re.sub(r'\d+$', '', sym).strip()
-                                                        if sym_clean and len(sym_clean) >= 2 and len(sym_clean) <= 15:
-                                                            u_code = sym_clean.upper()
-                                                            source = "symbol(clean)"
-                                                        else:
-                                                            skipped_count += 1
-                                                            skipped_reasons['has_space'] = skipped_reasons.get('has_space', 0) + 1
-                                                            skipped_items.append({
-                                                                'symbol': item.get('symbol', 'N/A'),
-                                                                'underlyingName': underlying_name[:50],
-                                                                'u_code': u_code,
-                                                                'reason': 'has_space'
-                                                            })
-                                                            continue
-                                                    else:
-                                                        skipped_count += 1
-                                                        skipped_reasons['has_space'] = skipped_reasons.get('has_space', 0) + 1
-                                                        skipped_items.append({
-                                                            'symbol': item.get('symbol', 'N/A'),
-                                                            'underlyingName': underlying_name[:50],
-                                                            'u_code': u_code,
-                                                            'reason': 'has_space'
-                                                        })
-                                                        continue
-                                        else:
-                                            # วิธี 2: ลอง extract ticker จาก underlying โดยลบคำว่า "ETF", "DIAMOND ETF" ฯลฯ
-                                            u_code_clean = re.sub(r'\s+(ETF|DIAMOND ETF|FUND|TRUST).*$', '', u_code, flags=re.IGNORECASE).strip()
-                                            if u_code_clean and ' ' not in u_code_clean and len(u_code_clean) <= 15:
-                                                u_code = u_code_clean
-                                                source = "underlying(clean)"
-                                            else:
-                                                # วิธี 3: ลองใช้ symbol โดยลบ suffix (เช่น "E1VFVN3001" -> "E1VFVN30", "FUEVFVND01" -> "FUEVFVND")
-                                                sym = item.get("symbol") or ""
-                                                if sym:
-                                                    # ลบ suffix ตัวเลขท้าย (เช่น "01", "24", "3001")
-                                                    sym_clean = re.sub(r'\d+$', '', sym).strip()
-                                                    if sym_clean and len(sym_clean) >= 2 and len(sym_clean) <= 15:
-                                                        u_code = sym_clean.upper()
-                                                        source = "symbol(clean)"
-                                                    else:
-                                                        skipped_count += 1
-                                                        skipped_reasons['has_space'] = skipped_reasons.get('has_space', 0) + 1
-                                                        skipped_items.append({
-                                                            'symbol': item.get('symbol', 'N/A'),
-                                                            'underlyingName': underlying_name[:50],
-                                                            'u_code': u_code,
-                                                            'reason': 'has_space'
-                                                        })
-                                                        continue
-                                                else:
-                                                    skipped_count += 1
-                                                    skipped_reasons['has_space'] = skipped_reasons.get('has_space', 0) + 1
-                                                    skipped_items.append({
-                                                        'symbol': item.get('symbol', 'N/A'),
-                                                        'underlyingName': underlying_name[:50],
-                                                        'u_code': u_code,
-                                                        'reason': 'has_space'
-                                                    })
-                                                    continue
-                                    # ถ้ายาวเกิน 15 ตัวอักษร อาจเป็นชื่อเต็ม ให้ข้าม
-                                    if len(u_code) > 15:
-                                        skipped_count += 1
-                                        skipped_reasons['too_long'] = skipped_reasons.get('too_long', 0) + 1
-                                        skipped_items.append({
-                                            'symbol': item.get('symbol', 'N/A'),
-                                            'underlyingName': underlying_name[:50],
-                                            'u_code': u_code,
-                                            'reason': 'too_long'
-                                        })
-                                        continue
-                                    valid_dr_tickers.add(u_code)
-                                    
-                                    # ✅ สร้าง mapping table: ใช้ underlying code เป็น key และ value
-                                    # และเพิ่ม alias จาก symbol (เช่น "JPM80" -> "JPM")
-                                    ticker_mapping[u_code] = u_code
-                                    
-                                    # เพิ่ม alias จาก symbol (ถ้า symbol ไม่ใช่ underlying code)
-                                    sym_clean = item.get("symbol", "").strip().upper()
-                                    if sym_clean and sym_clean != u_code:
-                                        # ลบ suffix "80", "19" จาก symbol
-                                        sym_no_suffix = sym_clean.replace("80", "").replace("19", "").strip()
-                                        if sym_no_suffix and sym_no_suffix != u_code and len(sym_no_suffix) <= 15 and ' ' not in sym_no_suffix:
-                                            ticker_mapping[sym_no_suffix] = u_code
-                                    
-                                    # ✅ เพิ่ม alias จาก underlyingName (extract ticker จากชื่อบริษัท)
-                                    # เช่น "บริษัท JP MORGAN CHASE & CO. (JPM)" -> "JPM"
-                                    if underlying_name:
-                                        name_match = re.search(r'\(([A-Z0-9.\-_]+)\)', underlying_name.upper())
-                                        if name_match:
-                                            name_ticker = name_match.group(1).strip()
-                                            if name_ticker and name_ticker != u_code and len(name_ticker) <= 15 and ' ' not in name_ticker:
-                                                ticker_mapping[name_ticker] = u_code
-                                    
-                                    # Debug: แสดงตัวอย่างการ extract (เฉพาะ 10 ตัวแรก)
-                                    if len(valid_dr_tickers) <= 10:
-                                        print(f"    [OK] Extracted: {u_code} from {source} (symbol: {item.get('symbol', 'N/A')}, underlyingName: {underlying_name[:50]})")
-                    
-                    # Debug: แสดงจำนวนที่ถูก skip
+                    # Whitelist is precomputed once per DR list version by the shared DR universe
+                    await dr_universe.refresh()
+                    whitelist = dr_universe.earnings_whitelist()
+                    valid_dr_tickers = set(whitelist["valid_tickers"])
+                    ticker_mapping = dict(whitelist["ticker_mapping"])
+                    if not valid_dr_tickers:
+                        raise ValueError("DR list is empty")
+                    skipped_count = sum(whitelist["skipped"].values())
                     if skipped_count > 0:
-                        print(f"  [WARN] Skipped {skipped_count} items: {skipped_reasons}")
+                        print(f"  [WARN] Skipped {skipped_count} items: {whitelist['skipped']}")
                         # แสดงรายละเอียดของ items ที่ถูก skip (เฉพาะ 5 ตัวแรก)
-                        for skipped in skipped_items[:5]:
-                            print(f"    - Skipped: symbol='{skipped['symbol']}', u_code='{skipped['u_code']}', reason={skipped['reason']}, underlyingName='{skipped['underlyingName']}'")
-                    print(f"[Background] DR Filter is ENABLED. Found {len(valid_dr_tickers)} unique symbols (from {len(dr_rows)} DR rows, skipped {skipped_count}).")
-                    # Debug: ตรวจสอบว่ามี underlying codes ซ้ำกันหรือไม่
-                    if len(valid_dr_tickers) < len(dr_rows) - skipped_count:
-                        duplicate_count = len(dr_rows) - skipped_count - len(valid_dr_tickers)
-                        print(f"  [NOTE] Note: {duplicate_count} underlying codes are duplicates (multiple DR rows share the same underlying code)")
-                    # Debug: แสดง sample ของ underlying codes (เฉพาะ ticker symbols ไม่ใช่ชื่อเต็ม)
-                    # กรองเฉพาะ ticker symbols ที่ไม่มี space และไม่ยาวเกินไป
-                    clean_tickers = [c for c in valid_dr_tickers if ' ' not in c and len(c) <= 15]
-                    sample_codes = sorted(clean_tickers)[:10]
-                    print(f"  [SAMPLE] Sample ticker symbols: {sample_codes}")
-                    # Debug: แสดง ticker symbols ที่มี space (ชื่อเต็ม) เพื่อตรวจสอบ - ควรไม่มี
-                    full_names = [c for c in valid_dr_tickers if ' ' in c]
-                    if full_names:
-                        print(f"  [WARN] Found {len(full_names)} full names (should be filtered out): {full_names[:5]}")
-                    # Debug: ตรวจสอบว่ามี "JPM", "WFC", "BAC", "MS" อยู่ใน valid_dr_tickers หรือไม่
-                    test_tickers = ["JPM", "WFC", "BAC", "MS", "GS", "C"]
-                    found_test = [t for t in test_tickers if t in valid_dr_tickers]
-                    missing_test = [t for t in test_tickers if t not in valid_dr_tickers]
-                    if found_test:
-                        print(f"  [OK] Found test tickers in DR list: {found_test}")
-                    if missing_test:
-                        print(f"  [WARN] Missing test tickers in DR list: {missing_test}")
-                    # Debug: แสดง sample ของ ticker_mapping
+                        for skipped in whitelist["skipped_items"][:5]:
+                            print(f"    - Skipped: symbol='{skipped['symbol']}', reason={skipped['reason']}, underlyingName='{skipped['underlyingName']}'")
+                    print(f"[Background] DR Filter is ENABLED. Found {len(valid_dr_tickers)} unique symbols (skipped {skipped_count}).")
                     if ticker_mapping:
                         mapping_samples = list(ticker_mapping.items())[:10]
                         print(f"  [SAMPLE] Sample ticker mapping: {mapping_samples}")
@@ -767,140 +597,17 @@ async def force_refresh_earnings():
         valid_dr_tickers = None
         ticker_mapping = {}  # Mapping table: {ticker_from_tv: underlying_code}
         if ENABLE_DR_FILTER:
-            valid_dr_tickers = set()
-            skipped_count = 0
-            skipped_reasons = {}
-            skipped_items = []
             try:
-                async with httpx.AsyncClient() as client:
-                    r_dr = await client.get(DR_LIST_URL, timeout=10)
-                    dr_rows = r_dr.json().get("rows", [])
-                    print(f"  [DATA] [Manual Refresh] Total DR rows from API: {len(dr_rows)}")
-                    for item in dr_rows:
-                        u_code = None
-                        source = None
-                        
-                        underlying_name = item.get("underlyingName") or ""
-                        match = re.search(r'\(([A-Z0-9.\-_]+)\)$', underlying_name)
-                        if match:
-                            u_code = match.group(1)
-                            source = "underlyingName"
-                        else:
-                            u_code = item.get("underlying")
-                            if u_code:
-                                source = "underlying"
-                            else:
-                                sym = item.get("symbol") or ""
-                                if "80" in sym: 
-                                    u_code = sym.replace("80", "")
-                                    source = "symbol(80)"
-                                elif "19" in sym: 
-                                    u_code = sym.replace("19", "")
-                                    source = "symbol(19)"
-                        
-                        if u_code:
-                            u_code = u_code.strip().upper()
-                            if u_code and len(u_code) > 0:
-                                if ' ' in u_code:
-                                    name_match_alt = re.search(r'\(([A-Z0-9.\-_]+)\)', underlying_name.upper())
-                                    if name_match_alt:
-                                        alt_ticker = name_match_alt.group(1).strip()
-                                        if alt_ticker and ' ' not in alt_ticker and len(alt_ticker) <= 15:
-                                            u_code = alt_ticker
-                                            source = "underlyingName(alt)"
-                                        else:
-                                            u_code_clean = re.sub(r'\s+(ETF|DIAMOND ETF|FUND|TRUST).*$', '', u_code, flags=re.IGNORECASE).strip()
-                                            if u_code_clean and ' ' not in u_code_clean and len(u_code_clean) <= 15:
-                                                u_code = u_code_clean
-                                                source = "underlying(clean)"
-                                            else:
-                                                sym = item.get("symbol") or ""
-                                                if sym:
-                                                    sym_clean = re.sub(r'\d+$', '', sym).strip()
-                                                    if sym_clean and len(sym_clean) >= 2 and len(sym_clean) <= 15:
-                                                        u_code = sym_clean.upper()
-                                                        source = "symbol(clean)"
-                                                    else:
-                                                        skipped_count += 1
-                                                        skipped_reasons['has_space'] = skipped_reasons.get('has_space', 0) + 1
-                                                        skipped_items.append({
-                                                            'symbol': item.get('symbol', 'N/A'),
-                                                            'underlyingName': underlying_name[:50],
-                                                            'u_code': u_code,
-                                                            'reason': 'has_space'
-                                                        })
-                                                        continue
-                                                else:
-                                                    skipped_count += 1
-                                                    skipped_reasons['has_space'] = skipped_reasons.get('has_space', 0) + 1
-                                                    skipped_items.append({
-                                                        'symbol': item.get('symbol', 'N/A'),
-                                                        'underlyingName': underlying_name[:50],
-                                                        'u_code': u_code,
-                                                        'reason': 'has_space'
-                                                    })
-                                                    continue
-                                    else:
-                                        u_code_clean = re.sub(r'\s+(ETF|DIAMOND ETF|FUND|TRUST).*$', '', u_code, flags=re.IGNORECASE).strip()
-                                        if u_code_clean and ' ' not in u_code_clean and len(u_code_clean) <= 15:
-                                            u_code = u_code_clean
-                                            source = "underlying(clean)"
-                                        else:
-                                            sym = item.get("symbol") or ""
-                                            if sym:
-                                                sym_clean = re.sub(r'\d+$', '', sym).strip()
-                                                if sym_clean and len(sym_clean) >= 2 and len(sym_clean) <= 15:
-                                                    u_code = sym_clean.upper()
-                                                    source = "symbol(clean)"
-                                                else:
-                                                    skipped_count += 1
-                                                    skipped_reasons['has_space'] = skipped_reasons.get('has_space', 0) + 1
-                                                    skipped_items.append({
-                                                        'symbol': item.get('symbol', 'N/A'),
-                                                        'underlyingName': underlying_name[:50],
-                                                        'u_code': u_code,
-                                                        'reason': 'has_space'
-                                                    })
-                                                    continue
-                                            else:
-                                                skipped_count += 1
-                                                skipped_reasons['has_space'] = skipped_reasons.get('has_space', 0) + 1
-                                                skipped_items.append({
-                                                    'symbol': item.get('symbol', 'N/A'),
-                                                    'underlyingName': underlying_name[:50],
-                                                    'u_code': u_code,
-                                                    'reason': 'has_space'
-                                                })
-                                                continue
-                                if len(u_code) > 15:
-                                    skipped_count += 1
-                                    skipped_reasons['too_long'] = skipped_reasons.get('too_long', 0) + 1
-                                    skipped_items.append({
-                                        'symbol': item.get('symbol', 'N/A'),
-                                        'underlyingName': underlying_name[:50],
-                                        'u_code': u_code,
-                                        'reason': 'too_long'
-                                    })
-                                    continue
-                                valid_dr_tickers.add(u_code)
-                                ticker_mapping[u_code] = u_code
-                                
-                                sym_clean = item.get("symbol", "").strip().upper()
-                                if sym_clean and sym_clean != u_code:
-                                    sym_no_suffix = sym_clean.replace("80", "").replace("19", "").strip()
-                                    if sym_no_suffix and sym_no_suffix != u_code and len(sym_no_suffix) <= 15 and ' ' not in sym_no_suffix:
-                                        ticker_mapping[sym_no_suffix] = u_code
-                                
-                                if underlying_name:
-                                    name_match = re.search(r'\(([A-Z0-9.\-_]+)\)', underlying_name.upper())
-                                    if name_match:
-                                        name_ticker = name_match.group(1).strip()
-                                        if name_ticker and name_ticker != u_code and len(name_ticker) <= 15 and ' ' not in name_ticker:
-                                            ticker_mapping[name_ticker] = u_code
-                    
-                    if skipped_count > 0:
-                        print(f"  [WARN] Skipped {skipped_count} items: {skipped_reasons}")
-                    print(f"[DATA] [Manual Refresh] DR Filter is ENABLED. Found {len(valid_dr_tickers)} unique symbols.")
+                await dr_universe.refresh()
+                whitelist = dr_universe.earnings_whitelist()
+                valid_dr_tickers = set(whitelist["valid_tickers"])
+                ticker_mapping = dict(whitelist["ticker_mapping"])
+                if not valid_dr_tickers:
+                    raise ValueError("DR list is empty")
+                skipped_count = sum(whitelist["skipped"].values())
+                if skipped_count > 0:
+                    print(f"  [WARN] Skipped {skipped_count} items: {whitelist['skipped']}")
+                print(f"[DATA] [Manual Refresh] DR Filter is ENABLED. Found {len(valid_dr_tickers)} unique symbols.")
             except Exception as dr_err:
                 print(f"[ERROR] [Manual Refresh] Failed to fetch DR whitelist: {dr_err}")
                 valid_dr_tickers = None 
@@ -0,0 +1,540 @@
+"""
+History backfill engine
+
+Usage:
+    py history_backfill.py --markets US,HK --start 2026-02-02 --end 2026-02-06
+    py history_backfill.py --resume            # continue the last (crashed) run
+
+Rebuilds `rating_history` (one snapshot per market trading day, timestamped at the
+market-open time used by the live scheduler) and then recomputes `rating_accuracy`
+only for the windows touched by the inserted rows.
+
+- Past sessions are read from TradingView's bar-offset columns (`close[k]`,
+  `Recommend.All[k]`, ...); the current session uses the live columns.
+- Requests run concurrently behind an adaptive limiter: the limit is halved on 429
+  and grows back by one after a full round of successful requests.
+- Progress is written to a JSON checkpoint after every (market, day) slot, so a
+  crashed run resumes where it stopped. Failed tickers are retried on resume.
+- The same engine is exposed through POST /ratings/api/admin/backfill.
+
+Note: run this from `backend/API` folder so relative imports work.
+"""
+import os
+import json
+import time as time_mod
+import asyncio
+import argparse
+import sqlite3
+from datetime import datetime, date, timedelta, time
+from zoneinfo import ZoneInfo
+import httpx
+
+# Import helpers from main module
+import ratings_api_dynamic as rmod
+import dr_universe
+import accuracy_cube
+
+BKK_TZ = ZoneInfo("Asia/Bangkok")
+CHECKPOINT_FILE = os.getenv("BACKFILL_CHECKPOINT_FILE") or "backfill_checkpoint.json"
+BACKFILL_MAX_CONCURRENCY = int(os.getenv("BACKFILL_MAX_CONCURRENCY") or rmod.MAX_CONCURRENCY)
+ACCURACY_WINDOW_DAYS = 90
+
+# Columns requested per snapshot (past sessions add a bar offset, see _field_name)
+DAILY_FIELDS = ["Recommend.All", "close", "open", "high", "low"]
+WEEKLY_FIELDS = ["Recommend.All|1W"]
+
+# Progress of the current/last run (read by the admin status endpoint)
+_job_state = {
+    "running": False,
+    "markets": [],
+    "start": None,
+    "end": None,
+    "total_slots": 0,
+    "done_slots": 0,
+    "total_tickers": 0,
+    "processed_tickers": 0,
+    "inserted": 0,
+    "failed": 0,
+    "concurrency": 0,
+    "phase": "idle",
+    "started_at": None,
+    "finished_at": None,
+    "eta_seconds": None,
+    "error": None,
+}
+
+
+class AdaptiveLimiter:
+    """Concurrency limiter whose limit shrinks on rate limiting and slowly grows back."""
+
+    def __init__(self, max_limit: int, start_limit: int = None, min_limit: int = 1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min_limit)
+        self.limit = max(self.min_limit, min(self.max_limit, start_limit or self.max_limit))
+        self._active = 0
+        self._successes = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            while self._active >= self.limit:
+                await self._cond.wait()
+            self._active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def on_success(self):
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.max_limit:
+            self.limit += 1
+            self._successes = 0
+
+    def on_rate_limited(self):
+        self.limit = max(self.min_limit, self.limit // 2)
+        self._successes = 0
+
+
+# ---------- Calendar helpers ----------
+
+def _market_local_date(market_code: str, ts_thai: datetime) -> date:
+    tz_name = rmod.MARKET_TIMEZONE.get(market_code)
+    if not tz_name:
+        return ts_thai.date()
+    return ts_thai.astimezone(ZoneInfo(tz_name)).date()
+
+
+def snapshot_time_thai(market_code: str, day: date) -> datetime:
+    """Market-open snapshot time (Thai time) for a trading day, same rule as market_scheduler."""
+    cfg = rmod.MARKET_OPEN_CONFIG.get(market_code, rmod.MARKET_OPEN_CONFIG["US"])
+    ref = datetime.combine(day, time(12, 0), tzinfo=BKK_TZ)
+    if "winter" in cfg and "summer" in cfg:
+        open_time = cfg["summer"] if rmod.is_summer_time(ref) else cfg["winter"]
+    else:
+        open_time = cfg.get("winter") or cfg.get("summer") or time(3, 0)
+    return datetime.combine(day, open_time, tzinfo=BKK_TZ)
+
+
+def trading_days(market_code: str, start: date, end: date) -> list:
+    days = []
+    d = start
+    while d <= end:
+        ts = snapshot_time_thai(market_code, d)
+        if rmod.is_market_trading_day(market_code, _market_local_date(market_code, ts)):
+            days.append(d)
+        d += timedelta(days=1)
+    return days
+
+
+def last_opened_session(market_code: str, now_thai: datetime) -> date:
+    d = now_thai.date()
+    for _ in range(30):
+        if snapshot_time_thai(market_code, d) <= now_thai and \
+                rmod.is_market_trading_day(market_code, _market_local_date(market_code, snapshot_time_thai(market_code, d))):
+            return d
+        d -= timedelta(days=1)
+    return d
+
+
+def session_offsets(market_code: str, day: date, now_thai: datetime):
+    """
+    Return (daily_offset, weekly_offset) in bars between `day` and the latest opened session,
+    or None if that session has not opened yet.
+    """
+    latest = last_opened_session(market_code, now_thai)
+    if day > latest:
+        return None
+    daily_offset = len(trading_days(market_code, day + timedelta(days=1), latest))
+    weekly_offset = ((latest - timedelta(days=latest.weekday())) - (day - timedelta(days=day.weekday()))).days // 7
+    return daily_offset, weekly_offset
+
+
+# ---------- Checkpoint ----------
+
+def load_checkpoint(path: str = CHECKPOINT_FILE):
+    try:
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"[Backfill] Could not read checkpoint {path}: {e}")
+    return None
+
+
+def save_checkpoint(cp: dict, path: str = CHECKPOINT_FILE):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cp, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def _new_checkpoint(markets, start: date, end: date) -> dict:
+    return {
+        "markets": list(markets),
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "created_at": datetime.now(BKK_TZ).isoformat(),
+        "slots": {},
+        # ticker -> [earliest, latest] inserted timestamp whose accuracy windows still need recompute
+        "accuracy_pending": {},
+        "completed": False,
+    }
+
+
+# ---------- Fetch ----------
+
+def _field_name(name: str, offset: int) -> str:
+    """'Recommend.All|1W', 2 -> 'Recommend.All[2]|1W' (TradingView puts the bar offset before the interval)."""
+    if not offset:
+        return name
+    base, sep, interval = name.partition("|")
+    return f"{base}[{offset}]{sep}{interval}"
+
+
+def _safe_float(x):
+    try:
+        return float(x) if x is not None else None
+    except Exception:
+        return None
+
+
+async def fetch_snapshot(client: httpx.AsyncClient, item: dict, daily_offset: int, weekly_offset: int, limiter: AdaptiveLimiter):
+    """Fetch one ticker's snapshot `daily_offset` sessions back. Returns the same shape as fetch_single_ticker_for_history."""
+    ticker = item.get("u_code")
+    exchange = item.get("u_exch") or ""
+    tv_symbol = rmod.construct_tv_symbol(ticker, item.get("u_name"), exchange, item.get("dr_sym"))
+
+    daily_cols = {name: _field_name(name, daily_offset) for name in DAILY_FIELDS}
+    weekly_cols = {name: _field_name(name, weekly_offset) for name in WEEKLY_FIELDS}
+    params = {
+        "symbol": tv_symbol,
+        "fields": ",".join(list(daily_cols.values()) + list(weekly_cols.values()) + ["currency"]),
+        "no_404": "true",
+        "label-product": "popup-technicals",
+    }
+
+    last_error = None
+    for attempt in range(4):
+        async with limiter:
+            try:
+                resp = await client.get(rmod.TRADINGVIEW_BASE, params=params, headers=rmod.FAKE_HEADERS, timeout=rmod.REQUEST_TIMEOUT)
+            except Exception as e:
+                last_error = str(e)
+                resp = None
+
+        if resp is None:
+            await asyncio.sleep(0.5 * (attempt + 1))
+            continue
+
+        if resp.status_code == 429:
+            limiter.on_rate_limited()
+            last_error = "429"
+            await asyncio.sleep(2 * (2 ** attempt))
+            continue
+
+        try:
+            resp.raise_for_status()
+            payload = resp.json()
+        except Exception as e:
+            last_error = str(e)
+            await asyncio.sleep(0.5 * (attempt + 1))
+            continue
+
+        limiter.on_success()
+        d = payload.get("data") if isinstance(payload, dict) and isinstance(payload.get("data"), dict) else (payload if isinstance(payload, dict) else {})
+
+        d_val = _safe_float(d.get(daily_cols["Recommend.All"]))
+        w_val = _safe_float(d.get(weekly_cols["Recommend.All|1W"]))
+        close = _safe_float(d.get(daily_cols["close"]))
+        if d_val is None or close is None:
+            # TradingView returned no bar for this offset (delisted / too far back / unknown symbol)
+            return {"ticker": ticker, "exchange": exchange, "tv_symbol": tv_symbol, "success": False, "error": "no data for offset"}
+
+        return {
+            "ticker": ticker,
+            "exchange": exchange,
+            "tv_symbol": tv_symbol,
+            "success": True,
+            "data": {
+                "daily_val": d_val,
+                "daily_rating": rmod.rating_from_recommend_custom(d_val),
+                "weekly_val": w_val,
+                "weekly_rating": rmod.rating_from_recommend_custom(w_val) if w_val is not None else "Unknown",
+                "currency": str(d.get("currency") or ""),
+                "market_data": {
+                    "price": close,
+                    "open": _safe_float(d.get(daily_cols["open"])),
+                    "high": _safe_float(d.get(daily_cols["high"])),
+                    "low": _safe_float(d.get(daily_cols["low"])),
+                },
+            },
+        }
+
+    return {"ticker": ticker, "exchange": exchange, "tv_symbol": tv_symbol, "success": False, "error": last_error or "Max retries exceeded"}
+
+
+async def load_market_items(client: httpx.AsyncClient, markets) -> dict:
+    """Return {market_code: [item, ...]} with one item per underlying, same keys as fetch_single_ticker_for_history."""
+    await dr_universe.refresh(client)
+    return {m: dr_universe.market_items(m) for m in markets}
+
+
+# ---------- DB writes ----------
+
+def _connect():
+    # used from asyncio.to_thread workers (one at a time), not only the thread that opened it
+    con = sqlite3.connect(rmod.DB_FILE, timeout=30, check_same_thread=False)
+    cur = con.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA busy_timeout=30000")
+    return con
+
+
+def repair_next_history_row(cur, ticker: str, ts_str: str):
+    """A row inserted between two existing snapshots changes the prev/change fields of the next one."""
+    cur.execute("""
+        SELECT timestamp FROM rating_history
+        WHERE ticker=? AND timestamp > ?
+        ORDER BY timestamp ASC LIMIT 1
+    """, (ticker, ts_str))
+    nxt = cur.fetchone()
+    if not nxt:
+        return
+    cur.execute("SELECT daily_rating, weekly_rating, price FROM rating_history WHERE ticker=? AND timestamp=?", (ticker, ts_str))
+    ins = cur.fetchone()
+    if not ins:
+        return
+    cur.execute("""
+        UPDATE rating_history
+        SET daily_prev=?, weekly_prev=?,
+            change_pct = CASE WHEN ? > 0 AND price IS NOT NULL THEN (price - ?) / ? * 100 ELSE 0.0 END,
+            change_abs = CASE WHEN ? > 0 AND price IS NOT NULL THEN price - ? ELSE 0.0 END
+        WHERE ticker=? AND timestamp=?
+    """, (ins[0], ins[1], ins[2] or 0, ins[2], ins[2], ins[2] or 0, ins[2], ticker, nxt[0]))
+
+
+def existing_tickers(con, market_code: str, day: date) -> set:
+    cur = con.cursor()
+    cur.execute("""
+        SELECT ticker FROM rating_history
+        WHERE market=? AND strftime('%Y-%m-%d', timestamp)=?
+    """, (market_code, day.isoformat()))
+    return {r[0] for r in cur.fetchall()}
+
+
+def write_slot(con, cp: dict, market_code: str, snapshot_ts: datetime, results: list):
+    """Store one slot's fetched snapshots (runs in a worker thread). Returns (inserted, failed, inserted_tickers)."""
+    cur = con.cursor()
+    inserted = 0
+    failed = []
+    inserted_tickers = []
+    for res in results:
+        if not res.get("success"):
+            failed.append(res.get("ticker"))
+            continue
+        data = res["data"]
+        market_data = dict(data.get("market_data") or {})
+        market_data["currency"] = data.get("currency", "")
+        ok = rmod.upsert_history_snapshot(
+            cur,
+            ticker=res["ticker"],
+            market_code=market_code,
+            snapshot_ts_thai=snapshot_ts,
+            daily_val=data.get("daily_val"),
+            daily_rating=data.get("daily_rating"),
+            weekly_val=data.get("weekly_val"),
+            weekly_rating=data.get("weekly_rating"),
+            exchange=res.get("exchange") or "",
+            market_data=market_data,
+        )
+        if ok:
+            ts_str = snapshot_ts.replace(tzinfo=None).isoformat()
+            repair_next_history_row(cur, res["ticker"], ts_str)
+            span = cp["accuracy_pending"].get(res["ticker"])
+            cp["accuracy_pending"][res["ticker"]] = [min(span[0], ts_str), max(span[1], ts_str)] if span else [ts_str, ts_str]
+            inserted += 1
+            inserted_tickers.append(res["ticker"])
+    rmod.commit_and_bump(con, inserted_tickers)
+    return inserted, failed, inserted_tickers
+
+
+def recompute_accuracy_windows(con, pending: dict, window_days: int = ACCURACY_WINDOW_DAYS) -> int:
+    """
+    Recompute rating_accuracy for rows whose window contains a backfilled snapshot:
+    history rows from the earliest inserted timestamp up to `window_days` after the latest one,
+    in time order.
+    """
+    cur = con.cursor()
+    count = 0
+    for ticker, (min_ts, max_ts) in sorted(pending.items()):
+        window_end = (datetime.fromisoformat(max_ts) + timedelta(days=window_days)).isoformat()
+        cur.execute("""
+            SELECT timestamp, price, change_pct, currency, high, low
+            FROM rating_history
+            WHERE ticker=? AND timestamp >= ? AND timestamp <= ?
+            ORDER BY timestamp ASC
+        """, (ticker, min_ts, window_end))
+        for ts, price, change_pct, currency, high, low in cur.fetchall():
+            rmod.calculate_and_save_accuracy_for_ticker(cur, ticker, ts, price, change_pct, currency, high, low, window_days=window_days)
+            count += 1
+        accuracy_cube.flush_dirty(cur)
+        rmod.commit_and_bump(con, [ticker])
+        rmod.apply_leaderboard_updates(con)
+    return count
+
+
+# ---------- Engine ----------
+
+def _update_eta():
+    st = _job_state
+    if st["started_at"] and st["processed_tickers"]:
+        elapsed = time_mod.time() - st["started_at"]
+        remaining = max(0, st["total_tickers"] - st["processed_tickers"])
+        st["eta_seconds"] = round(elapsed / st["processed_tickers"] * remaining, 1)
+
+
+def get_backfill_status() -> dict:
+    return dict(_job_state)
+
+
+async def run_backfill(markets, start: date, end: date, resume: bool = True, max_concurrency: int = None,
+                       checkpoint_path: str = CHECKPOINT_FILE) -> dict:
+    markets = [m.strip().upper() for m in markets if m and m.strip()]
+    unknown = [m for m in markets if m not in rmod.MARKET_OPEN_CONFIG]
+    if unknown:
+        raise ValueError(f"Unknown market(s): {', '.join(unknown)}")
+    if end < start:
+        raise ValueError("end must not be before start")
+
+    cp = load_checkpoint(checkpoint_path) if resume else None
+    if cp and (cp.get("markets") != markets or cp.get("start") != start.isoformat() or cp.get("end") != end.isoformat()):
+        print("[Backfill] Checkpoint belongs to a different run, starting fresh")
+        cp = None
+    if cp is None:
+        cp = _new_checkpoint(markets, start, end)
+        save_checkpoint(cp, checkpoint_path)
+
+    now_thai = datetime.now(BKK_TZ)
+    slots = [(m, d) for m in markets for d in trading_days(m, start, end)]
+    todo = [(m, d) for m, d in slots if cp["slots"].get(f"{m}|{d.isoformat()}", {}).get("status") != "done"]
+
+    _job_state.update({
+        "running": True, "markets": markets, "start": start.isoformat(), "end": end.isoformat(),
+        "total_slots": len(slots), "done_slots": len(slots) - len(todo),
+        "total_tickers": 0, "processed_tickers": 0, "inserted": 0, "failed": 0,
+        "phase": "history", "started_at": time_mod.time(), "finished_at": None, "eta_seconds": None, "error": None,
+    })
+    print(f"[Backfill] {len(slots)} slots in range, {len(todo)} to process (markets: {', '.join(markets)})")
+
+    max_concurrency = max_concurrency or BACKFILL_MAX_CONCURRENCY
+    try:
+        async with httpx.AsyncClient() as client:
+            items_by_market = await load_market_items(client, markets)
+            _job_state["total_tickers"] = sum(len(items_by_market.get(m, [])) for m, _ in todo)
+
+            limiters = {}
+            for m in markets:
+                # HK rate-limits early; start lower and let the limiter grow (same idea as manual_history_fetch)
+                start_limit = max(2, max_concurrency // 4) if m == "HK" else max_concurrency
+                limiters[m] = AdaptiveLimiter(max_concurrency, start_limit=start_limit)
+
+            con = await asyncio.to_thread(_connect)
+            try:
+                for market_code, day in todo:
+                    key = f"{market_code}|{day.isoformat()}"
+                    items = items_by_market.get(market_code, [])
+                    offsets = session_offsets(market_code, day, now_thai)
+                    if offsets is None:
+                        print(f"[Backfill] [{key}] Session has not opened yet, skipping")
+                        _job_state["processed_tickers"] += len(items)
+                        continue
+
+                    snapshot_ts = snapshot_time_thai(market_code, day)
+                    existing = await asyncio.to_thread(existing_tickers, con, market_code, day)
+                    missing = [it for it in items if it["u_code"] not in existing]
+                    _job_state["processed_tickers"] += len(items) - len(missing)
+
+                    limiter = limiters[market_code]
+                    _job_state["concurrency"] = limiter.limit
+                    results = await asyncio.gather(*(fetch_snapshot(client, it, offsets[0], offsets[1], limiter) for it in missing))
+
+                    inserted, failed, inserted_tickers = await asyncio.to_thread(
+                        write_slot, con, cp, market_code, snapshot_ts, results)
+
+                    cp["slots"][key] = {
+                        "status": "failed" if failed else "done",
+                        "inserted": inserted,
+                        "failed": sorted(t for t in failed if t),
+                        "offset": offsets[0],
+                        "at": datetime.now(BKK_TZ).isoformat(),
+                    }
+                    save_checkpoint(cp, checkpoint_path)
+
+                    _job_state["processed_tickers"] += len(missing)
+                    _job_state["inserted"] += inserted
+                    _job_state["failed"] += len(failed)
+                    if not failed:
+                        _job_state["done_slots"] += 1
+                    _update_eta()
+                    print(f"[Backfill] [{key}] inserted={inserted} failed={len(failed)} concurrency={limiter.limit} "
+                          f"progress={_job_state['processed_tickers']}/{_job_state['total_tickers']} eta={_job_state['eta_seconds']}s")
+
+                if cp["accuracy_pending"]:
+                    _job_state["phase"] = "accuracy"
+                    print(f"[Backfill] Recomputing accuracy windows for {len(cp['accuracy_pending'])} tickers...")
+                    rows = await asyncio.to_thread(recompute_accuracy_windows, con, cp["accuracy_pending"])
+                    print(f"[Backfill] Accuracy recomputed for {rows} rows")
+                    cp["accuracy_pending"] = {}
+            finally:
+                rmod.discard_leaderboard_updates(con)
+                con.close()
+
+        cp["completed"] = all(v.get("status") == "done" for v in cp["slots"].values())
+        save_checkpoint(cp, checkpoint_path)
+        _job_state["phase"] = "done"
+        return {"inserted": _job_state["inserted"], "failed": _job_state["failed"], "completed": cp["completed"]}
+    except Exception as e:
+        _job_state["error"] = str(e)
+        _job_state["phase"] = "error"
+        raise
+    finally:
+        _job_state["running"] = False
+        _job_state["finished_at"] = time_mod.time()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill rating_history / rating_accuracy for a date range")
+    parser.add_argument("--markets", help="Comma-separated market codes (e.g. US,HK). Default: all markets")
+    parser.add_argument("--start", help="First day (YYYY-MM-DD, Thai date)")
+    parser.add_argument("--end", help="Last day (YYYY-MM-DD, Thai date). Default: today")
+    parser.add_argument("--resume", action="store_true", help="Continue the run stored in the checkpoint file")
+    parser.add_argument("--fresh", action="store_true", help="Ignore an existing checkpoint")
+    parser.add_argument("--concurrency", type=int, default=None, help="Upper bound for the adaptive limiter")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    args = parser.parse_args()
+
+    if args.resume and not args.start:
+        cp = load_checkpoint(args.checkpoint)
+        if not cp:
+            raise SystemExit(f"No checkpoint found at {args.checkpoint}")
+        markets = cp["markets"]
+        start = date.fromisoformat(cp["start"])
+        end = date.fromisoformat(cp["end"])
+    else:
+        if not args.start:
+            parser.error("--start is required (or use --resume)")
+        markets = args.markets.split(",") if args.markets else list(rmod.MARKET_OPEN_CONFIG.keys())
+        start = date.fromisoformat(args.start)
+        end = date.fromisoformat(args.end) if args.end else datetime.now(BKK_TZ).date()
+
+    rmod.init_database()
+    result = asyncio.run(run_backfill(markets, start, end, resume=not args.fresh, max_concurrency=args.concurrency,
+                                      checkpoint_path=args.checkpoint))
+    print(f"[Backfill] Finished: {result}")
+
+
+if __name__ == "__main__":
+    main()
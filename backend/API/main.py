@@ -14,10 +14,15 @@ Usage:
     uvicorn main:app --host 0.0.0.0 --port 8000 --reload
 """
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 import asyncio
+import gzip
+import json
+import zlib
+import httpx
 
 import os
 from dotenv import load_dotenv
@@ -41,6 +46,7 @@ import ratings_api_dynamic
 import earnings_api
 import news_api
 import dr_calculation_api
+import dr_universe
 
 
 @asynccontextmanager
@@ -54,14 +60,11 @@ async def lifespan(app: FastAPI):
     print("[INIT] Initializing Ratings API...")
     ratings_api_dynamic.init_database()
     ratings_api_dynamic.migrate_from_json_if_needed()
-    # Populate accuracy on startup and wait for completion so we have a visible terminal log
-    try:
-        print("[INIT] Populating accuracy data (startup)... this may take a while")
-        ratings_api_dynamic.populate_accuracy_on_startup()
-        print("[INIT] Accuracy population completed on startup")
-    except Exception as acc_e:
-        print(f"[INIT] Error during accuracy population on startup: {acc_e}")
+    # Populate missing/outdated accuracy rows in the background (progress: /ready)
+    print("[INIT] Populating accuracy data in background...")
+    ratings_api_dynamic.start_accuracy_population()
     asyncio.create_task(ratings_api_dynamic.background_updater())
+    asyncio.create_task(ratings_api_dynamic.tracking_ingest.run_flusher())
     print("[OK] Ratings API: Ready")
     
     # ========== Initialize Earnings API ==========
@@ -190,6 +193,20 @@ async def health_check():
         }
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until background startup work (accuracy population) is done. /health stays liveness."""
+    ready = ratings_api_dynamic.is_ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "services": {
+                "ratings": {"accuracy_population": ratings_api_dynamic.get_accuracy_population_status()},
+            },
+        },
+    )
+
 @app.get("/debug/routes")
 def debug_routes():
     routes = []
@@ -207,24 +224,64 @@ def debug_routes():
     }
 
 @app.get("/caldr")
-def proxy_caldr():
-    """Proxy /caldr to return local encoded DR list to satisfy frontend defaults."""
-    import os, json
-    # Use ratings_api path or just relative path? ratings_api_dynamic sits next to this file usually
+async def proxy_caldr():
+    """Proxy /caldr to return the DR list to satisfy frontend defaults."""
+    # Served from the shared DR universe snapshot (upstream by ETag, dr_list.json as fallback)
     try:
-        local_dr_file = os.path.join(os.path.dirname(__file__), "ratings_api_dynamic", "dr_list.json")
-        if not os.path.exists(local_dr_file):
-             # Try same directory
-             local_dr_file = os.path.join(os.path.dirname(__file__), "dr_list.json")
-        
-        if os.path.exists(local_dr_file):
-            with open(local_dr_file, "r", encoding="utf-8") as f:
-                 return json.load(f)
-        return {"count": 0, "rows": []}
+        return (await dr_universe.refresh())["payload"]
     except Exception as e:
         return {"error": str(e)}
 
 
+# --- Suggestion page bundle: live DR list + ratings list in one response ---
+# `dr` comes from the same live source as /ratings/dr-list (fetched on every request, like that endpoint);
+# the body is rebuilt only when the ratings data version or the DR list bytes change
+_page_bundle_cache = {"key": None}
+
+
+async def _live_dr_list_body() -> bytes:
+    url = ratings_api_dynamic.DR_LIST_URL or "https://api.ideatrade1.com/caldr"
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            resp = await client.get(url)
+            resp.raise_for_status()
+            body = resp.content
+        json.loads(body)  # spliced as-is below, so it has to be valid JSON
+        return body
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Failed to fetch DR list from external source: {e}")
+
+
+def _build_page_bundle(key, dr_body: bytes, ratings_entry: dict) -> dict:
+    # parts are already JSON -> splice the bytes instead of re-serializing
+    body = b'{"dr":' + dr_body + b',"ratings":' + ratings_entry["body"] + b'}'
+    return {
+        "key": key,
+        "etag": f'"{ratings_entry["etag"].strip(chr(34))}-{format(key[1], "x")}"',
+        "body": body,
+        "gzip": gzip.compress(body, 6),
+    }
+
+
+@app.get("/api/page/suggestion")
+async def suggestion_page_bundle(request: Request):
+    """
+    Initial data of the suggestion page in one round trip:
+    {"dr": <same as /ratings/dr-list>, "ratings": <same as /ratings/from-dr-api>}
+    Both parts are fetched concurrently; the body is served pre-gzipped with an ETag (304 when unchanged).
+    """
+    global _page_bundle_cache
+    dr_body, ratings_entry = await asyncio.gather(
+        _live_dr_list_body(),
+        asyncio.to_thread(ratings_api_dynamic._get_dr_api_cache),
+    )
+    key = (ratings_entry["etag"], zlib.crc32(dr_body))
+    cache = _page_bundle_cache
+    if cache["key"] != key:
+        cache = _page_bundle_cache = await asyncio.to_thread(_build_page_bundle, key, dr_body, ratings_entry)
+    return ratings_api_dynamic._cached_json_response(request, cache)
+
+
 if __name__ == "__main__":
     import uvicorn
     
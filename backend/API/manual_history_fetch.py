@@ -19,6 +19,7 @@ import httpx
 
 # Import helpers from main module
 import ratings_api_dynamic as rmod
+import dr_universe
 
 # Markets and their desired close timestamps (Thai time)
 TARGETS = {
@@ -39,20 +40,10 @@ TARGETS = {
 
 BKK_TZ = ZoneInfo("Asia/Bangkok")
 DB_PATH = getattr(rmod, "DB_FILE", "ratings.sqlite")
-DR_LIST_URL = os.getenv("DR_LIST_URL") or getattr(rmod, "DR_LIST_URL", None)
 MAX_CONCURRENCY = int(getattr(rmod, "MAX_CONCURRENCY", 8))
 BATCH_SLEEP = float(getattr(rmod, "BATCH_SLEEP_SECONDS", 3.0))
 REQUEST_TIMEOUT = int(getattr(rmod, "REQUEST_TIMEOUT", 10))
 
-if not DR_LIST_URL:
-    print("ERROR: DR_LIST_URL not configured. Set DR_LIST_URL env or in ratings_api_dynamic.py")
-    raise SystemExit(1)
-
-async def fetch_dr_list(client: httpx.AsyncClient):
-    r = await client.get(DR_LIST_URL, timeout=REQUEST_TIMEOUT)
-    r.raise_for_status()
-    return r.json().get("rows", [])
-
 async def fetch_for_items(client, items, semaphore):
     tasks = []
     for item in items:
@@ -75,27 +66,12 @@ async def process_market(market_code: str, snapshot_ts_thai: datetime):
     semaphore = asyncio.Semaphore(local_max_concurrency)
 
     async with httpx.AsyncClient() as client:
-        try:
-            rows = await fetch_dr_list(client)
-        except Exception as e:
-            print(f"[ManualFetch] Failed to fetch DR list: {e}")
+        # Items matching fetch_single_ticker_for_history expectations, from the shared DR universe
+        universe = await dr_universe.refresh(client)
+        if not universe["rows"]:
+            print("[ManualFetch] Failed to fetch DR list")
             return
-
-        # Build items list matching fetch_single_ticker_for_history expectations
-        items = []
-        for item in rows:
-            # derive underlying code similar to main code
-            u_code = item.get("underlying") or (item.get("symbol") or "").replace("80", "").replace("19", "")
-            if not u_code:
-                continue
-            u_code = u_code.strip().upper()
-            exchange = item.get("underlyingExchange") or item.get("exchange") or item.get("u_exch") or ""
-            name = item.get("underlyingName") or item.get("name") or item.get("u_name") or ""
-            dr_sym = item.get("symbol") or item.get("dr_sym") or ""
-            mapped = rmod.market_code_from_exchange(exchange)
-            if mapped != market_code:
-                continue
-            items.append({"u_code": u_code, "u_name": name, "u_exch": exchange, "dr_sym": dr_sym})
+        items = dr_universe.market_items(market_code)
 
         if not items:
             print(f"[ManualFetch] No tickers mapped to market {market_code}")
@@ -0,0 +1,70 @@
+"""
+Live presence (Stats page "Active Users")
+
+In-memory sliding window of sessions seen in the last WINDOW_SECONDS, fed by every event
+that reaches tracking_ingest (duplicates included - they still mean the user is there).
+Server receive time is used, not the client timestamp.
+
+- _sessions: session_id -> (last_seen, page), ordered oldest -> newest (move_to_end on touch)
+- _page_counts: page -> active sessions currently on it
+Expiry pops from the oldest end, so touch / counts are O(1) amortized.
+Presence restarts empty with the process (heartbeats refill it within the window).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import analytics_rollup
+
+WINDOW_SECONDS = int(os.getenv("PRESENCE_WINDOW_SECONDS", "600"))
+
+_sessions = OrderedDict()
+_page_counts = {}
+_lock = threading.Lock()
+
+
+def _expire(now):
+    cutoff = now - WINDOW_SECONDS
+    while _sessions:
+        session_id, (last_seen, page) = next(iter(_sessions.items()))
+        if last_seen >= cutoff:
+            break
+        _sessions.popitem(last=False)
+        _dec(page)
+
+
+def _dec(page):
+    n = _page_counts.get(page, 0) - 1
+    if n > 0:
+        _page_counts[page] = n
+    else:
+        _page_counts.pop(page, None)
+
+
+def touch(session_id: str, page_path: str):
+    """Mark the session active on `page_path` now."""
+    if not session_id:
+        return
+    page = analytics_rollup.normalize_page(page_path)
+    now = time.monotonic()
+    with _lock:
+        prev = _sessions.pop(session_id, None)
+        if prev is not None:
+            _dec(prev[1])
+        _sessions[session_id] = (now, page)
+        _page_counts[page] = _page_counts.get(page, 0) + 1
+        _expire(now)
+
+
+def active_count() -> int:
+    with _lock:
+        _expire(time.monotonic())
+        return len(_sessions)
+
+
+def snapshot() -> dict:
+    """{"active_users": n, "pages": {page: sessions}} for the current window."""
+    with _lock:
+        _expire(time.monotonic())
+        return {"active_users": len(_sessions), "pages": dict(_page_counts)}
@@ -1,22 +1,40 @@
 # --- Intraday History API ---
 from fastapi import HTTPException, Request
 from fastapi import FastAPI, Query
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import httpx
 import uvicorn
 import asyncio
+import bisect
+import gzip
 import json
 import os
 import re
 import random
 import sqlite3
+import threading
+import time as time_mod
+import numpy as np
+from collections import deque
 from datetime import datetime, timedelta, time
 from zoneinfo import ZoneInfo
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
 
+import dr_universe
+import accuracy_cube
+import accuracy_engine
+import tracking_ingest
+import analytics_db
+import analytics_rollup
+import presence
+# Symbol/market mapping is shared with the other APIs through the DR universe
+from dr_universe import construct_tv_symbol, market_code_from_exchange
+
 # Debug logging setup
 DEBUG_LOG_PATH = os.getenv("DEBUG_LOG_PATH") or r"c:\Users\Thoz\Desktop\New-Cal-DR-Project-main\.cursor\debug.log"
 
@@ -113,6 +131,116 @@ FAKE_HEADERS = {
     "Accept": "application/json, text/plain, */*",
 }
 
+# --- Data version ---
+# เพิ่มทุกครั้งที่ commit batch ของ ratings (rating_main / rating_history) ในโปรเซสนี้
+# ใช้แทน mtime ของไฟล์ DB (WAL เขียนลงไฟล์ -wal ทำให้ mtime ไม่เปลี่ยน) สำหรับ cache + ETag
+_BOOT_ID = format(int(datetime.now().timestamp() * 1000), "x")
+_data_version = 0
+_data_version_updated_at = None
+_data_version_lock = threading.Lock()
+# change log: (version, tickers) ต่อ batch ที่ commit; tickers=None = เปลี่ยนทั้งหมด (client ต้องโหลดใหม่ทั้งชุด)
+CHANGE_LOG_SIZE = int(os.getenv("RATINGS_CHANGE_LOG_SIZE", "500"))
+_change_log = deque(maxlen=CHANGE_LOG_SIZE)
+# SSE clients ของ /changes/stream (asyncio.Queue ต่อ client) + event loop ที่ใช้ส่ง
+_changes_sse_clients = []
+_changes_loop = None
+# โปรเซสอื่น (history_backfill / manual_history_fetch / accuracy_rebuild CLI) bump counter ในนี้ไม่ได้
+# -> เช็ค PRAGMA data_version บน connection ที่เปิดค้างไว้ (เปลี่ยนเมื่อ connection อื่น commit) ไม่เกินทุก N วินาที
+# writer ในโปรเซสนี้ commit ผ่าน commit_and_bump() ซึ่ง resync stamp เอง -> stamp ที่เปลี่ยนโดยไม่มีที่มา = external
+EXTERNAL_WRITE_CHECK_SECONDS = float(os.getenv("RATINGS_EXTERNAL_WRITE_CHECK_SECONDS", "1"))
+_db_stamp_con = None
+_db_stamp_seen = None
+_db_stamp_checked_at = 0.0
+
+
+def bump_data_version(tickers=None):
+    """
+    Call after committing a ratings batch: invalidates version-keyed response caches,
+    appends the changed tickers to the change log and wakes /changes/stream clients.
+    tickers=None means "anything may have changed" (cleanup etc.).
+    """
+    global _data_version, _data_version_updated_at
+    with _data_version_lock:
+        _data_version += 1
+        _data_version_updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        _change_log.append((_data_version, tuple(sorted({t.upper() for t in tickers if t})) if tickers is not None else None))
+        version = _data_version
+    if _changes_loop is not None and _changes_sse_clients:
+        try:
+            _changes_loop.call_soon_threadsafe(_notify_changes_clients, version)
+        except RuntimeError:
+            pass  # loop closed
+    return version
+
+
+def commit_and_bump(con, tickers=None):
+    """
+    Commit an in-process write on `con` and account for it in the data version.
+    tickers=None = full change; an empty collection = nothing visible changed (only the stamp is resynced).
+
+    The stamp is read before the commit too, while `con` still holds the write lock: a commit from
+    another process that landed before ours is still reported as external (full change) instead of
+    being absorbed into our own bump. Every in-process writer of ratings.sqlite should commit here.
+    """
+    global _db_stamp_seen
+    with _data_version_lock:
+        before = _read_db_stamp()
+        con.commit()
+        after = _read_db_stamp()
+        foreign = before is not None and _db_stamp_seen is not None and before != _db_stamp_seen
+        if after is not None:
+            _db_stamp_seen = after
+    if foreign:
+        _on_external_write()
+    if tickers is None or tickers:
+        return bump_data_version(tickers)
+    return _data_version
+
+
+def _read_db_stamp():
+    """PRAGMA data_version of the long-lived stamp connection (None if the DB can't be read)."""
+    global _db_stamp_con
+    try:
+        if _db_stamp_con is None:
+            _db_stamp_con = sqlite3.connect(DB_FILE, timeout=5, check_same_thread=False)
+        return _db_stamp_con.execute("PRAGMA data_version").fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"⚠️ data_version check failed: {e}")
+        return None
+
+
+def _check_external_writes():
+    """Bump the data version (full change) when a commit not made through commit_and_bump() reached the DB."""
+    global _db_stamp_seen, _db_stamp_checked_at
+    now = time_mod.monotonic()
+    if now - _db_stamp_checked_at < EXTERNAL_WRITE_CHECK_SECONDS:
+        return
+    with _data_version_lock:
+        _db_stamp_checked_at = now
+        stamp = _read_db_stamp()
+        if stamp is None or stamp == _db_stamp_seen:
+            return
+        first = _db_stamp_seen is None
+        _db_stamp_seen = stamp
+    if not first:
+        _on_external_write()
+
+
+def _on_external_write():
+    """Another connection / process committed: everything may have changed."""
+    bump_data_version()
+    # leaderboard อัปเดตแบบ incremental จาก writer ในโปรเซสนี้เท่านั้น -> โหลดใหม่จาก DB
+    if _leaderboard_loaded:
+        try:
+            load_leaderboard()
+        except sqlite3.Error as e:
+            print(f"⚠️ Leaderboard reload after external write failed: {e}")
+
+
+def get_data_version():
+    _check_external_writes()
+    return _data_version
+
 # --- Database Initialization & Migration ---
 
 def check_table_schema(cur, table_name):
@@ -488,51 +616,7 @@ def init_database():
             )
         """)
 
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS user_tracking (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ip_address TEXT,
-                session_id TEXT,
-                event_type TEXT,
-                event_data TEXT,
-                page_path TEXT,
-                timestamp TEXT,
-                user_agent TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Check and migrate user_tracking if it has old schema (user_id instead of ip_address)
-        try:
-            cur.execute("PRAGMA table_info(user_tracking)")
-            ut_cols = [r[1] for r in cur.fetchall()]
-            if "user_id" in ut_cols:
-                print("⚠️ Migrating user_tracking to match user_behavior schema...")
-                cur.execute("ALTER TABLE user_tracking RENAME TO user_tracking_old")
-                cur.execute("""
-                    CREATE TABLE user_tracking (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        ip_address TEXT,
-                        session_id TEXT,
-                        event_type TEXT,
-                        event_data TEXT,
-                        page_path TEXT,
-                        timestamp TEXT,
-                        user_agent TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                # Restore data (set ip_address to 'migrated')
-                cur.execute("""
-                    INSERT INTO user_tracking (session_id, event_type, event_data, page_path, timestamp, user_agent, created_at, ip_address)
-                    SELECT session_id, event_type, event_data, page_path, timestamp, user_agent, created_at, 'migrated'
-                    FROM user_tracking_old
-                """)
-                cur.execute("DROP TABLE user_tracking_old")
-                print("   -> user_tracking migrated successfully.")
-        except Exception as e:
-            print(f"⚠️ Error check/migrating user_tracking: {e}")
-
+        # Website tracking tables live in analytics.sqlite (analytics_db.init, below)
 
         cur.execute("""
             CREATE INDEX IF NOT EXISTS idx_rating_accuracy_ticker 
@@ -543,6 +627,21 @@ def init_database():
             ON rating_accuracy(ticker, timestamp DESC)
         """)
 
+        # Precomputed accuracy per (ticker, timeframe, window, threshold, rating) - see accuracy_cube.py
+        accuracy_cube.ensure_table(cur)
+
+        # Sliding-window accuracy state per ticker (deque ของแถวใน window + ตัวนับ) เพื่อไม่ต้อง rebuild ตอน restart
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS accuracy_window_state (
+                ticker TEXT NOT NULL,
+                window_day INTEGER NOT NULL,
+                last_timestamp TEXT,
+                entries TEXT NOT NULL,
+                updated_at TEXT,
+                PRIMARY KEY (ticker, window_day)
+            )
+        """)
+
         # Ensure 'open' and 'open_prev' columns exist on older DBs for history/accuracy only
         try:
             for tbl in ("rating_history", "rating_accuracy"):
@@ -564,6 +663,9 @@ def init_database():
 
         con.commit()
         con.close()
+
+        # Analytics DB (own file/writer); moves tracking tables out of ratings.sqlite on first run
+        analytics_db.init(DB_FILE)
         if needs_recreate:
             print("[INFO] SQLite database recreated with new schema successfully.")
         else:
@@ -684,132 +786,6 @@ def _find_key_recursive(obj, key):
             if r is not None: return r
     return None
 
-def construct_tv_symbol(ticker: str, name: str, exchange: str, dr_symbol: str):
-    ticker = ticker.strip().upper()
-    exchange = " ".join(exchange.upper().split()) if exchange else ""
-    name = name.strip() if name else ""
-    dr_symbol = dr_symbol.strip().upper() if dr_symbol else ""
-
-    real_ticker = ticker 
-    # If ticker looks like numeric with an exchange suffix (e.g. 3692.HK, 3692-HK, 3692:HKEX),
-    # strip the suffix so TradingView receives just the numeric code (e.g. 3692).
-    m_num_suffix = re.match(r'^([0-9]+)[\.\:\-].*$', real_ticker)
-    if m_num_suffix:
-        real_ticker = m_num_suffix.group(1)
-
-    match = re.search(r'\(([A-Z0-9.\-_]+)\)$', name)
-    if match:
-        matched = match.group(1)
-        # If matched begins with digits (numeric HK/TW style), strip suffix like '.HK' -> '3692'
-        if re.match(r'^\d+', matched):
-            real_ticker = re.sub(r'[\.\:\-].*$', '', matched)
-        else:
-            # Preserve non-numeric tickers including class suffixes (e.g. 'BRK.B' or 'NOVO-B')
-            real_ticker = matched
-    else:
-        if dr_symbol:
-            # Normalize dr_symbol by removing common suffixes (.HK, -HK, :HKEX)
-            dr_clean = re.sub(r'[\.\:\-].*$', '', dr_symbol).strip()
-            if len(dr_clean) >= 1:
-                real_ticker = dr_clean
-
-    if any(k in exchange for k in ("MILAN", "MIL")): return f"MIL:{real_ticker}"
-    if any(k in exchange for k in ("COPENHAGEN", "OMX")): return f"OMXCOP:{real_ticker.replace('-', '_')}"
-    if any(k in exchange for k in ("EURONEXT", "PARIS", "AMSTERDAM", "BRUSSELS", "FRANCE", "NETHERLANDS")): return f"EURONEXT:{real_ticker}"
-    if any(k in exchange for k in ("SHANGHAI", "SSE", "SHANGHAI STOCK EXCHANGE")): return f"SSE:{real_ticker}"
-    if any(k in exchange for k in ("SHENZHEN", "SZSE")): return f"SZSE:{real_ticker}"
-    if any(k in exchange for k in ("HONG", "HK", "HKEX")): return f"HKEX:{real_ticker}"
-    if any(k in exchange for k in ("VIET", "HOCHIMINH", "HOSE", "HNX")): return f"HOSE:{real_ticker}"
-    if any(k in exchange for k in ("TOKYO", "JAPAN", "TSE", "JP")): return f"TSE:{real_ticker}"
-    if any(k in exchange for k in ("SINGAPORE", "SGX", "SG")): return f"SGX:{real_ticker}"
-    if any(k in exchange for k in ("TAIWAN", "TWSE", "TW")): return f"TWSE:{real_ticker}"
-    if "NASDAQ" in exchange: return f"NASDAQ:{real_ticker}"
-    if any(k in exchange for k in ("NEW YORK", "NYSE", "NY")):     
-        if any(sub_k in exchange for sub_k in ("ARCHIPELAGO", "ARCA", "AMEX")): return f"AMEX:{real_ticker}"
-        return f"NYSE:{real_ticker}"
-    if re.match(r'^\d+$', real_ticker): return f"HKEX:{real_ticker}" 
-    return f"NASDAQ:{real_ticker}" 
-
-
-def market_code_from_exchange(exchange: str) -> str:
-    """
-    Map exchange/market description from DR API to high-level market code
-    used in MARKET_CLOSE_CONFIG.
-    """
-    if not exchange:
-        return "US"
-
-    ex = exchange.upper()
-
-    # ใช้การ map แบบเดียวกับ frontend (DRList.jsx) - ตรวจสอบแบบเต็มก่อน
-    ex_lower = ex.lower()
-    
-    # Europe - ตรวจสอบแบบเต็มตาม frontend
-    if "euronext amsterdam" in ex_lower:
-        return "NL"
-    if "euronext milan" in ex_lower:
-        return "IT"
-    if "euronext paris" in ex_lower:
-        return "FR"
-    if "nasdaq copenhagen" in ex_lower:
-        return "DK"
-    
-    if ("ho chi minh" in ex_lower or "hochiminh" in ex_lower or 
-        "hanoi" in ex_lower or "hnx" in ex_lower):
-        return "VN"
-    
-    if "shenzhen" in ex_lower or "shanghai" in ex_lower:
-        return "CN" 
-  
-    if "singapore exchange" in ex_lower or "sgx" in ex_lower:
-        return "SG"
-   
-    if "taiwan stock exchange" in ex_lower:
-        return "TW"
-    
-    if "stock exchange of hong kong" in ex_lower or "hkex" in ex_lower:
-        return "HK"
-    
-    if "tokyo stock exchange" in ex_lower:
-        return "JP"
-    
-    if ("nasdaq global select market" in ex_lower or 
-        "nasdaq stock market" in ex_lower or 
-        "new york stock exchange archipelago" in ex_lower or  # ตรวจสอบ Archipelago ก่อน (เพราะมี "new york stock exchange" อยู่ด้วย)
-        "new york stock exchange" in ex_lower or 
-        "nyse" in ex_lower or 
-        "nasdaq" in ex_lower):
-        return "US"
-    
-    # Fallback: ตรวจสอบแบบย่อสำหรับกรณีที่ไม่ได้ระบุแบบเต็ม
-    if any(k in ex for k in ("COPENHAGEN", "DENMARK", "OMXCOP", "DK")):
-        return "DK"
-    if any(k in ex for k in ("AMSTERDAM", "NETHERLANDS")):
-        return "NL"
-    if any(k in ex for k in ("PARIS", "FRANCE")):
-        return "FR"
-    if any(k in ex for k in ("MILAN", "ITALY", "BORSA ITALIANA")):
-        return "IT"
-    if any(k in ex for k in ("VIET", "VIETNAM", "HOCHIMINH", "HOSE", "HNX", "VN")):
-        return "VN"
-    if any(k in ex for k in ("SHANGHAI", "SSE", "SZSE", "SHENZHEN", "CHINA", "CN")):
-        return "CN"
-    if any(k in ex for k in ("SINGAPORE", "SGX", "SG")):
-        return "SG"
-    if any(k in ex for k in ("TAIWAN", "TWSE", "TW")):
-        return "TW"
-    if any(k in ex for k in ("HONG", "HKEX", "HONG KONG", "HK")):
-        return "HK"
-    if any(k in ex for k in ("TOKYO", "JAPAN", "TSE", "JP")):
-        return "JP"
-    if any(k in ex for k in ("NASDAQ", "NYSE", "NEW YORK", "AMEX", "ARCHIPELAGO", "ARCA")):
-        return "US"
-    # Note: ไม่มี TH (Thailand) เพราะระบบไม่มีหุ้นไทย
-
-    # Default: treat as US if ไม่แมตช์
-    return "US"
-
-
 def generate_tv_candidates(ticker: str, name: str, exchange: str, dr_symbol: str):
     """
     Generate a prioritized list of TradingView symbol candidates based on
@@ -1056,6 +1032,7 @@ async def fetch_single_ticker(client: httpx.AsyncClient, item_data):
             val_high = safe_float(p_high)
             val_low = safe_float(p_low)
 
+            _note_tv_resolution(ticker, exchange, tv_symbol)
             return {
                 "ticker": ticker, 
                 "tv_symbol": tv_symbol,
@@ -1078,6 +1055,7 @@ async def fetch_single_ticker(client: httpx.AsyncClient, item_data):
             await asyncio.sleep(1)
             
     print(f"      - ❌ Failed to fetch data for {ticker} after 3 attempts")
+    _note_tv_resolution(ticker, exchange, tv_symbol, "Max retries exceeded", tv_candidates_unique)
     return {"ticker": ticker, "success": False, "error": "Max retries exceeded"}
 
 
@@ -1175,6 +1153,7 @@ async def fetch_single_ticker_for_history(client: httpx.AsyncClient, item_data):
             daily_rating = rating_from_recommend_custom(d_val) if d_val is not None else "Unknown"
             weekly_rating = rating_from_recommend_custom(w_val) if w_val is not None else "Unknown"
 
+            _note_tv_resolution(ticker, exchange, tv_symbol)
             return {
                 "ticker": ticker,
                 "exchange": exchange,
@@ -1201,6 +1180,7 @@ async def fetch_single_ticker_for_history(client: httpx.AsyncClient, item_data):
             await asyncio.sleep(1)
 
     print(f"      - ❌ [history] Failed to fetch data for {ticker} after 3 attempts")
+    _note_tv_resolution(ticker, exchange, tv_symbol, "Max retries exceeded")
     return {"ticker": ticker, "exchange": exchange, "success": False, "error": "Max retries exceeded"}
 
 
@@ -1542,37 +1522,14 @@ async def background_updater():
                 pass
             
             async with httpx.AsyncClient() as client:
-                # Get the full list of DRs
-                try:
-                    # Prefer local file to avoid asking source as requested
-                    local_dr_file = os.path.join(os.path.dirname(__file__), "dr_list.json")
-                    if os.path.exists(local_dr_file):
-                        with open(local_dr_file, "r", encoding="utf-8") as f:
-                            rows = json.load(f).get("rows", [])
-                            print(f"[Background] Loaded {len(rows)} items from local DR list.")
-                    else:
-                        r_dr = await client.get(DR_LIST_URL, timeout=20)
-                        r_dr.raise_for_status()
-                        rows = r_dr.json().get("rows", [])
-                        print(f"Found {len(rows)} total items from DR API.")
-                except Exception as dr_e:
-                    print(f"❌ Could not fetch DR list: {dr_e}. Retrying in {UPDATE_INTERVAL_SECONDS}s.")
+                # Get the unique list of underlying stocks to query from the shared DR universe
+                universe = await dr_universe.refresh(client)
+                if not universe["rows"]:
+                    print(f"❌ DR list is empty/unavailable. Retrying in {UPDATE_INTERVAL_SECONDS}s.")
                     await asyncio.sleep(UPDATE_INTERVAL_SECONDS)
                     continue
 
-                # Create a unique list of underlying stocks to query
-                underlying_map = {}
-                for item in rows:
-                    u_code = item.get("underlying") or (item.get("symbol") or "").replace("80", "").replace("19", "")
-                    if u_code:
-                        u_code = u_code.strip().upper()
-                        if u_code not in underlying_map or (not underlying_map[u_code]["u_exch"] and item.get("underlyingExchange")):
-                            underlying_map[u_code] = {
-                                "u_code": u_code, "u_name": item.get("underlyingName", ""),
-                                "u_exch": item.get("underlyingExchange", ""), "dr_sym": item.get("symbol", "")
-                            }
-                
-                tasks_data = list(underlying_map.values())
+                tasks_data = universe["underlying_items"]
                 print(f"Processing {len(tasks_data)} unique underlying tickers.")
                 if not tasks_data:
                     await asyncio.sleep(UPDATE_INTERVAL_SECONDS)
@@ -1587,6 +1544,7 @@ async def background_updater():
                     results = await asyncio.gather(*[fetch_single_ticker(client, item) for item in batch_data])
                     
                     successful_updates_in_batch = 0
+                    changed_tickers = []
                     con = None # Ensure 'con' is defined before try block
                     try:
                         con = sqlite3.connect(DB_FILE, timeout=10)
@@ -1619,6 +1577,7 @@ async def background_updater():
 
                             # This is a successful update
                             successful_updates_in_batch += 1
+                            changed_tickers.append(ticker)
                             
                             # Prepare market data
                             market_data = {
@@ -1645,7 +1604,7 @@ async def background_updater():
                             # Step 3: Update rating_history (from rating_main with A-B-A filter - separate for daily/weekly)
                             update_rating_history(cur, ticker)
                         
-                        con.commit()
+                        commit_and_bump(con, changed_tickers)
                         # แสดง log เฉพาะทุก 10 batches หรือ batch สุดท้าย
                         if batch_num % 10 == 0 or batch_num == total_batches:
                             print(f"    Batch {batch_num}/{total_batches}: {successful_updates_in_batch} updates committed")
@@ -1668,8 +1627,8 @@ async def background_updater():
                 cur.execute("PRAGMA journal_mode=WAL")
                 cur.execute("PRAGMA busy_timeout=30000")
                 
-                cleanup_old_records_by_date(cur)
-                con.commit()
+                deleted = cleanup_old_records_by_date(cur)
+                commit_and_bump(con, None if any(deleted) else ())
                 con.close()
             except Exception as cleanup_e:
                 print(f"   -> ❌ Error during cleanup: {cleanup_e}")
@@ -1689,6 +1648,36 @@ async def background_updater():
         await asyncio.sleep(UPDATE_INTERVAL_SECONDS)
 
 
+def is_market_trading_day(market_code: str, local_date) -> bool:
+    """
+    True if `local_date` (market local date) is a trading day: not Sat/Sun and not listed
+    in backend/API/market_holidays.json.
+    Format: { "US": ["2026-01-01", "2026-12-25"], "JP": ["2026-01-01"] }
+    """
+    try:
+        if local_date.weekday() in (5, 6):
+            return False
+    except Exception:
+        pass
+
+    try:
+        from pathlib import Path
+
+        holidays_file = Path(os.path.dirname(__file__)) / "market_holidays.json"
+        if holidays_file.exists():
+            with open(holidays_file, "r", encoding="utf-8") as hf:
+                hol = json.load(hf)
+            # accept either upper/lower keys
+            market_code = market_code or ""
+            market_hols = hol.get(market_code) or hol.get(market_code.upper()) or hol.get(market_code.lower()) or []
+            if isinstance(market_hols, list) and local_date.isoformat() in market_hols:
+                return False
+    except Exception:
+        # If holiday check fails, do not block insertion (we already filtered weekends)
+        pass
+    return True
+
+
 def upsert_history_snapshot(
     cur,
     ticker: str,
@@ -1701,6 +1690,7 @@ def upsert_history_snapshot(
     exchange: str,
     market_data: dict,
 ):
+    # Returns True when a new row was inserted, False when skipped (holiday / already present)
     # Ensure timezone-aware (assume Thai time if missing)
     if snapshot_ts_thai.tzinfo is None:
         bkk_tz = ZoneInfo("Asia/Bangkok")
@@ -1721,32 +1711,9 @@ def upsert_history_snapshot(
     except Exception:
         local_ts = snapshot_ts_thai
 
-    # Skip weekend snapshots for rating_history (Sat/Sun in market local time)
-    try:
-        if local_ts.weekday() in (5, 6):
-            return
-    except Exception:
-        pass
-
-    # Optional: support market-specific holiday list via backend/API/market_holidays.json
-    # Format: { "US": ["2026-01-01", "2026-12-25"], "JP": ["2026-01-01"] }
-    try:
-        import json, os
-        from pathlib import Path
-
-        holidays_file = Path(os.path.dirname(__file__)) / "market_holidays.json"
-        if holidays_file.exists():
-            with open(holidays_file, "r", encoding="utf-8") as hf:
-                hol = json.load(hf)
-            # accept either upper/lower keys
-            market_hols = hol.get(market_code) or hol.get(market_code.upper()) or hol.get(market_code.lower()) or []
-            if isinstance(market_hols, list):
-                local_date_str = local_ts.date().isoformat()
-                if local_date_str in market_hols:
-                    return
-    except Exception:
-        # If holiday check fails, do not block insertion (we already filtered weekends)
-        pass
+    # Skip weekends and market holidays (market local time)
+    if not is_market_trading_day(market_code, local_ts.date()):
+        return False
 
     ts_str = snapshot_ts_thai.replace(tzinfo=None).isoformat()
     date_str = snapshot_ts_thai.date().isoformat()
@@ -1764,7 +1731,7 @@ def upsert_history_snapshot(
     existing = cur.fetchone()
     if existing:
         # Already have snapshot for this day -> nothing to do
-        return
+        return False
 
     # Find previous history record (for prev fields and price calculation)
     cur.execute(
@@ -1823,101 +1790,127 @@ def upsert_history_snapshot(
             market_data.get("low"),
         ),
     )
+    return True
+
+
+# --- Ticker mapping report (per DR-list version) ---
+# TradingView symbols ที่ resolve ไม่ได้ล่าสุด {ticker: {...}} (ลบออกเมื่อดึงสำเร็จ)
+_tv_resolution_failures = {}
+_mapping_report_logged_version = None
+
+
+def _note_tv_resolution(ticker, exchange, tv_symbol, error=None, tried=None):
+    """Record the outcome of a TradingView lookup for the mapping report."""
+    if not ticker:
+        return
+    if error is None:
+        _tv_resolution_failures.pop(ticker, None)
+        return
+    _tv_resolution_failures[ticker] = {
+        "ticker": ticker,
+        "exchange": exchange or "",
+        "tv_symbol": tv_symbol,
+        "tried": list(tried or [tv_symbol]),
+        "error": str(error),
+        "at": datetime.now(ZoneInfo("Asia/Bangkok")).isoformat(),
+    }
+
+
+def _build_mapping_report(snap):
+    """Market / exchange distribution of the DR universe (no network)."""
+    total_tickers = 0
+    market_counts = {}
+    exchange_counts = {}
+    no_exchange = []
+
+    for item in snap["rows"]:
+        u_code = dr_universe.underlying_code(item)
+        if not u_code:
+            continue
+        exchange = item.get("underlyingExchange", "")
+        market = market_code_from_exchange(exchange)
+        total_tickers += 1
+        market_counts[market] = market_counts.get(market, 0) + 1
+        if exchange:
+            if exchange not in exchange_counts:
+                exchange_counts[exchange] = {"count": 0, "market": market}
+            exchange_counts[exchange]["count"] += 1
+        else:
+            no_exchange.append(u_code)
+
+    markets = {}
+    for market in sorted(market_counts):
+        count = market_counts[market]
+        markets[market] = {
+            "dr_count": count,
+            "pct": round(count / total_tickers * 100, 1) if total_tickers > 0 else 0,
+            "underlyings": len(snap["market_items"].get(market, [])),
+            "scheduled": market in MARKET_OPEN_CONFIG,
+            "exchanges": sorted(ex for ex, info in exchange_counts.items() if info["market"] == market),
+        }
+
+    # Underlyings ที่ไม่มี exchange (ถูก default เป็น US) หรืออยู่ใน market ที่ไม่มี scheduler
+    unmapped = []
+    for it in snap["underlying_items"]:
+        if not it["u_exch"]:
+            unmapped.append({"ticker": it["u_code"], "dr_symbol": it["dr_sym"], "reason": "no_exchange", "market": it["market"]})
+        elif it["market"] not in MARKET_OPEN_CONFIG:
+            unmapped.append({"ticker": it["u_code"], "dr_symbol": it["dr_sym"], "reason": "unscheduled_market", "market": it["market"]})
+
+    return {
+        "dr_version": snap["version"],
+        "source": snap["source"],
+        "total_tickers": total_tickers,
+        "total_underlyings": len(snap["underlying_items"]),
+        "markets": markets,
+        "market_counts": market_counts,
+        "exchanges": [
+            {"exchange": ex, "market": info["market"], "count": info["count"]}
+            for ex, info in sorted(exchange_counts.items(), key=lambda x: x[1]["count"], reverse=True)
+        ],
+        "exchange_counts": exchange_counts,
+        "no_exchange_tickers": sorted(set(no_exchange)),
+        "unmapped_tickers": unmapped,
+    }
+
+
+def get_mapping_report():
+    """Cached mapping report for the current DR-list version plus live TradingView failures."""
+    report = dict(dr_universe.derived("mapping_report", _build_mapping_report))
+    report["tv_resolution_failures"] = sorted(_tv_resolution_failures.values(), key=lambda f: f["ticker"])
+    return report
+
+
+def log_mapping_report(report=None):
+    """พิมพ์สรุปการ mapping ครั้งเดียวต่อ DR-list version"""
+    global _mapping_report_logged_version
+    report = report or get_mapping_report()
+    if report["dr_version"] == _mapping_report_logged_version:
+        return report
+    _mapping_report_logged_version = report["dr_version"]
+
+    total_tickers = report["total_tickers"]
+    print("\n" + "=" * 80)
+    print(f"[MAPPING ANALYSIS] DR list version {report['dr_version']} ({report['source']})")
+    print(f"  จำนวน Tickers ทั้งหมดจาก DR API: {total_tickers}")
+    print(f"  จำนวน Markets ที่พบ: {len(report['markets'])}")
+    print(f"  จำนวน Exchanges ที่พบ: {len(report['exchanges'])}")
+    if report["no_exchange_tickers"]:
+        print(f"  Tickers ที่ไม่มี Exchange: {len(report['no_exchange_tickers'])}")
+    for market, info in report["markets"].items():
+        print(f"  {market:3s}: {info['dr_count']:4d} tickers ({info['pct']:5.1f}%)")
+    print("=" * 80 + "\n")
+    return report
 
 
 async def analyze_all_tickers():
     """
-    วิเคราะห์ tickers ทั้งหมดจาก DR API และแสดงสรุปการ mapping
+    วิเคราะห์ tickers ทั้งหมดจาก DR universe และแสดงสรุปการ mapping
+    (คำนวณครั้งเดียวต่อ DR-list version; ใช้ snapshot ใน memory)
     """
     try:
-        async with httpx.AsyncClient() as client:
-            r_dr = await client.get(DR_LIST_URL, timeout=20)
-            r_dr.raise_for_status()
-            rows = r_dr.json().get("rows", [])
-            
-            print("\n" + "=" * 80)
-            print("[MAPPING ANALYSIS] วิเคราะห์การ Mapping Tickers ทั้งหมด")
-            print("=" * 80)
-            
-            total_tickers = 0
-            market_counts = {}
-            exchange_counts = {}
-            unmapped_tickers = []
-            
-            for item in rows:
-                u_code = item.get("underlying") or (item.get("symbol") or "").replace("80", "").replace("19", "")
-                if u_code:
-                    u_code = u_code.strip().upper()
-                    exchange = item.get("underlyingExchange", "")
-                    market = market_code_from_exchange(exchange)
-                    
-                    total_tickers += 1
-                    
-                    # นับตาม market
-                    if market not in market_counts:
-                        market_counts[market] = 0
-                    market_counts[market] += 1
-                    
-                    # นับตาม exchange
-                    if exchange:
-                        if exchange not in exchange_counts:
-                            exchange_counts[exchange] = {"count": 0, "market": market}
-                        exchange_counts[exchange]["count"] += 1
-                    else:
-                        unmapped_tickers.append(u_code)
-            
-            print(f"\n[SUMMARY] สรุปการ Mapping:")
-            print(f"  จำนวน Tickers ทั้งหมดจาก DR API: {total_tickers}")
-            print(f"  จำนวน Markets ที่พบ: {len(market_counts)}")
-            print(f"  จำนวน Exchanges ที่พบ: {len(exchange_counts)}")
-            if unmapped_tickers:
-                print(f"  Tickers ที่ไม่มี Exchange: {len(unmapped_tickers)}")
-            
-            print(f"\n[MARKET DISTRIBUTION] แยกตาม Market:")
-            for market in sorted(market_counts.keys()):
-                count = market_counts[market]
-                pct = (count / total_tickers * 100) if total_tickers > 0 else 0
-                print(f"  {market:3s}: {count:4d} tickers ({pct:5.1f}%)")
-            
-            print(f"\n[EXCHANGE DISTRIBUTION] แยกตาม Exchange (Top 20):")
-            sorted_exchanges = sorted(exchange_counts.items(), key=lambda x: x[1]["count"], reverse=True)
-            for exchange, info in sorted_exchanges[:20]:
-                count = info["count"]
-                market = info["market"]
-                print(f"  {exchange:60s} -> {market:3s} ({count:3d} tickers)")
-            
-            if len(sorted_exchanges) > 20:
-                print(f"  ... และอีก {len(sorted_exchanges) - 20} exchanges")
-            
-            # ตรวจสอบ US exchanges
-            print(f"\n[US EXCHANGES] Exchange ที่ Map เป็น US:")
-            us_exchanges = {ex: info for ex, info in exchange_counts.items() if info["market"] == "US"}
-            if us_exchanges:
-                total_us = sum(info["count"] for info in us_exchanges.values())
-                print(f"  พบ {len(us_exchanges)} unique exchanges, รวม {total_us} tickers")
-                for exchange, info in sorted(us_exchanges.items(), key=lambda x: x[1]["count"], reverse=True):
-                    print(f"    {exchange:60s}: {info['count']:3d} tickers")
-            else:
-                print("  ไม่พบ exchange ที่ map เป็น US")
-            
-            # ตรวจสอบ HK exchanges
-            print(f"\n[HK EXCHANGES] Exchange ที่ Map เป็น HK:")
-            hk_exchanges = {ex: info for ex, info in exchange_counts.items() if info["market"] == "HK"}
-            if hk_exchanges:
-                total_hk = sum(info["count"] for info in hk_exchanges.values())
-                print(f"  พบ {len(hk_exchanges)} unique exchanges, รวม {total_hk} tickers")
-                for exchange, info in sorted(hk_exchanges.items(), key=lambda x: x[1]["count"], reverse=True):
-                    print(f"    {exchange:60s}: {info['count']:3d} tickers")
-            else:
-                print("  ไม่พบ exchange ที่ map เป็น HK")
-            
-            print("=" * 80 + "\n")
-            
-            return {
-                "total_tickers": total_tickers,
-                "market_counts": market_counts,
-                "exchange_counts": exchange_counts,
-            }
+        await dr_universe.refresh()
+        return log_mapping_report()
     except Exception as e:
         print(f"[MAPPING ANALYSIS] Error: {e}")
         import traceback
@@ -1936,99 +1929,19 @@ async def fetch_market_history(market_code: str):
     print(f"[History] [{market_code}] Starting fetch at {now_thai.strftime('%Y-%m-%d %H:%M:%S')} ไทย")
     
     async with httpx.AsyncClient() as client:
-        # Get DR list
-        try:
-            r_dr = await client.get(DR_LIST_URL, timeout=20)
-            r_dr.raise_for_status()
-            rows = r_dr.json().get("rows", [])
-        except Exception as dr_e:
-            print(f"[History] [{market_code}] Could not fetch DR list: {dr_e}")
+        # Get DR list (shared DR universe; items are already deduped per underlying for this market)
+        universe = await dr_universe.refresh(client)
+        if not universe["rows"]:
+            print(f"[History] [{market_code}] Could not fetch DR list")
             return
         
-        # วิเคราะห์ข้อมูลทั้งหมดก่อน (แสดงครั้งแรกเท่านั้น)
-        if not hasattr(fetch_market_history, "_analysis_done"):
-            await analyze_all_tickers()
-            fetch_market_history._analysis_done = True
+        # สรุปการ mapping (แสดงครั้งเดียวต่อ DR-list version)
+        log_mapping_report()
         
         # Filter tickers for this market
-        market_tickers = []
-        all_exchanges = set()  # Debug: เก็บ exchange names ทั้งหมด
-        total_from_dr = 0
-        
-        for item in rows:
-            u_code = item.get("underlying") or (item.get("symbol") or "").replace("80", "").replace("19", "")
-            if u_code:
-                u_code = u_code.strip().upper()
-                total_from_dr += 1
-                exchange = item.get("underlyingExchange", "")
-                if exchange:
-                    all_exchanges.add(exchange)  # Debug: เก็บ exchange name
-                ticker_market = market_code_from_exchange(exchange)
-                if ticker_market == market_code:
-                    market_tickers.append({
-                        "u_code": u_code,
-                        "u_name": item.get("underlyingName", ""),
-                        "u_exch": exchange,
-                        "dr_sym": item.get("symbol", ""),
-                    })
-
-        # Deduplicate market_tickers by underlying code to avoid fetching same underlying multiple times
-        if market_tickers:
-            grouped = {}
-            for it in market_tickers:
-                code = (it.get("u_code") or "").strip().upper()
-                if not code:
-                    continue
-                grouped.setdefault(code, []).append(it)
-
-            deduped_list = []
-            for code, lst in grouped.items():
-                if len(lst) == 1:
-                    deduped_list.append(lst[0])
-                    continue
-
-                # Prefer item that has a DR symbol (dr_sym) if available
-                preferred = None
-                for it in lst:
-                    if it.get("dr_sym"):
-                        preferred = it
-                        break
-
-                # If none has dr_sym, use market-specific exchange keyword matching to choose best row
-                if preferred is None:
-                    keywords = []
-                    if market_code == "HK":
-                        keywords = ["HONG", "HK", "HKEX", "SEHK"]
-                    elif market_code == "US":
-                        keywords = ["NASDAQ", "NYSE", "AMEX"]
-                    elif market_code in ("NL", "FR", "IT", "DK"):
-                        keywords = ["EURONEXT", "AMSTERDAM", "MILAN", "PARIS", "COPENHAGEN"]
-                    elif market_code == "JP":
-                        keywords = ["TSE", "TYO", "TOKYO"]
-                    elif market_code == "SG":
-                        keywords = ["SGX", "SINGAPORE"]
-                    elif market_code == "CN":
-                        keywords = ["SSE", "SHANGHAI", "SZSE", "SHENZHEN"]
-
-                    for kw in keywords:
-                        found = next((it for it in lst if kw in (it.get("u_exch") or "").upper()), None)
-                        if found:
-                            preferred = found
-                            break
-
-                # Fallback to first occurrence
-                if preferred is None:
-                    preferred = lst[0]
-
-                if len(lst) > 1:
-                    try:
-                        print(f"[History] [{market_code}] Deduped {code}: kept exchange {preferred.get('u_exch')} (removed {len(lst)-1})")
-                    except Exception:
-                        pass
-
-                deduped_list.append(preferred)
-
-            market_tickers = deduped_list
+        market_tickers = dr_universe.market_items(market_code)
+        all_exchanges = universe["exchanges"]  # Debug: exchange names ทั้งหมด
+        total_from_dr = sum(len(v) for v in universe["by_underlying"].values())
         
         print(f"[History] [{market_code}] Total tickers from DR API: {total_from_dr}")
         print(f"[History] [{market_code}] Tickers mapped to {market_code}: {len(market_tickers)}")
@@ -2166,6 +2079,7 @@ async def fetch_market_history(market_code: str):
         
         try:
             fetched_count = 0
+            fetched_tickers = []
             skipped_count = 0
             
             for item in market_tickers:
@@ -2255,6 +2169,7 @@ async def fetch_market_history(market_code: str):
                 
                 if upsert_success:
                     fetched_count += 1
+                    fetched_tickers.append(ticker)
                 else:
                     print(f"[History] [{market_code}] Failed to upsert {ticker} after retries")
                 
@@ -2314,10 +2229,16 @@ async def fetch_market_history(market_code: str):
                       f"Before commit for {market_code}", {"market_code": market_code, "fetched_count": fetched_count})
             # #endregion
             
+            try:
+                accuracy_cube.flush_dirty(cur)
+            except Exception as cube_e:
+                print(f"[Accuracy] [{market_code}] Accuracy cube refresh failed: {cube_e}")
+
             for commit_retry in range(3):
                 try:
-                    con.commit()
+                    commit_and_bump(con, fetched_tickers)
                     commit_success = True
+                    apply_leaderboard_updates(con)
                     # #region agent log
                     debug_log(session_id, run_id, "F", f"fetch_market_history:{market_code}:commit_success",
                               f"Commit successful for {market_code}", {"market_code": market_code, "retry": commit_retry})
@@ -2374,6 +2295,7 @@ async def fetch_market_history(market_code: str):
             traceback.print_exc()
         finally:
             if con:
+                discard_leaderboard_updates(con)
                 con.close()
 
 
@@ -2532,7 +2454,8 @@ async def history_updater():
     """
     # วิเคราะห์ข้อมูลทั้งหมดเมื่อเริ่มต้นระบบ
     print("\n[History] Initializing history updater...")
-    await analyze_all_tickers()
+    # ใช้ snapshot ที่โหลดไว้แล้ว (local file) - ไม่ยิง network ตอน boot
+    log_mapping_report()
     
     # เริ่ม scheduler สำหรับทุก market
     markets = list(MARKET_OPEN_CONFIG.keys())
@@ -2552,12 +2475,13 @@ async def lifespan(app: FastAPI):
     init_database()
     migrate_from_json_if_needed()
     
-    # Populate accuracy data สำหรับข้อมูลที่มีใน rating_history แล้ว
-    print("\n[Startup] Populating accuracy data from existing rating_history...")
-    populate_accuracy_on_startup()
+    # Populate accuracy data (เฉพาะที่ขาด/ไม่ตรง) ใน background - ดู /ready
+    print("\n[Startup] Populating accuracy data from existing rating_history (background)...")
+    start_accuracy_population()
     
     asyncio.create_task(background_updater())
     asyncio.create_task(history_updater())
+    asyncio.create_task(tracking_ingest.run_flusher())
     # accuracy_updater removed - accuracy is now calculated immediately when rating_history is updated
     yield
 
@@ -2573,7 +2497,7 @@ app.add_middleware(
 )
 
 # --- Tracking Models & Endpoints ---
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter, ValidationError
 
 class TrackingEvent(BaseModel):
     session_id: str
@@ -2587,95 +2511,89 @@ class TrackingEvent(BaseModel):
 @app.post("/api/track")
 async def track_event(event: TrackingEvent, req: Request):
     """
-    Receive tracking events from frontend and save to user_tracking (realtime) 
-    and user_page_analytics (aggregated).
+    Receive tracking events from frontend. Events are deduped in memory and queued;
+    tracking_ingest writes them to user_tracking (detail) and user_page_analytics
+    (aggregated) in batches, so no DB work happens on the request path.
     """
     try:
         # Note: logic aligned with user_behavior table (capturing IP, no user_id)
-        
-        client_ip = req.client.host
-        page_path = event.page_path
-        
-        con = sqlite3.connect(DB_FILE)
-        cur = con.cursor()
-        
+        result = tracking_ingest.enqueue(
+            req.client.host,
+            event.session_id,
+            event.event_type,
+            event.event_data,
+            event.page_path,
+            event.timestamp,
+            event.user_agent
+        )
+        if result == "duplicate":
+            return {"status": "ok", "saved": False, "reason": "Duplicate event ignored (sequential match)"}
+        if result == "dropped":
+            return {"status": "ok", "saved": False, "reason": "Tracking queue full"}
+        return {"status": "ok", "saved": True}
+    except Exception as e:
+        print(f"Tracking Error: {e}")
+        return {"status": "error", "message": str(e)}
 
+TRACK_BATCH_MAX_EVENTS = 500
+TRACK_BATCH_MAX_BYTES = 512 * 1024
+_tracking_events_adapter = TypeAdapter(list[TrackingEvent])
 
 
-        # Check for duplicate events (Strict Debounce - Sequential)
-        # If the latest event for this session is IDENTICAL to the current one, ignore it.
-        try:
-            cur.execute("""
-                SELECT event_data 
-                FROM user_tracking 
-                WHERE session_id = ? 
-                AND event_type = ? 
-                AND page_path = ? 
-                ORDER BY id DESC 
-                LIMIT 1
-            """, (event.session_id, event.event_type, page_path))
-            
-            last_record = cur.fetchone()
-            if last_record:
-                last_data_str = last_record[0]
-                
-                # Normalize JSON for comparison (sort keys)
-                try:
-                    current_data_str = json.dumps(event.event_data, sort_keys=True)
-                    # Try to parse last_data_str to re-dump with sort_keys=True to be sure
-                    last_data_obj = json.loads(last_data_str)
-                    last_data_normalized = json.dumps(last_data_obj, sort_keys=True)
-                except Exception:
-                    # Fallback to simple string comparison if parsing fails
-                    current_data_str = json.dumps(event.event_data)
-                    last_data_normalized = last_data_str
-
-                if last_data_normalized == current_data_str:
-                     # It's a duplicate (sequential), ignore it regardless of time
-                     con.close()
-                     return {"status": "ok", "saved": False, "reason": "Duplicate event ignored (sequential match)"}
-        except Exception as e:
-            print(f"⚠️ Error checking duplicates: {e}")
+@app.post("/api/track/batch")
+async def track_events_batch(req: Request):
+    """
+    Many tracking events in one request: a JSON array of TrackingEvent (or {"events": [...]}).
+    Accepts any content type so the frontend can use navigator.sendBeacon / text/plain
+    (no CORS preflight). The array is validated in one pass; if some events are invalid,
+    the valid ones are still queued.
+    """
+    body = await req.body()
+    if len(body) > TRACK_BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Tracking batch too large")
+    try:
+        raw = json.loads(body or b"[]")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of events")
+    if isinstance(raw, dict):
+        raw = raw.get("events")
+    if not isinstance(raw, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of events")
+    if len(raw) > TRACK_BATCH_MAX_EVENTS:
+        raise HTTPException(status_code=413, detail=f"At most {TRACK_BATCH_MAX_EVENTS} events per batch")
 
-        # 1. Save detailed event log to user_tracking
-        cur.execute("""
-            INSERT INTO user_tracking 
-            (ip_address, session_id, event_type, event_data, page_path, timestamp, user_agent)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
+    try:
+        events = _tracking_events_adapter.validate_python(raw)
+    except ValidationError:
+        # fall back to per-event validation so one bad event does not drop the whole batch
+        events = []
+        for item in raw:
+            try:
+                events.append(TrackingEvent.model_validate(item))
+            except ValidationError:
+                pass
+
+    client_ip = req.client.host
+    counts = {"queued": 0, "duplicate": 0, "dropped": 0}
+    for event in events:
+        result = tracking_ingest.enqueue(
             client_ip,
-            event.session_id, 
-            event.event_type, 
-            json.dumps(event.event_data), 
-            page_path, 
-            event.timestamp, 
+            event.session_id,
+            event.event_type,
+            event.event_data,
+            event.page_path,
+            event.timestamp,
             event.user_agent
-        ))
-
-        # 2. Update aggregated stats (for quick summary)
-        # Ensure table exists (just in case)
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS user_page_analytics (
-                ip_address TEXT, 
-                page_path TEXT, 
-                view_count INTEGER,
-                PRIMARY KEY (ip_address, page_path)
-            )
-        """)
-        
-        cur.execute("""
-            INSERT INTO user_page_analytics (ip_address, page_path, view_count)
-            VALUES (?, ?, 1)
-            ON CONFLICT(ip_address, page_path) DO UPDATE SET
-                view_count = view_count + 1
-        """, (client_ip, page_path))
-        
-        con.commit()
-        con.close()
-        return {"status": "ok", "saved": True}
-    except Exception as e:
-        print(f"Tracking Error: {e}")
-        return {"status": "error", "message": str(e)}
+        )
+        counts[result] += 1
+    return {
+        "status": "ok",
+        "received": len(raw),
+        "saved": counts["queued"],
+        "duplicates": counts["duplicate"],
+        "dropped": counts["dropped"],
+        "invalid": len(raw) - len(events),
+    }
 
 # --- Auth Models & Endpoints ---
 class AuthRequest(BaseModel):
@@ -2717,66 +2635,169 @@ async def check_auth(req: Request):
         else:
             # Session expired, remove it
             del authorized_ips[client_ip]
-    
+
     return {"authenticated": False}
 
+
+def require_authorized(req: Request):
+    """Raise 401 unless the client IP has an active Stats session (used by admin endpoints)."""
+    client_ip = req.client.host if req.client else None
+    expiry = authorized_ips.get(client_ip)
+    if not expiry or datetime.now().timestamp() >= expiry:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+# --- Admin: History Backfill ---
+
+class BackfillRequest(BaseModel):
+    markets: list[str]
+    start: str
+    end: Optional[str] = None
+    resume: bool = True
+    max_concurrency: Optional[int] = None
+
+_backfill_task = None
+
+@app.post("/api/admin/backfill")
+async def start_backfill(request: BackfillRequest, req: Request):
+    """
+    Start a history backfill for markets/date range in the background (see history_backfill.py).
+    Progress and ETA: GET /api/admin/backfill/status
+    """
+    global _backfill_task
+    require_authorized(req)
+    import history_backfill
+
+    if _backfill_task is not None and not _backfill_task.done():
+        raise HTTPException(status_code=409, detail="A backfill is already running")
+    try:
+        start = datetime.strptime(request.start, "%Y-%m-%d").date()
+        end = datetime.strptime(request.end, "%Y-%m-%d").date() if request.end else datetime.now(ZoneInfo("Asia/Bangkok")).date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start/end must be YYYY-MM-DD")
+    unknown = [m for m in request.markets if m.strip().upper() not in MARKET_OPEN_CONFIG]
+    if unknown or end < start:
+        raise HTTPException(status_code=400, detail=f"Invalid markets {unknown}" if unknown else "end must not be before start")
+
+    async def _run():
+        try:
+            await history_backfill.run_backfill(request.markets, start, end, resume=request.resume, max_concurrency=request.max_concurrency)
+        except Exception as e:
+            print(f"[Backfill] Error: {e}")
+
+    _backfill_task = asyncio.create_task(_run())
+    return {"started": True, "markets": request.markets, "start": start.isoformat(), "end": end.isoformat()}
+
+# --- Admin: Parallel Accuracy Rebuild ---
+
+class AccuracyRebuildRequest(BaseModel):
+    workers: Optional[int] = None
+    tickers: Optional[list[str]] = None
+    window_days: int = 90
+
+_accuracy_rebuild_task = None
+
+@app.post("/api/admin/accuracy/rebuild")
+async def start_accuracy_rebuild(request: AccuracyRebuildRequest, req: Request):
+    """
+    Rebuild rating_accuracy for all (or the given) tickers across worker processes (see accuracy_rebuild.py).
+    Progress: GET /api/admin/accuracy/rebuild/status
+    """
+    global _accuracy_rebuild_task
+    require_authorized(req)
+    import accuracy_rebuild
+
+    # rating_accuracy rows here are the live 90-day aggregates (incremental updater / cube / leaderboard)
+    # -> other windows only via the CLI against a copy of the DB
+    if request.window_days != accuracy_rebuild.ACCURACY_WINDOW_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"window_days must be {accuracy_rebuild.ACCURACY_WINDOW_DAYS} (other windows: accuracy_rebuild.py --db <copy>)",
+        )
+    if (_accuracy_rebuild_task is not None and not _accuracy_rebuild_task.done()) or accuracy_rebuild.get_rebuild_status()["running"]:
+        raise HTTPException(status_code=409, detail="An accuracy rebuild is already running")
+
+    async def _run():
+        try:
+            await asyncio.to_thread(accuracy_rebuild.rebuild_all, DB_FILE, request.workers, request.tickers,
+                                    request.window_days, commit=commit_and_bump)
+        except Exception as e:
+            print(f"[AccuracyRebuild] Error: {e}")
+        finally:
+            _accuracy_window_states.clear()
+            if _leaderboard_loaded:
+                await asyncio.to_thread(load_leaderboard)
+
+    _accuracy_rebuild_task = asyncio.create_task(_run())
+    return {"started": True, "workers": request.workers or os.cpu_count(), "tickers": request.tickers or "all"}
+
+@app.get("/api/admin/accuracy/rebuild/status")
+async def accuracy_rebuild_status(req: Request):
+    require_authorized(req)
+    import accuracy_rebuild
+    return accuracy_rebuild.get_rebuild_status()
+
+@app.get("/api/accuracy/population-status")
+def accuracy_population_status():
+    """Progress of the startup accuracy population job."""
+    return get_accuracy_population_status()
+
+
+@app.get("/ready")
+def ratings_ready():
+    """Readiness probe (200 when accuracy population finished, 503 while running)."""
+    from fastapi.responses import JSONResponse
+    st = get_accuracy_population_status()
+    return JSONResponse(status_code=200 if is_ready() else 503, content={"ready": is_ready(), "accuracy_population": st})
+
+
+@app.get("/api/admin/track/status")
+async def track_ingest_status(req: Request):
+    """Tracking ingest buffer: queued / flushed / duplicates / dropped counters."""
+    require_authorized(req)
+    return tracking_ingest.get_status()
+
+
+@app.get("/api/admin/backfill/status")
+async def backfill_status(req: Request):
+    require_authorized(req)
+    import history_backfill
+    return history_backfill.get_backfill_status()
+
 # --- Analytics Endpoints ---
 
 @app.get("/api/analytics/summary")
 async def get_analytics_summary():
     """
-    Get summary analytics using real data from user_tracking and user_page_analytics.
-    - Active Users: Distinct sessions in last 5 minutes
-    - Unique Visitors: Distinct IPs from user_page_analytics
-    - Total Visits: Sum of view counts
+    Get summary analytics (rollups maintained on ingest, see analytics_rollup.py).
+    - Active Users: Sessions seen in the last 10 minutes (in-memory presence, + active_pages)
+    - Unique Visitors: Distinct IPs (HyperLogLog estimate)
+    - Total Visits: Page views
     """
     try:
-        con = sqlite3.connect(DB_FILE)
+        con = analytics_db.connect()
         cur = con.cursor()
         
-        # 1. Active Users (Live) - queries user_tracking for activity in last 10 minutes
-        # We use a slightly wider window (10 mins) to capture 'reading' users
-        active_users = 0
-        try:
-            cur.execute("""
-                SELECT COUNT(DISTINCT session_id) 
-                FROM user_tracking 
-                WHERE timestamp >= datetime('now', '-10 minutes')
-            """)
-            active_users = cur.fetchone()[0] or 0
-        except Exception:
-            active_users = 0
+        # 1. Active Users (Live) - sessions seen by the tracking ingest in the last 10 minutes
+        # (server receive time; a slightly wider window captures 'reading' users)
+        live = presence.snapshot()
+        active_users = live["active_users"]
 
-        # 2. Unique Visitors & Total Visits - from user_tracking (Real detailed logs)
-        # matches "Total Users" requirement to count all distinct users from DB
+        # 2. Unique Visitors (HyperLogLog of IPs) & Total Visits (page views) - lifetime rollup row
         unique_visitors = 0
         total_visits = 0
-        
         try:
-            # Check if table exists
-            cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_tracking'")
-            if cur.fetchone():
-                # Count distinct User IDs (Total Users)
-                cur.execute("SELECT COUNT(DISTINCT ip_address) FROM user_tracking")
-                unique_visitors = cur.fetchone()[0] or 0
-                
-                # Count total page views (Total Visits)
-                cur.execute("SELECT COUNT(*) FROM user_tracking WHERE event_type = 'page_view'")
-                total_visits = cur.fetchone()[0] or 0
+            totals = analytics_rollup.totals(cur)
+            unique_visitors = totals["unique_visitors"]
+            total_visits = totals["page_views"]
         except Exception:
             pass
 
-        # 3. Top Pages
+        # 3. Top Pages (all events per page, like user_page_analytics.view_count)
         top_pages = []
         try:
-            cur.execute("""
-                SELECT page_path, SUM(view_count) as total_views 
-                FROM user_page_analytics 
-                GROUP BY page_path 
-                ORDER BY total_views DESC
-                LIMIT 10
-            """)
-            top_pages = [{"page_path": row[0], "total_views": row[1]} for row in cur.fetchall()]
+            pages = analytics_rollup.page_totals(cur)
+            ranked = sorted(pages.items(), key=lambda kv: kv[1]["events"], reverse=True)[:10]
+            top_pages = [{"page_path": "/" + page, "total_views": v["events"]} for page, v in ranked]
         except Exception:
             pass
         
@@ -2786,20 +2807,58 @@ async def get_analytics_summary():
             "unique_visitors": unique_visitors,
             "total_visits": total_visits,
             "active_users": active_users,
+            "active_pages": live["pages"],
             "top_pages": top_pages
         }
     except Exception as e:
         print(f"Analytics Summary Error: {e}")
-        return {"unique_visitors": 0, "total_visits": 0, "active_users": 0, "top_pages": []}
+        return {"unique_visitors": 0, "total_visits": 0, "active_users": 0, "active_pages": {}, "top_pages": []}
+
+PRESENCE_STREAM_INTERVAL = 2  # seconds between presence checks per SSE client
+
+@app.get("/api/analytics/presence/stream")
+async def presence_stream(request: Request):
+    """SSE: {"type": "presence", "active_users", "pages"} whenever live presence changes."""
+    from fastapi.responses import StreamingResponse
+
+    async def event_generator():
+        last = None
+        idle = 0.0
+        try:
+            while True:
+                if await request.is_disconnected():
+                    break
+                snap = presence.snapshot()
+                if snap != last:
+                    last = snap
+                    idle = 0.0
+                    yield f"data: {json.dumps({'type': 'presence', **snap})}\n\n"
+                elif idle >= 30:
+                    idle = 0.0
+                    yield ": heartbeat\n\n"
+                await asyncio.sleep(PRESENCE_STREAM_INTERVAL)
+                idle += PRESENCE_STREAM_INTERVAL
+        except asyncio.CancelledError:
+            pass
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
 
 @app.get("/api/analytics/weekly-trend")
 async def get_weekly_trend():
     """
-    Get page view data for weekly trend chart using REAL data from user_tracking.
+    Get page view data for weekly trend chart from the daily analytics rollups.
     Shows 2 week ranges (Last week vs This week).
     """
     try:
-        con = sqlite3.connect(DB_FILE)
+        con = analytics_db.connect()
         cur = con.cursor()
         
         # Define ranges
@@ -2842,23 +2901,10 @@ async def get_weekly_trend():
             year_suffix = start_dt.strftime("%y")
             date_str = f"{start_dt.strftime('%d %b')} - {end_dt.strftime('%d %b')} {year_suffix}"
             
-            # Query user_tracking for this range
-            start_iso = start_dt.isoformat()
-            end_iso = end_dt.isoformat()
-            if not isinstance(end_iso, str):
-                 end_iso = str(end_iso)
-                 
-            # Query pages. Note: timestamps stored from frontend are usually ISO UTC or local.
-            # Comparison with string usually works for ISO format.
-            cur.execute("""
-                SELECT page_path, COUNT(*) as count
-                FROM user_tracking
-                WHERE timestamp >= ? AND timestamp <= ?
-                AND event_type = 'page_view'
-                GROUP BY page_path
-            """, (start_iso, end_iso))
-            
-            rows = cur.fetchall()
+            # Page views per normalized page from day buckets in this range
+            views = analytics_rollup.page_views_between(
+                cur, start_dt.strftime("%Y-%m-%d"), end_dt.strftime("%Y-%m-%d")
+            )
             
             data_point = {"date": date_str}
             
@@ -2867,20 +2913,16 @@ async def get_weekly_trend():
                 if p_name != 'Stats':
                     data_point[p_name] = 0
             
-            for row in rows:
-                raw_path = row[0].strip().lower()
-                parts = [p for p in raw_path.split('/') if p]
-                page_path = parts[-1] if parts else 'home'
-                
+            for page_path, count in views.items():
                 page_name = page_map.get(page_path, page_path.title())
                 
                 if page_name == 'Stats':
                     continue
                     
                 if page_name in data_point:
-                    data_point[page_name] += row[1]
+                    data_point[page_name] += count
                 else:
-                    data_point[page_name] = row[1]
+                    data_point[page_name] = count
             
             result.append(data_point)
             
@@ -2900,17 +2942,11 @@ async def get_monthly_trend():
     Shows current month with page distribution (e.g., "Jan 2026").
     """
     try:
-        con = sqlite3.connect(DB_FILE)
+        con = analytics_db.connect()
         cur = con.cursor()
         
-        # Get all page views aggregated
-        cur.execute("""
-            SELECT page_path, SUM(view_count) as views
-            FROM user_page_analytics 
-            GROUP BY page_path
-        """)
-        
-        rows = cur.fetchall()
+        # All events per page (lifetime rollup rows)
+        pages = analytics_rollup.page_totals(cur)
         con.close()
         
         # Map page paths to names and aggregate totals
@@ -2926,13 +2962,8 @@ async def get_monthly_trend():
         
         # Calculate totals per page
         page_totals = {}
-        for row in rows:
-            raw_path = row[0].strip().lower()
-            parts = [p for p in raw_path.split('/') if p]
-            page_path = parts[-1] if parts else 'home'
-            if not page_path:
-                page_path = 'home'
-            views = row[1]
+        for page_path, v in pages.items():
+            views = v["events"]
             
             page_name = page_map.get(page_path, page_path.title())
             # Skip stats page from trend
@@ -3003,22 +3034,128 @@ def get_intraday_history(ticker: str, timeframe: str = Query("1D", description="
         raise HTTPException(status_code=404, detail="No intraday history found for this ticker")
 
     # Map selected columns to a consistent schema expected by the frontend.
-    result = []
-    for row in rows:
-        result.append({
-            "timestamp": row[0],
-            # Use the same keys (`daily_rating`, `daily_val`) so frontend logic is unchanged;
-            # when timeframe=="1W" these fields contain weekly values.
-            "daily_rating": row[1],
-            "daily_val": row[2],
-            "price": row[3],
-            "change_pct": row[4],
-            "change_abs": row[5],
-            "currency": row[6],
-            "at_price": row[7],
-        })
+    result = [_intraday_item(row) for row in rows]
     return {"ticker": ticker, "intraday_history": result}
 
+
+def _intraday_item(row):
+    """(timestamp, rating, val, price, change_pct, change_abs, currency, at_price) -> intraday item."""
+    return {
+        "timestamp": row[0],
+        # Use the same keys (`daily_rating`, `daily_val`) so frontend logic is unchanged;
+        # when timeframe=="1W" these fields contain weekly values.
+        "daily_rating": row[1],
+        "daily_val": row[2],
+        "price": row[3],
+        "change_pct": row[4],
+        "change_abs": row[5],
+        "currency": row[6],
+        "at_price": row[7],
+    }
+
+
+INTRADAY_SERIES_MAX_POINTS = 5000
+
+
+def _lttb_indices(x, y, max_points: int):
+    """
+    Largest-Triangle-Three-Buckets: indices of at most `max_points` points that keep the
+    visual shape of (x, y). First and last points are always kept.
+    """
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return list(range(min(n, max(max_points, 0))))
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)  # buckets over points 1..n-2
+    picked = [0]
+    a = 0
+    for b in range(max_points - 2):
+        lo, hi = edges[b], max(edges[b + 1], edges[b] + 1)
+        # average of the next bucket (or the last point)
+        if b + 2 < len(edges):
+            nlo, nhi = edges[b + 1], max(edges[b + 2], edges[b + 1] + 1)
+            avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        else:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = int(lo) + int(area.argmax())
+        picked.append(a)
+    picked.append(n - 1)
+    return picked
+
+
+# Intraday series from rating_stats (one row per rating change), downsampled for charts
+@app.get("/api/intraday-series/{ticker}")
+def get_intraday_series(
+    ticker: str,
+    timeframe: str = Query("1D", description="Timeframe: 1D or 1W"),
+    from_ts: Optional[str] = Query(None, alias="from", description="Start timestamp/date (ISO), inclusive"),
+    to_ts: Optional[str] = Query(None, alias="to", description="End timestamp/date (ISO), inclusive"),
+    max_points: int = Query(500, ge=3, le=INTRADAY_SERIES_MAX_POINTS, description="Max points returned (LTTB)")
+):
+    """
+    Price (at_price) + recommend value (daily_val / weekly_val) + rating from rating_stats,
+    between `from` and `to`, downsampled server-side with LTTB on price so the chart never
+    gets more than `max_points` points. Rows without at_price get the last known price
+    (leading rows the first known one); price is null only if the range has no price at all.
+    """
+    prefix = "weekly" if timeframe == "1W" else "daily"
+    sql = f"""
+        SELECT timestamp, at_price, {prefix}_val, {prefix}_rating
+        FROM rating_stats
+        WHERE ticker = ?
+    """
+    params = [ticker.upper()]
+    if from_ts:
+        sql += " AND timestamp >= ?"
+        params.append(from_ts)
+    if to_ts:
+        # date only -> whole day
+        sql += " AND timestamp <= ?"
+        params.append(to_ts + "T23:59:59.999999" if len(to_ts) == 10 else to_ts)
+    sql += " ORDER BY timestamp ASC"
+
+    con = sqlite3.connect(DB_FILE, timeout=5)
+    try:
+        rows = con.execute(sql, params).fetchall()
+    finally:
+        con.close()
+
+    total = len(rows)
+    price = np.array([np.nan if r[1] is None else r[1] for r in rows], dtype=float)
+    has_price = bool(total) and not np.isnan(price).all()
+    if has_price:
+        # forward/back fill missing prices
+        idx = np.where(np.isnan(price), 0, np.arange(total))
+        np.maximum.accumulate(idx, out=idx)
+        filled = price[idx]
+        first = np.argmax(~np.isnan(price))
+        filled[:first] = price[first]
+
+    keep = range(total)
+    if total > max_points:
+        x = np.arange(total, dtype=float)
+        try:
+            x = np.array([datetime.fromisoformat(r[0]).timestamp() for r in rows], dtype=float)
+        except (TypeError, ValueError):
+            pass  # unparsable timestamp -> evenly spaced
+        y = filled if has_price else np.array([r[2] or 0.0 for r in rows], dtype=float)
+        keep = _lttb_indices(x, y, max_points)
+
+    series = [
+        {"timestamp": rows[i][0], "price": float(filled[i]) if has_price else None,
+         "recommend": rows[i][2], "rating": rows[i][3]}
+        for i in keep
+    ]
+    return {
+        "ticker": ticker.upper(),
+        "timeframe": "1W" if timeframe == "1W" else "1D",
+        "from": from_ts,
+        "to": to_ts,
+        "total_points": total,
+        "returned_points": len(series),
+        "series": series,
+    }
+
 def calculate_accuracy_from_rating_change(history_rows, window_days=90):
 
     if not history_rows:
@@ -3185,6 +3322,322 @@ def calculate_accuracy_from_rating_change(history_rows, window_days=90):
         }
     }
 
+# --- Incremental sliding-window accuracy ---
+# (ticker, window_days) -> {"last_ts", "entries": deque, "sums": {...}}
+# entry = [timestamp, open, daily_with_neighbour, daily_alone, weekly_with_neighbour, weekly_alone]
+# outcome: 1 = correct, -1 = incorrect, 0 = ไม่นับ
+# "with_neighbour" ใช้ open ของแถวก่อนหน้า (ถ้าไม่มี open_prev) เหมือนตอนคำนวณจากทั้ง window;
+# แถวที่เก่าที่สุดใน window ไม่มีแถวก่อนหน้าให้ใช้ จึงใช้ค่า "alone" แทน
+_accuracy_window_states = {}
+# startup population รันใน worker thread พร้อมกับ market-close updater
+_accuracy_window_lock = threading.Lock()
+
+
+def _accuracy_outcome(row, neighbour_open=None):
+    rows = [row] if neighbour_open is None else [row, {"open": neighbour_open}]
+    res = calculate_accuracy_matching_frontend(rows, None, change_threshold=2.0)
+    return 1 if res["correct"] else (-1 if res["incorrect"] else 0)
+
+
+def _accuracy_window_entry(ts, daily_rating, daily_prev, weekly_rating, weekly_prev, change_pct, open_prev, open_price, neighbour_open):
+    daily = {"daily_rating": daily_rating, "daily_prev": daily_prev, "change_pct": change_pct, "open_prev": open_prev, "open": open_price}
+    weekly = {"rating": weekly_rating, "prev": weekly_prev, "change_pct": change_pct, "open_prev": open_prev, "open": open_price}
+    return [
+        ts, open_price,
+        _accuracy_outcome(daily, neighbour_open), _accuracy_outcome(daily),
+        _accuracy_outcome(weekly, neighbour_open), _accuracy_outcome(weekly),
+    ]
+
+
+def _window_push(state, entry):
+    sums = state["sums"]
+    for key, idx in (("daily", 2), ("weekly", 4)):
+        if entry[idx] == 1:
+            sums[key][0] += 1
+        elif entry[idx] == -1:
+            sums[key][1] += 1
+    state["entries"].append(entry)
+    state["last_ts"] = entry[0]
+
+
+def _window_drop(state, entry):
+    sums = state["sums"]
+    for key, idx in (("daily", 2), ("weekly", 4)):
+        if entry[idx] == 1:
+            sums[key][0] -= 1
+        elif entry[idx] == -1:
+            sums[key][1] -= 1
+
+
+def _new_window_state(entries=()):
+    state = {"last_ts": None, "entries": deque(), "sums": {"daily": [0, 0], "weekly": [0, 0]}}
+    for e in entries:
+        _window_push(state, list(e))
+    return state
+
+
+def _window_result(state, key):
+    """Totals for one timeframe in the shape returned by calculate_accuracy_matching_frontend."""
+    idx = 2 if key == "daily" else 4
+    correct, incorrect = state["sums"][key]
+    if state["entries"]:
+        oldest = state["entries"][0]
+        # แถวเก่าสุดไม่มี neighbour -> แทน outcome แบบ with ด้วยแบบ alone
+        correct += (oldest[idx + 1] == 1) - (oldest[idx] == 1)
+        incorrect += (oldest[idx + 1] == -1) - (oldest[idx] == -1)
+    total = correct + incorrect
+    accuracy = (correct / total * 100) if total > 0 else 0
+    return {"accuracy": round(accuracy), "correct": correct, "incorrect": incorrect, "total": total}
+
+
+def _rebuild_accuracy_window(cur, ticker, cutoff, ts):
+    """Load the rating_accuracy rows in [cutoff, ts) for one ticker (fallback / first use)."""
+    cur.execute("""
+        SELECT timestamp, daily_rating, daily_prev, weekly_rating, weekly_prev, change_pct, open_prev, open
+        FROM rating_accuracy
+        WHERE ticker=? AND timestamp >= ? AND timestamp < ?
+        ORDER BY timestamp ASC
+    """, (ticker, cutoff, ts))
+    state = _new_window_state()
+    neighbour_open = None
+    for r in cur.fetchall():
+        _window_push(state, _accuracy_window_entry(r[0], r[1], r[2], r[3], r[4], r[5], r[6], r[7], neighbour_open))
+        neighbour_open = r[7]
+    return state
+
+
+def _load_accuracy_window_state(cur, ticker, window_days):
+    # The persisted row is the source of truth: other writers (accuracy_rebuild.py, another
+    # process) drop or rewrite it, so the cached copy is used only while its saved_at matches.
+    cached = _accuracy_window_states.get((ticker, window_days))
+    try:
+        cur.execute("SELECT last_timestamp, entries, updated_at FROM accuracy_window_state WHERE ticker=? AND window_day=?", (ticker, window_days))
+        row = cur.fetchone()
+    except Exception:
+        return cached
+    if not row:
+        return None
+    if cached is not None and cached.get("saved_at") == row[2]:
+        return cached
+    state = _new_window_state(json.loads(row[1]))
+    state["last_ts"] = row[0]
+    state["saved_at"] = row[2]
+    return state
+
+
+def _save_accuracy_window_state(cur, ticker, window_days, state):
+    state["saved_at"] = datetime.now().isoformat()
+    _accuracy_window_states[(ticker, window_days)] = state
+    try:
+        cur.execute("""
+            INSERT OR REPLACE INTO accuracy_window_state (ticker, window_day, last_timestamp, entries, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (ticker, window_days, state["last_ts"], json.dumps(list(state["entries"])), state["saved_at"]))
+    except Exception:
+        # persistence is an optimization only; the state is re-validated against rating_accuracy on use
+        pass
+
+
+def drop_accuracy_window_state(cur, ticker):
+    """Forget the sliding-window state of a ticker (all windows) before recomputing its rows from an older timestamp."""
+    ticker = ticker.upper()
+    with _accuracy_window_lock:
+        for key in [k for k in _accuracy_window_states if k[0] == ticker]:
+            del _accuracy_window_states[key]
+        try:
+            cur.execute("DELETE FROM accuracy_window_state WHERE ticker=?", (ticker,))
+        except sqlite3.OperationalError:
+            pass  # older DB without the state table
+
+
+def advance_accuracy_window(cur, ticker, timestamp, window_days, daily_rating, daily_prev, weekly_rating, weekly_prev, change_pct, open_prev, open_price):
+    """
+    Add the rating_accuracy row at `timestamp` to the ticker's window and return
+    (daily_acc, weekly_acc) for the window (timestamp - window_days, timestamp].
+
+    O(1) amortized for in-order appends: expired rows are popped from the left and the
+    counters adjusted. The cached state is checked against rating_accuracy (count + latest
+    timestamp in the window) and rebuilt from the table only when it does not match, e.g.
+    after an out-of-order backfill, a deleted row or a restart without persisted state.
+    """
+    ticker = ticker.upper()
+    cur.execute(f"SELECT datetime(?, '-{int(window_days)} days')", (timestamp,))
+    cutoff = cur.fetchone()[0]
+    if cutoff is None:
+        empty = {"accuracy": 0, "correct": 0, "incorrect": 0, "total": 0}
+        return dict(empty), dict(empty)
+
+    with _accuracy_window_lock:
+        return _advance_accuracy_window_locked(cur, ticker, timestamp, window_days, cutoff, daily_rating, daily_prev,
+                                               weekly_rating, weekly_prev, change_pct, open_prev, open_price)
+
+
+def _advance_accuracy_window_locked(cur, ticker, timestamp, window_days, cutoff, daily_rating, daily_prev,
+                                    weekly_rating, weekly_prev, change_pct, open_prev, open_price):
+    state = _load_accuracy_window_state(cur, ticker, window_days)
+    if state is not None:
+        if state["last_ts"] is not None and timestamp < state["last_ts"]:
+            state = None
+        else:
+            entries = state["entries"]
+            # Re-saving the same snapshot replaces it
+            if entries and entries[-1][0] == timestamp:
+                _window_drop(state, entries.pop())
+            while entries and entries[0][0] < cutoff:
+                _window_drop(state, entries.popleft())
+            cur.execute("""
+                SELECT COUNT(*), MAX(timestamp) FROM rating_accuracy
+                WHERE ticker=? AND timestamp >= ? AND timestamp < ?
+            """, (ticker, cutoff, timestamp))
+            cnt, max_ts = cur.fetchone()
+            if cnt != len(entries) or max_ts != (entries[-1][0] if entries else None):
+                state = None
+
+    if state is None:
+        state = _rebuild_accuracy_window(cur, ticker, cutoff, timestamp)
+
+    neighbour_open = state["entries"][-1][1] if state["entries"] else None
+    _window_push(state, _accuracy_window_entry(timestamp, daily_rating, daily_prev, weekly_rating, weekly_prev, change_pct, open_prev, open_price, neighbour_open))
+    _save_accuracy_window_state(cur, ticker, window_days, state)
+    return _window_result(state, "daily"), _window_result(state, "weekly")
+
+
+# --- Accuracy leaderboard ---
+# อันดับ ticker ตาม accuracy ของแถวล่าสุดใน rating_accuracy (in-memory, เรียงไว้ตลอด)
+# key ในแต่ละ list = (-accuracy, -sample_size, ticker) -> bisect insert/remove, อ่านจากหัว list ได้เลย
+_leaderboard = {"1D": [], "1W": []}
+# ticker -> {"timestamp", "market", "1D": (accuracy, sample_size, correct, incorrect), "1W": (...)}
+_leaderboard_entries = {}
+_leaderboard_loaded = False
+_leaderboard_lock = threading.Lock()
+# updates staged per connection until its commit: id(con) -> (con, {ticker: (timestamp, market, daily, weekly)})
+# (con is kept so its id can't be reused while entries are pending)
+_leaderboard_pending = {}
+
+
+def _leaderboard_key(ticker, stats):
+    return (-(stats[0] or 0), -(stats[1] or 0), ticker)
+
+
+def _leaderboard_put(ticker, timestamp, market, daily, weekly):
+    """Replace a ticker's entry (caller holds _leaderboard_lock). Older timestamps are ignored."""
+    old = _leaderboard_entries.get(ticker)
+    if old is not None:
+        if timestamp < old["timestamp"]:
+            return
+        for tf in ("1D", "1W"):
+            lst = _leaderboard[tf]
+            i = bisect.bisect_left(lst, _leaderboard_key(ticker, old[tf]))
+            if i < len(lst) and lst[i][2] == ticker:
+                del lst[i]
+        if market is None:
+            market = old["market"]
+    entry = {"timestamp": timestamp, "market": market, "1D": daily, "1W": weekly}
+    _leaderboard_entries[ticker] = entry
+    for tf in ("1D", "1W"):
+        bisect.insort(_leaderboard[tf], _leaderboard_key(ticker, entry[tf]))
+
+
+def load_leaderboard(cur=None):
+    """(Re)build the leaderboard from the latest rating_accuracy row of every ticker."""
+    global _leaderboard_loaded
+    con = None
+    if cur is None:
+        con = sqlite3.connect(DB_FILE, timeout=5)
+        cur = con.cursor()
+    try:
+        cur.execute("""
+            SELECT a.ticker, a.timestamp,
+                   a.accuracy_daily, a.samplesize_daily, a.correct_daily, a.incorrect_daily,
+                   a.accuracy_weekly, a.samplesize_weekly, a.correct_weekly, a.incorrect_weekly,
+                   (SELECT h.market FROM rating_history h WHERE h.ticker = a.ticker ORDER BY h.timestamp DESC LIMIT 1)
+            FROM rating_accuracy a
+            JOIN (SELECT ticker, MAX(timestamp) AS ts FROM rating_accuracy GROUP BY ticker) m
+              ON m.ticker = a.ticker AND m.ts = a.timestamp
+        """)
+        rows = cur.fetchall()
+    finally:
+        if con:
+            con.close()
+    with _leaderboard_lock:
+        _leaderboard["1D"] = []
+        _leaderboard["1W"] = []
+        _leaderboard_entries.clear()
+        for r in rows:
+            _leaderboard_put(r[0], r[1], r[10], tuple(r[2:6]), tuple(r[6:10]))
+        _leaderboard_loaded = True
+    return len(rows)
+
+
+def update_leaderboard(cur, ticker, timestamp, daily, weekly):
+    """
+    Called after a rating_accuracy row is written: daily/weekly = (accuracy, sample_size, correct, incorrect).
+    Staged on the connection; apply_leaderboard_updates(con) after its commit makes it visible.
+    """
+    if not _leaderboard_loaded:
+        return  # first /api/leaderboard call loads everything from the DB
+    ticker = ticker.upper()
+    market = None
+    if ticker not in _leaderboard_entries:
+        cur.execute("SELECT market FROM rating_history WHERE ticker=? ORDER BY timestamp DESC LIMIT 1", (ticker,))
+        row = cur.fetchone()
+        market = row[0] if row else None
+    con = cur.connection
+    with _leaderboard_lock:
+        staged = _leaderboard_pending.setdefault(id(con), (con, {}))[1]
+        prev = staged.get(ticker)
+        if prev is None or timestamp >= prev[0]:
+            staged[ticker] = (timestamp, market if market is not None else (prev[1] if prev else None), daily, weekly)
+
+
+def apply_leaderboard_updates(con):
+    """Call right after con.commit(): publish the leaderboard updates staged on this connection."""
+    with _leaderboard_lock:
+        pending = _leaderboard_pending.pop(id(con), None)
+        if pending is None or pending[0] is not con or not _leaderboard_loaded:
+            return
+        for ticker, (timestamp, market, daily, weekly) in pending[1].items():
+            _leaderboard_put(ticker, timestamp, market, daily, weekly)
+
+
+def discard_leaderboard_updates(con):
+    """Drop staged updates of a connection that is closed / rolled back without committing."""
+    with _leaderboard_lock:
+        _leaderboard_pending.pop(id(con), None)
+
+
+def get_leaderboard(timeframe="1D", min_samples=0, market=None, limit=50, ascending=False):
+    if not _leaderboard_loaded:
+        load_leaderboard()
+    market = market.upper() if market else None
+    with _leaderboard_lock:
+        keys = _leaderboard[timeframe]
+        ordered = reversed(keys) if ascending else keys
+        items = []
+        for key in ordered:
+            ticker = key[2]
+            entry = _leaderboard_entries[ticker]
+            stats = entry[timeframe]
+            if (stats[1] or 0) < min_samples:
+                continue
+            if market and (entry["market"] or "").upper() != market:
+                continue
+            items.append({
+                "rank": len(items) + 1,
+                "ticker": ticker,
+                "market": entry["market"],
+                "accuracy": stats[0],
+                "sample_size": stats[1],
+                "correct": stats[2],
+                "incorrect": stats[3],
+                "timestamp": entry["timestamp"],
+            })
+            if len(items) >= limit:
+                break
+        total = len(keys)
+    return {"timeframe": timeframe, "total_tickers": total, "count": len(items), "items": items}
+
+
 def save_accuracy_to_db_new(cur, ticker, timestamp, price, price_prev, open_prev, change_pct, currency, high, low, window_days, accuracy_result, current_daily_rating=None, current_daily_prev=None, open_price=None):
     """
     บันทึก accuracy ลงในตาราง rating_accuracy (โครงสร้างใหม่)
@@ -3202,6 +3655,8 @@ def save_accuracy_to_db_new(cur, ticker, timestamp, price, price_prev, open_prev
         window_days: Number of days for the window
         accuracy_result: dict from calculate_accuracy_from_rating_change
     """
+    daily_rating = current_daily_rating if current_daily_rating is not None else accuracy_result["daily"]["rating"]
+    daily_prev = current_daily_prev if current_daily_prev is not None else accuracy_result["daily"]["prev"]
     cur.execute("""
         INSERT OR REPLACE INTO rating_accuracy 
         (ticker, timestamp, price, price_prev, open_prev, open, change_pct, currency, high, low, window_day,
@@ -3221,8 +3676,8 @@ def save_accuracy_to_db_new(cur, ticker, timestamp, price, price_prev, open_prev
         low,
         window_days,
         # Use the exact rating values from rating_history for this timestamp when available
-        (current_daily_rating if current_daily_rating is not None else accuracy_result["daily"]["rating"]),
-        (current_daily_prev if current_daily_prev is not None else accuracy_result["daily"]["prev"]),
+        daily_rating,
+        daily_prev,
         accuracy_result["daily"]["sample_size"],
         accuracy_result["daily"]["correct"],
         accuracy_result["daily"]["incorrect"],
@@ -3234,79 +3689,31 @@ def save_accuracy_to_db_new(cur, ticker, timestamp, price, price_prev, open_prev
         accuracy_result["weekly"]["incorrect"],
         accuracy_result["weekly"]["accuracy"]
     ))
-    # After inserting, recompute accuracy using the rows stored in rating_accuracy
+    # After inserting, update the window aggregates incrementally (same result as re-reading
+    # the rating_accuracy rows in the window and running calculate_accuracy_matching_frontend)
     try:
-        # Re-fetch rating_accuracy rows within the same window for this ticker up to this timestamp
-        cur.execute(f"""
-            SELECT daily_rating AS rating, daily_prev AS prev, change_pct, open_prev, open
-            FROM rating_accuracy
-            WHERE ticker=? AND timestamp >= datetime(?, '-{window_days} days') AND timestamp <= ?
-            ORDER BY timestamp DESC
-        """, (ticker.upper(), timestamp, timestamp))
-        rows = cur.fetchall()
-        # Map rows to dicts expected by the calculator
-        rows_mapped = []
-        for r in rows:
-            try:
-                rd = {"daily_rating": r[0], "daily_prev": r[1], "change_pct": r[2], "open_prev": r[3], "open": r[4]}
-            except Exception:
-                rd = {"daily_rating": r["rating"] if "rating" in r.keys() else None,
-                      "daily_prev": r["prev"] if "prev" in r.keys() else None,
-                      "change_pct": r["change_pct"] if "change_pct" in r.keys() else 0,
-                      "open_prev": r["open_prev"] if "open_prev" in r.keys() else None,
-                      "open": r["open"] if "open" in r.keys() else None}
-            rows_mapped.append(rd)
-
-        daily_acc = calculate_accuracy_matching_frontend(rows_mapped, None, change_threshold=2.0)
-
-        # Update the just-inserted row with the recomputed accurate aggregates
+        daily_acc, weekly_acc = advance_accuracy_window(
+            cur, ticker, timestamp, window_days,
+            daily_rating, daily_prev,
+            accuracy_result["weekly"]["rating"], accuracy_result["weekly"]["prev"],
+            change_pct, open_prev, open_price,
+        )
         cur.execute("""
             UPDATE rating_accuracy
-            SET samplesize_daily=?, correct_daily=?, incorrect_daily=?, accuracy_daily=?
+            SET samplesize_daily=?, correct_daily=?, incorrect_daily=?, accuracy_daily=?,
+                samplesize_weekly=?, correct_weekly=?, incorrect_weekly=?, accuracy_weekly=?
             WHERE ticker=? AND timestamp=?
-        """, (daily_acc["total"], daily_acc["correct"], daily_acc["incorrect"], daily_acc["accuracy"], ticker.upper(), timestamp))
+        """, (daily_acc["total"], daily_acc["correct"], daily_acc["incorrect"], daily_acc["accuracy"],
+              weekly_acc["total"], weekly_acc["correct"], weekly_acc["incorrect"], weekly_acc["accuracy"],
+              ticker.upper(), timestamp))
+        update_leaderboard(cur, ticker, timestamp,
+                           (daily_acc["accuracy"], daily_acc["total"], daily_acc["correct"], daily_acc["incorrect"]),
+                           (weekly_acc["accuracy"], weekly_acc["total"], weekly_acc["correct"], weekly_acc["incorrect"]))
     except Exception:
         # If this fails, don't block overall flow — leave previously saved values
         pass
-    # Also recompute weekly aggregates in the same way as daily
-    try:
-        cur.execute(f"""
-            SELECT weekly_rating AS rating, weekly_prev AS prev, change_pct, open_prev, open
-            FROM rating_accuracy
-            WHERE ticker=? AND timestamp >= datetime(?, '-{window_days} days') AND timestamp <= ?
-            ORDER BY timestamp DESC
-        """, (ticker.upper(), timestamp, timestamp))
-        rows = cur.fetchall()
-        rows_mapped = []
-        for r in rows:
-            try:
-                rd = {"weekly_rating": r[0], "weekly_prev": r[1], "change_pct": r[2], "open_prev": r[3], "open": r[4]}
-            except Exception:
-                rd = {"rating": r["rating"] if "rating" in r.keys() else None,
-                      "prev": r["prev"] if "prev" in r.keys() else None,
-                      "change_pct": r["change_pct"] if "change_pct" in r.keys() else 0,
-                      "open_prev": r["open_prev"] if "open_prev" in r.keys() else None,
-                      "open": r["open"] if "open" in r.keys() else None}
-            rows_mapped.append(rd)
-
-        # Normalize to keys expected by calculator (it accepts 'rating'/'prev' or 'daily_rating'/'daily_prev')
-        weekly_rows_for_calc = []
-        for rr in rows_mapped:
-            if "weekly_rating" in rr or "weekly_prev" in rr:
-                weekly_rows_for_calc.append({"rating": rr.get("weekly_rating"), "prev": rr.get("weekly_prev"), "change_pct": rr.get("change_pct"), "open_prev": rr.get("open_prev"), "open": rr.get("open")})
-            else:
-                weekly_rows_for_calc.append(rr)
-
-        weekly_acc = calculate_accuracy_matching_frontend(weekly_rows_for_calc, None, change_threshold=2.0)
-
-        cur.execute("""
-            UPDATE rating_accuracy
-            SET samplesize_weekly=?, correct_weekly=?, incorrect_weekly=?, accuracy_weekly=?
-            WHERE ticker=? AND timestamp=?
-        """, (weekly_acc["total"], weekly_acc["correct"], weekly_acc["incorrect"], weekly_acc["accuracy"], ticker.upper(), timestamp))
-    except Exception:
-        # Non-fatal: keep previously saved weekly values
-        pass
+    # accuracy cube ของ ticker นี้ต้องคำนวณใหม่ (flush ก่อน commit)
+    accuracy_cube.mark_dirty(cur, ticker)
 
 def calculate_and_save_accuracy_for_ticker(cur, ticker, timestamp_str, price, change_pct, currency=None, high=None, low=None, window_days=90):
 
@@ -3361,8 +3768,8 @@ def calculate_and_save_accuracy_for_ticker(cur, ticker, timestamp_str, price, ch
         except Exception:
             return
         
-        # ดึงข้อมูล history จาก rating_history (ย้อนหลัง window_days วัน)
-        # ใช้ datetime() function ใน SQLite กับ parameter
+        # ดึงเฉพาะแถวปัจจุบันและแถวก่อนหน้าใน window (ใช้หา open / open_prev)
+        # ตัวนับของทั้ง window คำนวณแบบ incremental ใน save_accuracy_to_db_new
         cur.execute("""
             SELECT 
                 daily_rating, daily_prev, daily_changed_at, change_pct, open,
@@ -3370,6 +3777,7 @@ def calculate_and_save_accuracy_for_ticker(cur, ticker, timestamp_str, price, ch
             FROM rating_history
             WHERE ticker=? AND timestamp >= datetime(?, '-{} days') AND timestamp <= ?
             ORDER BY timestamp DESC
+            LIMIT 2
         """.format(window_days), (ticker.upper(), timestamp_str, timestamp_str))
         
         rows = cur.fetchall()
@@ -3382,8 +3790,8 @@ def calculate_and_save_accuracy_for_ticker(cur, ticker, timestamp_str, price, ch
         cols = [d[0] for d in cur.description]
         history_rows = [dict(zip(cols, r)) for r in rows]
 
-        # คำนวณ accuracy (use unified frontend-matching function)
-        acc_simple = calculate_accuracy_matching_frontend(history_rows, None, change_threshold=2.0)
+        # Placeholder counts; save_accuracy_to_db_new fills in the window aggregates
+        acc_simple = {"accuracy": 0, "correct": 0, "incorrect": 0, "total": 0}
         # Wrap into the legacy nested structure expected by save_accuracy_to_db_new
         accuracy_result = {
             "daily": {
@@ -3435,13 +3843,67 @@ def calculate_and_save_accuracy_for_ticker(cur, ticker, timestamp_str, price, ch
         import traceback
         traceback.print_exc()
 
-def populate_accuracy_on_startup():
+# Progress ของ accuracy population (background job ตอน startup)
+_accuracy_population = {
+    "status": "pending",   # pending | running | done | error
+    "total": 0,
+    "processed": 0,
+    "errors": 0,
+    "started_at": None,
+    "finished_at": None,
+    "error": None,
+}
+_accuracy_population_task = None
+ACCURACY_POPULATE_CHUNK = int(os.getenv("ACCURACY_POPULATE_CHUNK") or "200")
+
+
+def find_accuracy_pairs_to_populate(cur):
+    """
+    แถวของ rating_history ที่ต้องคำนวณ accuracy ใหม่: ต่อ ticker เริ่มจากแถวแรกที่ยังไม่มีใน rating_accuracy
+    หรือแถวใน rating_accuracy ไม่ตรงกับแถวต้นทางแล้ว (price / open / rating / high / low เปลี่ยน)
+    ไปจนถึงแถวล่าสุด - accuracy เป็น sliding window แถวหลังจากนั้นจึงต้องคำนวณใหม่ด้วย
+    ไม่นับแถวแรกของแต่ละ ticker และแถวที่ไม่มี price เพราะคำนวณ accuracy ไม่ได้อยู่แล้ว
+    เรียง ticker, timestamp (เก่า -> ใหม่)
+    """
+    cur.execute("""
+        WITH eligible AS (
+            SELECT h.* FROM rating_history h
+            WHERE h.price IS NOT NULL
+              AND EXISTS (SELECT 1 FROM rating_history p WHERE p.ticker = h.ticker AND p.timestamp < h.timestamp)
+        ),
+        first_stale AS (
+            SELECT h.ticker, MIN(h.timestamp) AS ts
+            FROM eligible h
+            LEFT JOIN rating_accuracy a ON a.ticker = h.ticker AND a.timestamp = h.timestamp
+            WHERE a.ticker IS NULL
+               OR a.price IS NOT h.price
+               OR a.open IS NOT h.open
+               OR a.daily_rating IS NOT h.daily_rating
+               OR a.daily_prev IS NOT h.daily_prev
+               OR a.high IS NOT h.high
+               OR a.low IS NOT h.low
+            GROUP BY h.ticker
+        )
+        SELECT h.ticker, h.timestamp, h.price, h.change_pct, h.currency, h.high, h.low
+        FROM eligible h
+        JOIN first_stale f ON f.ticker = h.ticker AND h.timestamp >= f.ts
+        ORDER BY h.ticker, h.timestamp ASC
+    """)
+    return cur.fetchall()
+
+
+def populate_accuracy_on_startup(chunk_size=None):
     """
-    Populate accuracy data สำหรับทุก ticker ที่มีข้อมูลใน rating_history
-    เรียกใช้ตอน startup เพื่อคำนวณ accuracy สำหรับข้อมูลที่มีอยู่แล้ว
+    Populate accuracy data สำหรับ (ticker, timestamp) ใน rating_history ที่ยังไม่มี/ไม่ตรงใน rating_accuracy
+    เรียกจาก background job ตอน startup (start_accuracy_population) - commit ทีละ chunk และอัปเดต progress
     """
+    st = _accuracy_population
+    chunk_size = chunk_size or ACCURACY_POPULATE_CHUNK
+    st.update({"status": "running", "total": 0, "processed": 0, "errors": 0,
+               "started_at": datetime.now().isoformat(), "finished_at": None, "error": None})
+    con = None
     try:
-        con = sqlite3.connect(DB_FILE)
+        con = sqlite3.connect(DB_FILE, timeout=30)
         con.row_factory = sqlite3.Row
         cur = con.cursor()
         
@@ -3449,88 +3911,95 @@ def populate_accuracy_on_startup():
         cur.execute("PRAGMA journal_mode=WAL")
         cur.execute("PRAGMA busy_timeout=30000")
 
-        cur.execute("""
-            SELECT DISTINCT ticker, timestamp
-            FROM rating_history
-            ORDER BY ticker, timestamp DESC
-        """)
-        ticker_timestamps = cur.fetchall()
+        pairs = find_accuracy_pairs_to_populate(cur)
+        st["total"] = len(pairs)
         
-        if not ticker_timestamps:
-            print("[Accuracy Startup] No ticker-timestamp pairs found in rating_history")
-            con.close()
-            return
-        
-        print(f"[Accuracy Startup] Found {len(ticker_timestamps)} ticker-timestamp pairs in rating_history, calculating accuracy...")
+        if not pairs:
+            print("[Accuracy Startup] rating_accuracy is up to date")
+        else:
+            print(f"[Accuracy Startup] {len(pairs)} rows from the first missing/outdated pair of each ticker, calculating accuracy...")
         
-        populated_count = 0
-        error_count = 0
         window_days = 90
         
-        for row in ticker_timestamps:
-            ticker = row["ticker"] if "ticker" in row.keys() else None
-            timestamp_str = row["timestamp"] if "timestamp" in row.keys() else None
-            
-            if not ticker or not timestamp_str:
-                continue
-            
+        # เรียงเก่า -> ใหม่ เพื่อให้ sliding-window accuracy อัปเดตแบบ incremental ได้
+        chunk_tickers = set()
+        prev_ticker = None
+        for row in pairs:
+            ticker = row["ticker"]
+            timestamp_str = row["timestamp"]
+            if ticker != prev_ticker:
+                # state เดิมนับแถวที่กำลังจะคำนวณใหม่ไปแล้ว -> สร้างใหม่จาก rating_accuracy ตั้งแต่ต้น window
+                drop_accuracy_window_state(cur, ticker)
+                prev_ticker = ticker
             try:
-                # ดึงข้อมูลของ ticker นี้ที่ timestamp นี้จาก rating_history
-                cur.execute("""
-                    SELECT price, change_pct, currency, high, low
-                    FROM rating_history
-                    WHERE ticker=? AND timestamp=?
-                    LIMIT 1
-                """, (ticker, timestamp_str))
-                
-                row_data = cur.fetchone()
-                if not row_data:
-                    continue
-                
-                price = row_data["price"] if "price" in row_data.keys() else None
-                change_pct = row_data["change_pct"] if "change_pct" in row_data.keys() else None
-                currency = row_data["currency"] if "currency" in row_data.keys() else None
-                high = row_data["high"] if "high" in row_data.keys() else None
-                low = row_data["low"] if "low" in row_data.keys() else None
-                
-                # คำนวณและบันทึก accuracy
                 calculate_and_save_accuracy_for_ticker(
                     cur, 
                     ticker, 
                     timestamp_str, 
-                    price, 
-                    change_pct,
-                    currency,
-                    high,
-                    low,
+                    row["price"], 
+                    row["change_pct"],
+                    row["currency"],
+                    row["high"],
+                    row["low"],
                     window_days
                 )
-                
-                populated_count += 1
-                
-                # Commit ทุก 100 records เพื่อไม่ให้ transaction ใหญ่เกินไป
-                if populated_count % 100 == 0:
-                    con.commit()
-                    print(f"[Accuracy Startup] Progress: {populated_count} records processed...")
-                    
             except Exception as e:
-                error_count += 1
+                st["errors"] += 1
                 print(f"[Accuracy Startup] Error processing {ticker} at {timestamp_str}: {e}")
-                continue
-        
-        # Commit สุดท้าย
-        con.commit()
-        con.close()
-        
-        print(f"[Accuracy Startup] [INFO] Completed: {populated_count} records populated, {error_count} errors")
+            st["processed"] += 1
+            chunk_tickers.add(ticker)
+            
+            # Commit ทีละ chunk เพื่อไม่ให้ถือ write lock นาน (background_updater เขียนพร้อมกันได้)
+            if st["processed"] % chunk_size == 0:
+                accuracy_cube.flush_dirty(cur)
+                commit_and_bump(con, chunk_tickers)
+                chunk_tickers = set()
+                apply_leaderboard_updates(con)
+                print(f"[Accuracy Startup] Progress: {st['processed']}/{st['total']} records processed...")
+        
+        accuracy_cube.flush_dirty(cur)
+        # tickers ที่ยังไม่มี accuracy cube (DB เก่า / ticker ใหม่)
+        built = accuracy_cube.refresh_missing(cur)
+        if built:
+            print(f"[Accuracy Startup] Built {built} accuracy cube cells")
+        # cube ที่สร้างใหม่ไม่รู้ว่า ticker ไหน -> ถือเป็น full change (เกิดแค่ DB เก่า / ticker ใหม่)
+        commit_and_bump(con, None if built else chunk_tickers)
+        apply_leaderboard_updates(con)
+        st["status"] = "done"
+        print(f"[Accuracy Startup] [INFO] Completed: {st['processed']} records populated, {st['errors']} errors")
         
     except Exception as e:
+        st["status"] = "error"
+        st["error"] = str(e)
         print(f"[Accuracy Startup] [ERROR] Fatal error: {e}")
         import traceback
         traceback.print_exc()
-        if 'con' in locals() and con:
+    finally:
+        st["finished_at"] = datetime.now().isoformat()
+        if con:
+            discard_leaderboard_updates(con)
             con.close()
 
+
+def start_accuracy_population():
+    """Run populate_accuracy_on_startup in a worker thread so the API serves immediately."""
+    global _accuracy_population_task
+    if _accuracy_population_task and not _accuracy_population_task.done():
+        return _accuracy_population_task
+    _accuracy_population_task = asyncio.create_task(asyncio.to_thread(populate_accuracy_on_startup))
+    return _accuracy_population_task
+
+
+def is_ready():
+    """Readiness: accuracy population finished (errors are reported but don't block serving)."""
+    return _accuracy_population["status"] in ("done", "error")
+
+
+def get_accuracy_population_status():
+    st = dict(_accuracy_population)
+    st["percent"] = round(st["processed"] / st["total"] * 100, 1) if st["total"] else (100.0 if st["status"] == "done" else 0.0)
+    return st
+
 def load_mock_aapl_data():
     try:
         mock_file = os.path.join(os.path.dirname(__file__), "mock_rating_history_aapl.json")
@@ -4177,7 +4646,9 @@ def recalc_and_save_accuracy_for_ticker(ticker, timeframe="1D", window_days=90):
 
                 save_accuracy_to_db_new(cur, ticker, ts_latest, latest_price, None, None, latest_change_pct, latest_currency, latest_high, latest_low, window_days, wrapped, None, None, latest_open)
         
-        con.commit()
+        accuracy_cube.flush_dirty(cur)
+        commit_and_bump(con, [ticker])
+        apply_leaderboard_updates(con)
         con.close()
         
         print(f"✅ [Accuracy] Recalculated and saved accuracy for {ticker} ({timeframe}, {window_days}d)")
@@ -4187,13 +4658,188 @@ def recalc_and_save_accuracy_for_ticker(ticker, timeframe="1D", window_days=90):
         import traceback
         traceback.print_exc()
         if 'con' in locals() and con:
+            discard_leaderboard_updates(con)
             con.close()
 
+def _cube_params(window_days, threshold):
+    """(cube_window, cube_threshold) for /history-with-accuracy; 400 outside the accuracy cube grid."""
+    cube_window = window_days or 0
+    cube_threshold = 2.0 if threshold is None else float(threshold)
+    if cube_window not in accuracy_cube.CUBE_WINDOWS or cube_threshold not in accuracy_cube.CUBE_THRESHOLDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"window_days must be one of {[w for w in accuracy_cube.CUBE_WINDOWS if w]}, "
+                   f"threshold one of {list(accuracy_cube.CUBE_THRESHOLDS)}"
+        )
+    return cube_window, cube_threshold
+
+
+def build_history_with_accuracy(ticker, acc_rows, timeframe, filter_rating=None, window_days=None, threshold=None,
+                                accuracy_by_rating=None):
+    """
+    /history-with-accuracy payload from the ticker's rating_accuracy rows (newest first),
+    selected with HISTORY_ACCURACY_COLUMNS (prev_open already resolved in SQL).
+    accuracy_by_rating: accuracy cube lookup for (window, threshold) or None (computed from acc_rows).
+    """
+    cube_window, cube_threshold = _cube_params(window_days, threshold)
+    cube_tf = "1W" if timeframe == "1W" else "1D"
+
+    if not acc_rows:
+        return {
+            "ticker": ticker.upper(),
+            "currency": "",
+            "price": 0,
+            "changePercent": 0,
+            "change": 0,
+            "high": 0,
+            "low": 0,
+            "current_rating": "Unknown",
+            "prev_rating": "Unknown",
+            "history": [],
+            "accuracy": {"accuracy": 0.0, "correct": 0, "incorrect": 0, "total": 0}
+        }
+    
+    acc_row_latest = acc_rows[0]
+    
+    if timeframe == "1D":
+        rating_key = "daily_rating"
+        prev_key = "daily_prev"
+    else:  # timeframe == "1W"
+        rating_key = "weekly_rating"
+        prev_key = "weekly_prev"
+    
+    history_items = []
+
+    # Process rows in one pass (include rows but mark skipped reasons so frontend can debug)
+    for row in acc_rows:
+        timestamp = row["timestamp"]
+        rating = row[rating_key]
+        prev_rating = row[prev_key]
+        open_price = row["open"] or 0
+        price = row["price"] or 0
+        change_pct = row["change_pct"] or 0
+        # `open_prev` from rating_accuracy, else open of the previous rating_history row (resolved in SQL)
+        prev_open = row["prev_open"]
+
+        change_abs = price - prev_open if price and prev_open else 0
+
+        item = {
+            "rating": rating,
+            "prev": prev_rating or "Unknown",
+            "timestamp": timestamp,
+            "date": timestamp,
+            "open": open_price,
+            "prev_open": prev_open,
+            "result_price": price,
+            "change_pct": change_pct,
+            "change_abs": change_abs,
+            # debug fields
+            "skipped": False,
+            "skip_reason": None,
+            "counted": True,
+            "is_correct": None
+        }
+
+        # Determine skip reasons (but still include the row)
+        if not timestamp or not rating:
+            item["skipped"] = True
+            item["skip_reason"] = "missing timestamp or rating"
+            item["counted"] = False
+        else:
+            rating_lower = rating.lower() if rating else ""
+            if rating_lower in ("neutral", "unknown", ""):
+                item["skipped"] = True
+                item["skip_reason"] = "rating neutral/unknown"
+                item["counted"] = False
+            elif not prev_rating or str(prev_rating).lower() == "unknown":
+                item["skipped"] = True
+                item["skip_reason"] = "prev_rating unknown or missing"
+                item["counted"] = False
+
+        history_items.append(item)
+
+    # คำนวณ accuracy โดยรองรับ filter_rating
+    # ใช้ฟังก์ชันกลางที่มีอยู่แล้ว (เหมือนกับที่ใช้ใน endpoint อื่น)
+    accuracy_result = calculate_accuracy_matching_frontend(history_items, filter_rating)
+
+    if not accuracy_by_rating or next(iter(accuracy_by_rating.values()))["as_of"] != acc_row_latest["timestamp"]:
+        # cube not built / stale for this ticker yet: same numbers computed from the rows we already have
+        accuracy_by_rating = {}
+        asc_rows = [(r["timestamp"], r["daily_rating"], r["daily_prev"], r["weekly_rating"], r["weekly_prev"],
+                     r["change_pct"], r["open"], r["price"]) for r in reversed(acc_rows)]
+        for tf, w, th, flt, c, inc, total, acc in accuracy_cube.compute_ticker_cube(ticker.upper(), asc_rows):
+            if tf == cube_tf and w == cube_window and th == cube_threshold:
+                accuracy_by_rating[flt or "all"] = {"accuracy": acc, "correct": c, "incorrect": inc,
+                                                    "total": total, "as_of": asc_rows[-1][0]}
+    if window_days is not None or threshold is not None:
+        accuracy_result = {k: accuracy_by_rating["all"][k] for k in ("accuracy", "correct", "incorrect", "total")}
+    
+    # Get current rating from latest accuracy record (direct access - faster)
+    current_rating = acc_row_latest[rating_key] or "Unknown"
+    prev_rating = acc_row_latest[prev_key] or "Unknown"
+    
+    # Get data from latest accuracy record
+    latest_price = acc_row_latest["price"] or 0
+    latest_change_pct = acc_row_latest["change_pct"] or 0
+    latest_currency = acc_row_latest["currency"] or ""
+    latest_high = acc_row_latest["high"] or 0
+    latest_low = acc_row_latest["low"] or 0
+    
+    # Calculate change_abs from price and change_pct
+    latest_change_abs = 0
+    if latest_price and latest_change_pct:
+        # Estimate change_abs from change_pct
+        prev_price_est = latest_price / (1 + latest_change_pct / 100) if latest_change_pct != 0 else latest_price
+        latest_change_abs = latest_price - prev_price_est
+    
+    return {
+        "ticker": ticker.upper(),
+        "currency": latest_currency,
+        "price": latest_price,
+        "changePercent": latest_change_pct,
+        "change": latest_change_abs,
+        "high": latest_high,
+        "low": latest_low,
+        "current_rating": current_rating,
+        "prev_rating": prev_rating,
+        "history": history_items,
+        "accuracy": accuracy_result,
+        "accuracy_window_days": cube_window,
+        "accuracy_threshold": cube_threshold,
+        "accuracy_by_rating": accuracy_by_rating
+    }
+
+
+# rating_accuracy columns for /history-with-accuracy (table alias `a`).
+# prev_open = open_prev, or the open of the previous rating_history row (PK index probe, no extra round trip)
+HISTORY_ACCURACY_COLUMNS = """
+    a.timestamp, a.open, a.price, a.price_prev, a.open_prev, a.change_pct, a.currency, a.high, a.low, a.window_day,
+    a.daily_rating, a.daily_prev, a.samplesize_daily, a.correct_daily, a.incorrect_daily, a.accuracy_daily,
+    a.weekly_rating, a.weekly_prev, a.samplesize_weekly, a.correct_weekly, a.incorrect_weekly, a.accuracy_weekly,
+    COALESCE(a.open_prev, (
+        SELECT h.open FROM rating_history h
+        WHERE h.ticker = a.ticker AND h.timestamp < a.timestamp
+        ORDER BY h.timestamp DESC LIMIT 1
+    ), 0) AS prev_open
+"""
+# /history-with-accuracy responses per (ticker, timeframe, filter, window, threshold),
+# valid while the ticker's rating_accuracy stamp (MAX(rowid), COUNT(*)) is unchanged
+HISTORY_CACHE_MAX = int(os.getenv("HISTORY_CACHE_MAX", "2000"))
+_history_cache = {}
+
+
+def _ticker_accuracy_stamp(cur, ticker):
+    """Changes on every write to the ticker's rating_accuracy rows (INSERT OR REPLACE -> new rowid)."""
+    cur.execute("SELECT MAX(rowid), COUNT(*) FROM rating_accuracy WHERE ticker=?", (ticker,))
+    return tuple(cur.fetchone())
+
 @app.get("/history-with-accuracy/{ticker}")
 def get_history_with_accuracy(
     ticker: str, 
     timeframe: str = Query("1D", description="Timeframe: 1D or 1W"), 
-    filter_rating: str = Query(None, description="Filter by rating: Strong Buy, Buy, Sell, Strong Sell")
+    filter_rating: str = Query(None, description="Filter by rating: Strong Buy, Buy, Sell, Strong Sell"),
+    window_days: Optional[int] = Query(None, description="Accuracy window in days (30, 60, 90, 180); default whole history"),
+    threshold: Optional[float] = Query(None, description="Price change threshold in % (1, 2, 3, 5); default 2")
 ):
     """
     Get rating history with accuracy calculation.
@@ -4202,10 +4848,16 @@ def get_history_with_accuracy(
         ticker: Stock ticker symbol
         timeframe: "1D" or "1W"
         filter_rating: Optional rating filter ("Strong Buy", "Buy", "Sell", "Strong Sell")
+        window_days: Optional accuracy window (answered from the precomputed accuracy cube)
+        threshold: Optional change threshold % (answered from the precomputed accuracy cube)
     
     Returns:
         dict with history items (including price data) and accuracy metrics
+        (+ accuracy_by_rating breakdown for the selected window/threshold)
     """
+    cube_window, cube_threshold = _cube_params(window_days, threshold)
+    cube_tf = "1W" if timeframe == "1W" else "1D"
+
     # If mock data is enabled and ticker is AAPL, return mock data
     if USE_MOCK_DATA and ticker.upper() == "AAPL":
         print(f"✅ Returning mock data for {ticker} with filter: {filter_rating}")
@@ -4226,155 +4878,42 @@ def get_history_with_accuracy(
         cur.execute("PRAGMA busy_timeout=100")
         pragma_time = time.time() - pragma_start
 
+        cache_key = (ticker.upper(), timeframe, filter_rating, window_days, threshold)
+        stamp = _ticker_accuracy_stamp(cur, ticker.upper())
+        cached = _history_cache.get(cache_key)
+        if cached and cached[0] == stamp:
+            con.close()
+            return cached[1]
+
         query2_start = time.time()
-        cur.execute("""
-            SELECT 
-                timestamp, open, price, price_prev, open_prev, change_pct, currency, high, low, window_day,
-                daily_rating, daily_prev, samplesize_daily, correct_daily, incorrect_daily, accuracy_daily,
-                weekly_rating, weekly_prev, samplesize_weekly, correct_weekly, incorrect_weekly, accuracy_weekly
-            FROM rating_accuracy
-            WHERE ticker=?
-            ORDER BY timestamp DESC
+        cur.execute(f"""
+            SELECT {HISTORY_ACCURACY_COLUMNS}
+            FROM rating_accuracy a
+            WHERE a.ticker=?
+            ORDER BY a.timestamp DESC
         """, (ticker.upper(),))
         
         acc_rows = cur.fetchall()
         query2_time = time.time() - query2_start
 
-        con.close()
-        
-        if not acc_rows:
-            return {
-                "ticker": ticker.upper(),
-                "currency": "",
-                "price": 0,
-                "changePercent": 0,
-                "change": 0,
-                "high": 0,
-                "low": 0,
-                "current_rating": "Unknown",
-                "prev_rating": "Unknown",
-                "history": [],
-                "accuracy": {"accuracy": 0.0, "correct": 0, "incorrect": 0, "total": 0}
-            }
-        
-        acc_row_latest = acc_rows[0]
-        
-        if timeframe == "1D":
-            rating_key = "daily_rating"
-            prev_key = "daily_prev"
-        else:  # timeframe == "1W"
-            rating_key = "weekly_rating"
-            prev_key = "weekly_prev"
-        
-        history_items = []
-
-        # Process rows in one pass (include rows but mark skipped reasons so frontend can debug)
-        for acc_row in acc_rows:
-            # sqlite3.Row does not implement .get(); convert to dict for safe access
-            row = dict(acc_row)
-            timestamp = row.get("timestamp")
-            rating = row.get(rating_key)
-            prev_rating = row.get(prev_key)
-            open_price = row.get("open") or 0
-            price = row.get("price") or 0
-            price_prev = row.get("price_prev") or 0
-            change_pct = row.get("change_pct") or 0
-
-            # Prefer `open_prev` stored in `rating_accuracy` (faster and canonical).
-            # Fall back to querying `rating_history` only if `open_prev` is None.
-            prev_open = row.get("open_prev")
-            if prev_open is None:
-                prev_open = 0
-                try:
-                    cur.execute(
-                        "SELECT open FROM rating_history WHERE ticker=? AND timestamp < ? ORDER BY timestamp DESC LIMIT 1",
-                        (ticker.upper(), timestamp)
-                    )
-                    prev_row = cur.fetchone()
-                    if prev_row:
-                        try:
-                            prev_open = prev_row["open"] if prev_row["open"] is not None else 0
-                        except Exception:
-                            prev_open = prev_row[0] if prev_row[0] is not None else 0
-                except Exception:
-                    prev_open = 0
-
-            change_abs = price - prev_open if price and prev_open else 0
-
-            item = {
-                "rating": rating,
-                "prev": prev_rating or "Unknown",
-                "timestamp": timestamp,
-                "date": timestamp,
-                "open": open_price,
-                "prev_open": prev_open,
-                "result_price": price,
-                "change_pct": change_pct,
-                "change_abs": change_abs,
-                # debug fields
-                "skipped": False,
-                "skip_reason": None,
-                "counted": True,
-                "is_correct": None
-            }
+        # Precomputed accuracy for (window, threshold) -> one PK range lookup
+        try:
+            accuracy_by_rating = accuracy_cube.lookup(cur, ticker, cube_tf, cube_window, cube_threshold)
+        except sqlite3.OperationalError:
+            accuracy_by_rating = None  # cube table not created yet
 
-            # Determine skip reasons (but still include the row)
-            if not timestamp or not rating:
-                item["skipped"] = True
-                item["skip_reason"] = "missing timestamp or rating"
-                item["counted"] = False
-            else:
-                rating_lower = rating.lower() if rating else ""
-                if rating_lower in ("neutral", "unknown", ""):
-                    item["skipped"] = True
-                    item["skip_reason"] = "rating neutral/unknown"
-                    item["counted"] = False
-                elif not prev_rating or str(prev_rating).lower() == "unknown":
-                    item["skipped"] = True
-                    item["skip_reason"] = "prev_rating unknown or missing"
-                    item["counted"] = False
-
-            history_items.append(item)
-
-        # คำนวณ accuracy โดยรองรับ filter_rating
-        # ใช้ฟังก์ชันกลางที่มีอยู่แล้ว (เหมือนกับที่ใช้ใน endpoint อื่น)
-        accuracy_result = calculate_accuracy_matching_frontend(history_items, filter_rating)
-        
-        # Get current rating from latest accuracy record (direct access - faster)
-        current_rating = acc_row_latest[rating_key] or "Unknown"
-        prev_rating = acc_row_latest[prev_key] or "Unknown"
-        
-        # Get data from latest accuracy record
-        latest_price = acc_row_latest["price"] or 0
-        latest_change_pct = acc_row_latest["change_pct"] or 0
-        latest_currency = acc_row_latest["currency"] or ""
-        latest_high = acc_row_latest["high"] or 0
-        latest_low = acc_row_latest["low"] or 0
-        
-        # Calculate change_abs from price and change_pct
-        latest_change_abs = 0
-        if latest_price and latest_change_pct:
-            # Estimate change_abs from change_pct
-            prev_price_est = latest_price / (1 + latest_change_pct / 100) if latest_change_pct != 0 else latest_price
-            latest_change_abs = latest_price - prev_price_est
+        con.close()
+        result = build_history_with_accuracy(ticker, acc_rows, timeframe, filter_rating, window_days, threshold,
+                                             accuracy_by_rating)
+        if len(_history_cache) >= HISTORY_CACHE_MAX:
+            _history_cache.pop(next(iter(_history_cache)), None)
+        _history_cache[cache_key] = (stamp, result)
         
         # Print timing logs
         total_time = time.time() - start_time
         print(f"[History Accuracy] {ticker.upper()}: connect={connect_time:.3f}s, pragma={pragma_time:.3f}s, query2={query2_time:.3f}s, total={total_time:.3f}s")
         
-        return {
-            "ticker": ticker.upper(),
-            "currency": latest_currency,
-            "price": latest_price,
-            "changePercent": latest_change_pct,
-            "change": latest_change_abs,
-            "high": latest_high,
-            "low": latest_low,
-            "current_rating": current_rating,
-            "prev_rating": prev_rating,
-            "history": history_items,
-            "accuracy": accuracy_result
-        }
+        return result
         
     except sqlite3.OperationalError as e:
         error_msg = str(e)
@@ -4413,6 +4952,104 @@ def get_history_with_accuracy(
             "accuracy": {"accuracy": 0.0, "correct": 0, "incorrect": 0, "total": 0}
         }
 
+HISTORY_BATCH_MAX_TICKERS = 100
+
+class HistoryBatchRequest(BaseModel):
+    tickers: list[str]
+    timeframes: list[str] = ["1D"]
+    filter_rating: Optional[str] = None
+    window_days: Optional[int] = None
+    threshold: Optional[float] = None
+    include_intraday: bool = False
+
+@app.post("/api/history/batch")
+def history_batch(request: HistoryBatchRequest):
+    """
+    /history-with-accuracy (+ optional /api/intraday-history) for many tickers at once.
+    One connection and one `WHERE ticker IN (...)` query per table (rating_accuracy, accuracy_cube,
+    rating_main); the response is NDJSON,
+    one line per ticker: {"ticker", "history_with_accuracy": {tf: ...}, "intraday_history": {tf: [...]}}.
+    """
+    from fastapi.responses import StreamingResponse
+
+    tickers = list(dict.fromkeys(t.strip().upper() for t in request.tickers if t and t.strip()))
+    if not tickers:
+        raise HTTPException(status_code=400, detail="tickers must not be empty")
+    if len(tickers) > HISTORY_BATCH_MAX_TICKERS:
+        raise HTTPException(status_code=400, detail=f"At most {HISTORY_BATCH_MAX_TICKERS} tickers per batch")
+    timeframes = list(dict.fromkeys(request.timeframes or ["1D"]))
+    if any(tf not in ("1D", "1W") for tf in timeframes):
+        raise HTTPException(status_code=400, detail="timeframes must be 1D and/or 1W")
+    cube_window, cube_threshold = _cube_params(request.window_days, request.threshold)
+
+    marks = ",".join("?" for _ in tickers)
+    con = sqlite3.connect(DB_FILE, timeout=5)
+    try:
+        con.row_factory = sqlite3.Row
+        cur = con.cursor()
+        cur.execute(f"""
+            SELECT a.ticker, {HISTORY_ACCURACY_COLUMNS}
+            FROM rating_accuracy a
+            WHERE a.ticker IN ({marks})
+            ORDER BY a.ticker, a.timestamp DESC
+        """, tickers)
+        acc_by_ticker = {}
+        for r in cur.fetchall():
+            acc_by_ticker.setdefault(r["ticker"], []).append(r)
+
+        cube_by_ticker = {}
+        try:
+            cur.execute(f"""
+                SELECT ticker, timeframe, filter_rating, accuracy, correct, incorrect, total, as_of
+                FROM accuracy_cube
+                WHERE ticker IN ({marks}) AND window_days=? AND threshold=?
+            """, tickers + [cube_window, cube_threshold])
+            for r in cur.fetchall():
+                cube_by_ticker.setdefault((r["ticker"], r["timeframe"]), {})[r["filter_rating"] or "all"] = {
+                    "accuracy": r["accuracy"], "correct": r["correct"], "incorrect": r["incorrect"],
+                    "total": r["total"], "as_of": r["as_of"]}
+        except sqlite3.OperationalError:
+            pass  # cube table not created yet -> computed per ticker
+
+        intraday_by_ticker = {}
+        if request.include_intraday:
+            cur.execute(f"""
+                SELECT ticker, timestamp, daily_rating, daily_val, weekly_rating, weekly_val,
+                       price, change_pct, change_abs, currency, at_price
+                FROM rating_main
+                WHERE ticker IN ({marks})
+                ORDER BY ticker, timestamp ASC
+            """, tickers)
+            for r in cur.fetchall():
+                intraday_by_ticker.setdefault(r["ticker"], []).append(r)
+    finally:
+        con.close()
+
+    def generate():
+        for ticker in tickers:
+            line = {"ticker": ticker, "history_with_accuracy": {}}
+            try:
+                for tf in timeframes:
+                    line["history_with_accuracy"][tf] = build_history_with_accuracy(
+                        ticker, acc_by_ticker.get(ticker, []), tf, request.filter_rating,
+                        request.window_days, request.threshold,
+                        cube_by_ticker.get((ticker, tf)))
+                if request.include_intraday:
+                    line["intraday_history"] = {}
+                    for tf in timeframes:
+                        prefix = "daily" if tf == "1D" else "weekly"
+                        line["intraday_history"][tf] = [
+                            _intraday_item((r["timestamp"], r[f"{prefix}_rating"], r[f"{prefix}_val"], r["price"],
+                                            r["change_pct"], r["change_abs"], r["currency"], r["at_price"]))
+                            for r in intraday_by_ticker.get(ticker, [])
+                        ]
+            except Exception as e:
+                print(f"[History Batch] Error for {ticker}: {e}")
+                line["error"] = str(e)
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
 @app.get("/api/mock-rating-history/aapl")
 def get_mock_aapl_history():
     """
@@ -4448,6 +5085,114 @@ def recalculate_accuracy_endpoint(
             "ticker": ticker.upper()
         }, 500
 
+@app.get("/api/mapping-report")
+def mapping_report():
+    """Ticker mapping report (markets, exchanges, unmapped tickers, failed TradingView lookups) for the current DR list."""
+    return get_mapping_report()
+
+@app.get("/api/leaderboard")
+def accuracy_leaderboard(
+    timeframe: str = Query("1D", description="Timeframe: 1D or 1W"),
+    min_samples: int = Query(0, ge=0, description="Minimum sample size"),
+    market: Optional[str] = Query(None, description="Market code filter (e.g. US, HK, JP)"),
+    limit: int = Query(50, ge=1, le=1000),
+    order: str = Query("desc", description="desc = most accurate first, asc = least accurate first")
+):
+    """Tickers ranked by latest daily/weekly accuracy (served from the in-memory leaderboard)."""
+    if timeframe not in ("1D", "1W"):
+        raise HTTPException(status_code=400, detail="timeframe must be 1D or 1W")
+    return get_leaderboard(timeframe, min_samples, market, limit, ascending=(order == "asc"))
+
+# Backtest results per data version (rating_history changes -> old entries dropped)
+_backtest_cache = {}
+_backtest_cache_version = None
+BACKTEST_MAX_HORIZON = 20
+BACKTEST_MAX_VALUES = 10        # per thresholds / horizons list (grid size = thresholds x horizons)
+BACKTEST_CACHE_MAX = 32         # entries per data version (each holds a per-ticker grid)
+
+def _rating_history_version(cur):
+    """Cheap data version of rating_history: INSERT / INSERT OR REPLACE always bump MAX(rowid)."""
+    cur.execute("SELECT MAX(rowid), COUNT(*) FROM rating_history")
+    max_rowid, count = cur.fetchone()
+    return f"{max_rowid or 0}-{count}"
+
+def _parse_number_list(text, cast, name, max_values=BACKTEST_MAX_VALUES):
+    try:
+        values = sorted({cast(x) for x in str(text).split(",") if x.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: {text}")
+    if not values:
+        raise HTTPException(status_code=400, detail=f"{name} must not be empty")
+    if len(values) > max_values:
+        raise HTTPException(status_code=400, detail=f"At most {max_values} {name}")
+    if any(v != v or v in (float("inf"), float("-inf")) for v in values):
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: {text}")
+    return values
+
+@app.get("/api/backtest")
+def backtest_rating_signals(
+    timeframe: str = Query("1D", description="Timeframe: 1D or 1W"),
+    thresholds: str = Query("1,2,3", description="Comma-separated change thresholds in %"),
+    horizons: str = Query("1,3,5", description="Comma-separated holding horizons in snapshots"),
+    ticker: Optional[str] = Query(None, description="Only return this ticker's grid (aggregate is still universe-wide)"),
+    include_tickers: bool = Query(True, description="Include the per-ticker grid")
+):
+    """
+    Backtest rating changes over rating_history: an upgrade is correct when the price exactly N snapshots
+    later (point-to-point, not the excursion in between) is up at least `threshold` % (downgrade: down at
+    least `threshold` %).
+    Computed in one vectorized pass (accuracy_engine.backtest_grid) and cached per data version.
+    """
+    global _backtest_cache_version
+    if timeframe not in ("1D", "1W"):
+        raise HTTPException(status_code=400, detail="timeframe must be 1D or 1W")
+    threshold_list = _parse_number_list(thresholds, float, "thresholds")
+    horizon_list = _parse_number_list(horizons, int, "horizons")
+    if horizon_list[0] < 1 or horizon_list[-1] > BACKTEST_MAX_HORIZON:
+        raise HTTPException(status_code=400, detail=f"horizons must be between 1 and {BACKTEST_MAX_HORIZON}")
+
+    import time
+    start_time = time.time()
+    con = sqlite3.connect(DB_FILE, timeout=5)
+    try:
+        cur = con.cursor()
+        version = _rating_history_version(cur)
+        if version != _backtest_cache_version:
+            _backtest_cache.clear()
+            _backtest_cache_version = version
+        key = (timeframe, tuple(threshold_list), tuple(horizon_list))
+        cached = key in _backtest_cache
+        if not cached:
+            h = accuracy_engine.load_history(con, timeframe="daily" if timeframe == "1D" else "weekly")
+            cells, per_ticker = accuracy_engine.backtest_grid(h, threshold_list, horizon_list)
+            result = {"signals": int((accuracy_engine.change_signals(h) != 0).sum()),
+                      "tickers": len(h["tickers"]),
+                      "aggregate": cells,
+                      "per_ticker": per_ticker}
+            if len(_backtest_cache) < BACKTEST_CACHE_MAX:
+                _backtest_cache[key] = result
+        else:
+            result = _backtest_cache[key]
+    finally:
+        con.close()
+
+    if ticker:
+        per_ticker = {ticker.upper(): result["per_ticker"].get(ticker.upper(), [])}
+    else:
+        per_ticker = result["per_ticker"] if include_tickers else None
+    return {
+        "data_version": version,
+        "timeframe": timeframe,
+        "thresholds": threshold_list,
+        "horizons": horizon_list,
+        "tickers_count": result["tickers"],
+        "signals": result["signals"],
+        "aggregate": result["aggregate"],
+        "tickers": per_ticker,
+        "cached": cached,
+        "elapsed_ms": round((time.time() - start_time) * 1000, 1)
+    }
+
 @app.get("/dr-list")
 def get_local_dr_list():
     """Return DR list by fetching from external DR_LIST_URL (no local fallback).
@@ -4471,21 +5216,83 @@ def get_local_dr_list():
         except Exception:
             return {"error": str(e)}
 
-@app.get("/from-dr-api")
-def ratings_from_dr_api():
-    """
-    Fetches latest ratings, stats, and history from the SQLite DB 
-    and reconstructs the JSON response to match the original format.
-    Now reads from rating_main instead of ratings table.
+def _build_dr_api_row(cur, ticker):
+    """One /from-dr-api row (latest rating_main + filtered history) or None if the ticker has no rating_main row."""
+    # Get latest record from rating_main (contains both daily and weekly)
+    cur.execute("""
+        SELECT * FROM rating_main 
+        WHERE ticker=? 
+        ORDER BY timestamp DESC 
+        LIMIT 1
+    """, (ticker,))
+    main_row = cur.fetchone()
     
-    If USE_MOCK_DATA is True, returns mock AAPL data from mock_rating_history_aapl.json
-    """
-    # If mock data is enabled, return mock AAPL data
-    if USE_MOCK_DATA:
-        result = load_mock_aapl_data()
-        print(f"✅ Mock data loaded, returning: {result}")
-        return result
+    if not main_row:
+        return None
+    
+    # Get filtered history
+    cur.execute("""
+        SELECT daily_rating, daily_changed_at, weekly_rating, weekly_changed_at, timestamp
+        FROM rating_history 
+        WHERE ticker=? 
+        ORDER BY timestamp ASC
+    """, (ticker,))
+    history_rows = cur.fetchall()
+    
+    # Build daily history (use daily_changed_at as timestamp)
+    daily_history = []
+    for h in history_rows:
+        if h["daily_rating"] and h["daily_changed_at"]:
+            daily_history.append({
+                "rating": h["daily_rating"],
+                "timestamp": h["daily_changed_at"]
+            })
+    
+    # Build weekly history (use weekly_changed_at as timestamp)
+    weekly_history = []
+    for h in history_rows:
+        if h["weekly_rating"] and h["weekly_changed_at"]:
+            weekly_history.append({
+                "rating": h["weekly_rating"],
+                "timestamp": h["weekly_changed_at"]
+            })
     
+    return {
+        "ticker": ticker,
+        "currency": main_row["currency"] or "",
+        "price": main_row["price"],
+        "changePercent": main_row["change_pct"],
+        "change": main_row["change_abs"], 
+        "high": main_row["high"],
+        "low": main_row["low"],
+        "daily": {
+            "recommend_all": main_row["daily_val"],
+            "rating": main_row["daily_rating"] or "Unknown",
+            "prev": main_row["daily_prev"] or "Unknown",
+            "changed_at": main_row["daily_changed_at"],
+            "history": daily_history
+        },
+        "weekly": {
+            "recommend_all": main_row["weekly_val"],
+            "rating": main_row["weekly_rating"] or "Unknown",
+            "prev": main_row["weekly_prev"] or "Unknown",
+            "changed_at": main_row["weekly_changed_at"],
+            "history": weekly_history
+        }
+    }
+
+
+def _data_updated_at():
+    if _data_version_updated_at:
+        return _data_version_updated_at
+    if os.path.exists(DB_FILE):
+        mtime = os.path.getmtime(DB_FILE)
+        return datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S")
+    return "-"
+
+
+def build_from_dr_api_payload():
+    """Full /from-dr-api payload from SQLite. Returns (payload, ok) - ok=False on DB error (not cached)."""
     rows = []
     updated_at_str = "-"
     try:
@@ -4497,80 +5304,19 @@ def ratings_from_dr_api():
         cur.execute("PRAGMA journal_mode=WAL")
         cur.execute("PRAGMA busy_timeout=30000")
 
-        if os.path.exists(DB_FILE):
-            mtime = os.path.getmtime(DB_FILE)
-            updated_at_str = datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S")
+        updated_at_str = _data_updated_at()
 
         # Get all unique tickers from rating_main
         cur.execute("SELECT DISTINCT ticker FROM rating_main")
         all_tickers = [row[0] for row in cur.fetchall()]
 
         for ticker in all_tickers:
-            # Get latest record from rating_main (contains both daily and weekly)
-            cur.execute("""
-                SELECT * FROM rating_main 
-                WHERE ticker=? 
-                ORDER BY timestamp DESC 
-                LIMIT 1
-            """, (ticker,))
-            main_row = cur.fetchone()
-            
-            if not main_row:
-                continue 
-            
-            # Get filtered history
-            cur.execute("""
-                SELECT daily_rating, daily_changed_at, weekly_rating, weekly_changed_at, timestamp
-                FROM rating_history 
-                WHERE ticker=? 
-                ORDER BY timestamp ASC
-            """, (ticker,))
-            history_rows = cur.fetchall()
-            
-            # Build daily history (use daily_changed_at as timestamp)
-            daily_history = []
-            for h in history_rows:
-                if h["daily_rating"] and h["daily_changed_at"]:
-                    daily_history.append({
-                        "rating": h["daily_rating"],
-                        "timestamp": h["daily_changed_at"]
-                    })
-            
-            # Build weekly history (use weekly_changed_at as timestamp)
-            weekly_history = []
-            for h in history_rows:
-                if h["weekly_rating"] and h["weekly_changed_at"]:
-                    weekly_history.append({
-                        "rating": h["weekly_rating"],
-                        "timestamp": h["weekly_changed_at"]
-                    })
-            
-            rows.append({
-                "ticker": ticker,
-                "currency": main_row["currency"] or "",
-                "price": main_row["price"],
-                "changePercent": main_row["change_pct"],
-                "change": main_row["change_abs"], 
-                "high": main_row["high"],
-                "low": main_row["low"],
-                "daily": {
-                    "recommend_all": main_row["daily_val"],
-                    "rating": main_row["daily_rating"] or "Unknown",
-                    "prev": main_row["daily_prev"] or "Unknown",
-                    "changed_at": main_row["daily_changed_at"],
-                    "history": daily_history
-                },
-                "weekly": {
-                    "recommend_all": main_row["weekly_val"],
-                    "rating": main_row["weekly_rating"] or "Unknown",
-                    "prev": main_row["weekly_prev"] or "Unknown",
-                    "changed_at": main_row["weekly_changed_at"],
-                    "history": weekly_history
-                }
-            })
+            row = _build_dr_api_row(cur, ticker)
+            if row:
+                rows.append(row)
         
         con.close()
-        return {"updated_at": updated_at_str, "count": len(rows), "rows": rows}
+        return {"updated_at": updated_at_str, "count": len(rows), "rows": rows}, True
     
     except Exception as e:
         print(f"❌ API Error fetching from DB: {e}")
@@ -4578,42 +5324,369 @@ def ratings_from_dr_api():
         traceback.print_exc()
         if 'con' in locals() and con:
             con.close()
-        return {"updated_at": updated_at_str, "count": 0, "rows": []}
+        return {"updated_at": updated_at_str, "count": 0, "rows": []}, False
 
-@app.get("/api/intraday-history/{ticker}")
-def get_intraday_history(
-    ticker: str,
-    timeframe: str = Query("1D", description="Timeframe: 1D or 1W")
-):
+
+def _data_cursor(version=None):
+    return f"{_BOOT_ID}-{_data_version if version is None else version}"
+
+
+def get_changes_since(since):
     """
-    Simulated Intraday History for compatibility.
-    Since we don't have real intraday data in this local setup,
-    we fallback to returning the daily history but formatted to look like intraday/time-based log.
-    
-    In a real scenario, this would query a high-frequency database table.
+    Delta for /changes: rows of tickers changed after cursor `since`.
+    full=True when the cursor is unknown (restart / too old / bulk change) -> reload /from-dr-api.
     """
+    current = get_data_version()
+    result = {"cursor": _data_cursor(current), "updated_at": _data_updated_at(), "full": False, "rows": [], "removed": []}
+    boot_id, _, version_str = (since or "").rpartition("-")
     try:
-        # Fallback to daily history-with-accuracy logic, but just return the list 
-        # structure expected by the frontend for intraday mode
-        # Frontend expects: { "intraday_history": [ ... ] }
-        
-        # Reuse get_history_with_accuracy to fetch data
-        data = get_history_with_accuracy(ticker, timeframe=timeframe)
-        if "error" in data:
-            return {"intraday_history": []}
-            
-        history = data.get("history", [])
-        
-        # Transform strictly to what frontend might expect if it differs,
-        # but based on reading suggestion.jsx, it uses the same fields mostly.
-        # Just ensure top-level key matches.
-        
-        return {
-            "intraday_history": history
+        since_version = int(version_str)
+    except ValueError:
+        since_version = -1
+    if boot_id != _BOOT_ID or since_version < 0 or since_version > current:
+        result["full"] = True
+        return result
+    if since_version == current:
+        return result
+
+    with _data_version_lock:
+        entries = [e for e in _change_log if e[0] > since_version]
+    # log ถูกตัดไปแล้ว หรือมี batch ที่ไม่รู้ว่า ticker ไหนเปลี่ยน
+    if not entries or entries[0][0] != since_version + 1 or any(e[1] is None for e in entries):
+        result["full"] = True
+        return result
+
+    tickers = sorted({t for e in entries for t in e[1]})
+    con = sqlite3.connect(DB_FILE, timeout=10)
+    try:
+        con.row_factory = sqlite3.Row
+        cur = con.cursor()
+        for ticker in tickers:
+            row = _build_dr_api_row(cur, ticker)
+            if row:
+                result["rows"].append(row)
+            else:
+                result["removed"].append(ticker)
+    finally:
+        con.close()
+    return result
+
+
+def _notify_changes_clients(version):
+    """Runs on the event loop (bump_data_version -> call_soon_threadsafe): wake every /changes/stream client."""
+    for queue in list(_changes_sse_clients):
+        try:
+            queue.put_nowait(version)
+        except asyncio.QueueFull:
+            pass  # client กำลังจะอ่านอยู่แล้ว - delta รวมจาก cursor ของมันเอง
+
+
+@app.get("/changes")
+def ratings_changes(since: str = Query(..., description="Cursor from /from-dr-api (cursor) or a previous /changes call")):
+    """Only the tickers whose rating/price changed since `since` (same row format as /from-dr-api)."""
+    return get_changes_since(since)
+
+
+@app.get("/changes/stream")
+async def ratings_changes_stream(request: Request, since: Optional[str] = Query(None)):
+    """
+    SSE: pushes a /changes delta as soon as a ratings batch commits.
+    Resumes from `since` or the Last-Event-ID header (event id = cursor).
+    """
+    global _changes_loop
+    from fastapi.responses import StreamingResponse
+    _changes_loop = asyncio.get_running_loop()
+    cursor = request.headers.get("last-event-id") or since or _data_cursor()
+
+    async def event_generator():
+        nonlocal cursor
+        queue = asyncio.Queue(maxsize=1)
+        _changes_sse_clients.append(queue)
+        try:
+            yield f"data: {json.dumps({'type': 'connected', 'cursor': cursor})}\n\n"
+            if cursor != _data_cursor():
+                queue.put_nowait(_data_version)
+            while True:
+                try:
+                    await asyncio.wait_for(queue.get(), timeout=30)
+                except asyncio.TimeoutError:
+                    # writes จากโปรเซสอื่นไม่ปลุก queue -> เช็คตอน heartbeat
+                    if _data_cursor(await asyncio.to_thread(get_data_version)) == cursor:
+                        yield ": heartbeat\n\n"
+                        continue
+                delta = await asyncio.to_thread(get_changes_since, cursor)
+                if delta["cursor"] == cursor:
+                    continue
+                cursor = delta["cursor"]
+                delta["type"] = "changes"
+                yield f"id: {cursor}\ndata: {json.dumps(delta, ensure_ascii=False)}\n\n"
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if queue in _changes_sse_clients:
+                _changes_sse_clients.remove(queue)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
         }
-    except Exception as e:
-        print(f"Error in mock intraday history: {e}")
-        return {"intraday_history": []}
+    )
+
+
+# /from-dr-api body ต่อ data version: serialize + gzip ครั้งเดียว แล้วทุก poll เป็นแค่ dict lookup
+_dr_api_cache = {"version": None, "etag": None, "body": None, "gzip": None}
+_dr_api_cache_lock = threading.Lock()
+
+
+def _get_dr_api_cache():
+    version = get_data_version()
+    cache = _dr_api_cache
+    if cache["version"] == version:
+        return cache
+    with _dr_api_cache_lock:
+        if cache["version"] == version:
+            return cache
+        payload, ok = build_from_dr_api_payload()
+        # cursor สำหรับ /changes (อาจเก่ากว่าข้อมูลเล็กน้อย -> client ได้ delta ซ้ำ ไม่พลาด)
+        payload["cursor"] = _data_cursor(version)
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        entry = {"version": version, "etag": f'"{_BOOT_ID}-{version}"', "body": body, "gzip": gzip.compress(body, 6)}
+        if not ok:
+            return entry  # DB error: serve it, but rebuild on the next poll
+        cache.update(entry)
+        return cache
+
+
+# --- Filtered / projected / paged ratings list (SQL over the latest rating_main row per ticker) ---
+DR_API_LIST_FIELDS = ("ticker", "currency", "price", "changePercent", "change", "high", "low",
+                      "market", "exchange", "daily", "weekly", "daily.history", "weekly.history")
+# sort key -> SQL expression over the `latest` CTE
+DR_API_SORT_COLUMNS = {
+    "ticker": "l.ticker",
+    "price": "l.price",
+    "changePercent": "l.change_pct",
+    "change": "l.change_abs",
+    "market": "mk.market",
+    "daily_changed_at": "l.daily_changed_at",
+    "weekly_changed_at": "l.weekly_changed_at",
+    "timestamp": "l.timestamp",
+}
+DR_API_MAX_PAGE_SIZE = 500
+_dr_api_query_cache = {}
+_dr_api_query_cache_version = None
+
+
+def _split_param(value):
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+
+def query_ratings_list(market=None, exchange=None, rating=None, timeframe="1D", changed_since=None,
+                       sort="ticker", page=1, page_size=None, fields=None):
+    """
+    /from-dr-api with filters: one SQL query over the latest rating_main row of each ticker
+    (+ market/exchange from its latest rating_history row), filtered, sorted and paged in SQL.
+    History is only read for the tickers on the page, and only when requested.
+    """
+    prefix = "daily" if timeframe == "1D" else "weekly"
+    where, params = [], []
+    markets = [m.upper() for m in _split_param(market)]
+    if markets:
+        where.append(f"UPPER(mk.market) IN ({','.join('?' for _ in markets)})")
+        params += markets
+    exchanges = [e.upper() for e in _split_param(exchange)]
+    if exchanges:
+        where.append(f"UPPER(mk.exchange) IN ({','.join('?' for _ in exchanges)})")
+        params += exchanges
+    ratings_wanted = [r.lower() for r in _split_param(rating)]
+    if ratings_wanted:
+        where.append(f"LOWER(COALESCE(l.{prefix}_rating, 'Unknown')) IN ({','.join('?' for _ in ratings_wanted)})")
+        params += ratings_wanted
+    if changed_since:
+        where.append(f"l.{prefix}_changed_at >= ?")
+        params.append(changed_since)
+
+    desc = sort.startswith("-")
+    sort_col = DR_API_SORT_COLUMNS[sort.lstrip("-")]
+    order = f"{sort_col} IS NULL, {sort_col} {'DESC' if desc else 'ASC'}, l.ticker ASC"
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    sql_from = f"""
+        FROM latest l
+        LEFT JOIN market_info mk ON mk.ticker = l.ticker
+        {where_sql}
+    """
+    ctes = """
+        WITH latest AS (
+            SELECT m.* FROM rating_main m
+            JOIN (SELECT ticker, MAX(timestamp) AS ts FROM rating_main GROUP BY ticker) x
+              ON x.ticker = m.ticker AND x.ts = m.timestamp
+        ),
+        market_info AS (
+            SELECT h.ticker, h.market, h.exchange FROM rating_history h
+            JOIN (SELECT ticker, MAX(timestamp) AS ts FROM rating_history GROUP BY ticker) y
+              ON y.ticker = h.ticker AND y.ts = h.timestamp
+        )
+    """
+    page = max(1, page)
+    limit_sql = ""
+    page_params = []
+    if page_size:
+        limit_sql = "LIMIT ? OFFSET ?"
+        page_params = [page_size, (page - 1) * page_size]
+
+    wanted = set(fields) if fields else set(DR_API_LIST_FIELDS)
+    con = sqlite3.connect(DB_FILE, timeout=10)
+    try:
+        con.row_factory = sqlite3.Row
+        cur = con.cursor()
+        cur.execute(f"{ctes} SELECT COUNT(*) {sql_from}", params)
+        total = cur.fetchone()[0]
+        cur.execute(f"""
+            {ctes}
+            SELECT l.*, mk.market AS market, mk.exchange AS exchange
+            {sql_from}
+            ORDER BY {order}
+            {limit_sql}
+        """, params + page_params)
+        main_rows = cur.fetchall()
+
+        histories = {}
+        if main_rows and ({"daily.history", "weekly.history"} & wanted):
+            tickers = [r["ticker"] for r in main_rows]
+            cur.execute(f"""
+                SELECT ticker, daily_rating, daily_changed_at, weekly_rating, weekly_changed_at
+                FROM rating_history
+                WHERE ticker IN ({','.join('?' for _ in tickers)})
+                ORDER BY ticker, timestamp ASC
+            """, tickers)
+            for h in cur.fetchall():
+                hist = histories.setdefault(h["ticker"], {"daily": [], "weekly": []})
+                for tf in ("daily", "weekly"):
+                    if h[f"{tf}_rating"] and h[f"{tf}_changed_at"]:
+                        hist[tf].append({"rating": h[f"{tf}_rating"], "timestamp": h[f"{tf}_changed_at"]})
+    finally:
+        con.close()
+
+    rows = []
+    for m in main_rows:
+        full = {
+            "ticker": m["ticker"],
+            "currency": m["currency"] or "",
+            "price": m["price"],
+            "changePercent": m["change_pct"],
+            "change": m["change_abs"],
+            "high": m["high"],
+            "low": m["low"],
+            "market": m["market"],
+            "exchange": m["exchange"],
+        }
+        row = {k: v for k, v in full.items() if k in wanted}
+        for tf in ("daily", "weekly"):
+            if tf not in wanted and f"{tf}.history" not in wanted:
+                continue
+            block = {}
+            if tf in wanted:
+                block = {
+                    "recommend_all": m[f"{tf}_val"],
+                    "rating": m[f"{tf}_rating"] or "Unknown",
+                    "prev": m[f"{tf}_prev"] or "Unknown",
+                    "changed_at": m[f"{tf}_changed_at"],
+                }
+            if f"{tf}.history" in wanted:
+                block["history"] = histories.get(m["ticker"], {}).get(tf, [])
+            row[tf] = block
+        rows.append(row)
+
+    next_page = page + 1 if page_size and page * page_size < total else None
+    return {
+        "updated_at": _data_updated_at(),
+        "cursor": _data_cursor(),
+        "count": len(rows),
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "next_page": next_page,
+        "rows": rows,
+    }
+
+
+def _cached_json_response(request: Request, entry):
+    """Serve a cached {etag, body, gzip} entry with ETag/304 and gzip negotiation."""
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and entry["etag"] in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=entry["gzip"], media_type="application/json", headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+@app.get("/from-dr-api")
+def ratings_from_dr_api(
+    request: Request,
+    market: Optional[str] = Query(None, description="Market code(s), comma-separated (US,HK,...)"),
+    exchange: Optional[str] = Query(None, description="Exchange name(s), comma-separated"),
+    rating: Optional[str] = Query(None, description="Current rating(s) for `timeframe`, comma-separated"),
+    timeframe: str = Query("1D", description="Timeframe used by rating / changed_since: 1D or 1W"),
+    changed_since: Optional[str] = Query(None, description="Only tickers whose rating changed at/after this ISO time"),
+    sort: str = Query("ticker", description="Sort key (prefix - for descending): " + ", ".join(DR_API_SORT_COLUMNS)),
+    page: int = Query(1, ge=1),
+    page_size: Optional[int] = Query(None, ge=1, le=DR_API_MAX_PAGE_SIZE),
+    fields: Optional[str] = Query(None, description="Projection: " + ", ".join(DR_API_LIST_FIELDS))
+):
+    """
+    Fetches latest ratings, stats, and history from the SQLite DB 
+    and reconstructs the JSON response to match the original format.
+    Now reads from rating_main instead of ratings table.
+
+    The serialized (and gzipped) body is cached per data version (bump_data_version)
+    with a strong ETag; If-None-Match -> 304.
+
+    With any filter / sort / page / fields parameter the list is built by query_ratings_list
+    (SQL filtering + paging, history only when projected), also cached per data version.
+    
+    If USE_MOCK_DATA is True, returns mock AAPL data from mock_rating_history_aapl.json
+    """
+    global _dr_api_query_cache_version
+    # If mock data is enabled, return mock AAPL data
+    if USE_MOCK_DATA:
+        result = load_mock_aapl_data()
+        print(f"✅ Mock data loaded, returning: {result}")
+        return result
+
+    filtered = any(v is not None for v in (market, exchange, rating, changed_since, page_size, fields)) \
+        or sort != "ticker" or page != 1
+    if not filtered:
+        return _cached_json_response(request, _get_dr_api_cache())
+
+    if timeframe not in ("1D", "1W"):
+        raise HTTPException(status_code=400, detail="timeframe must be 1D or 1W")
+    if sort.lstrip("-") not in DR_API_SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {list(DR_API_SORT_COLUMNS)}")
+    field_list = _split_param(fields)
+    unknown = [f for f in field_list if f not in DR_API_LIST_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {unknown}")
+
+    version = get_data_version()
+    if version != _dr_api_query_cache_version:
+        _dr_api_query_cache.clear()
+        _dr_api_query_cache_version = version
+    key = (market, exchange, rating, timeframe, changed_since, sort, page, page_size, tuple(field_list))
+    entry = _dr_api_query_cache.get(key)
+    if entry is None:
+        payload = query_ratings_list(market, exchange, rating, timeframe, changed_since, sort, page, page_size, field_list)
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        etag_hash = format(abs(hash(key)) & 0xffffffff, "x")
+        entry = {"etag": f'"{_BOOT_ID}-{version}-{etag_hash}"', "body": body, "gzip": gzip.compress(body, 6)}
+        if len(_dr_api_query_cache) < 256:
+            _dr_api_query_cache[key] = entry
+    return _cached_json_response(request, entry)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8335)
@@ -0,0 +1,194 @@
+"""
+Golden tests: accuracy_engine must give exactly the same numbers as the Python
+accuracy functions in ratings_api_dynamic, for every ticker and every window.
+
+Run:
+    cd backend/API && python -m pytest -q test_accuracy_engine.py
+"""
+
+import os
+import random
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import accuracy_engine  # noqa: E402
+import ratings_api_dynamic as rmod  # noqa: E402
+
+RATINGS = ["Strong Buy", "Buy", "Neutral", "Sell", "Strong Sell",
+           "strong buy", " Buy ", "BUY", "Unknown", "", None]
+WINDOWS = [7, 30, 90]
+
+
+def _synthetic_db(seed=7, tickers=("AAPL", "NVDA", "700", "SAP"), days=160):
+    rnd = random.Random(seed)
+    con = sqlite3.connect(":memory:")
+    con.execute("""
+        CREATE TABLE rating_history (
+            ticker TEXT, timestamp TEXT, daily_rating TEXT, daily_prev TEXT,
+            weekly_rating TEXT, weekly_prev TEXT, change_pct REAL, open REAL, price REAL,
+            PRIMARY KEY (ticker, timestamp)
+        )
+    """)
+    start = datetime(2025, 10, 1, 4, 0, 0)
+    for t in tickers:
+        for d in range(days):
+            if rnd.random() < 0.3:
+                continue
+            ts = start + timedelta(days=d, hours=rnd.choice([0, 1, 18]), seconds=rnd.randint(0, 59))
+            ts_str = ts.isoformat() if rnd.random() < 0.7 else ts.isoformat(timespec="microseconds")
+            change = None if rnd.random() < 0.05 else rnd.choice([0.0, 0.005, 2.0, -2.0, rnd.uniform(-6, 6)])
+            opn = None if rnd.random() < 0.3 else rnd.choice([0.0, rnd.uniform(50, 150)])
+            price = None if rnd.random() < 0.1 else rnd.uniform(50, 150)
+            con.execute(
+                "INSERT INTO rating_history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (t, ts_str, rnd.choice(RATINGS), rnd.choice(RATINGS), rnd.choice(RATINGS),
+                 rnd.choice(RATINGS), change, opn, price),
+            )
+    con.commit()
+    return con
+
+
+def _window_rows(con, ticker, ts, window_days, timeframe="daily"):
+    """Rows exactly as the Python code selects them: newest first inside the window."""
+    cur = con.cursor()
+    cur.execute(f"""
+        SELECT {timeframe}_rating, {timeframe}_prev, change_pct, open, price
+        FROM rating_history
+        WHERE ticker=? AND timestamp >= datetime(?, '-{window_days} days') AND timestamp <= ?
+        ORDER BY timestamp DESC
+    """, (ticker, ts, ts))
+    return cur.fetchall()
+
+
+def _engine_windows(con, method, window_days, timeframe="daily", filter_rating=None):
+    h = accuracy_engine.load_history(con, timeframe=timeframe)
+    with_nb, alone = accuracy_engine.row_outcomes(h, method=method, filter_rating=filter_rating)
+    start = accuracy_engine.window_starts(h, window_days)
+    correct, incorrect = accuracy_engine.window_counts(h, with_nb, alone, start)
+    return h, correct, incorrect
+
+
+@pytest.fixture(scope="module")
+def con():
+    c = _synthetic_db()
+    yield c
+    c.close()
+
+
+@pytest.mark.parametrize("window_days", WINDOWS)
+@pytest.mark.parametrize("timeframe", ["daily", "weekly"])
+def test_matching_frontend_every_window(con, window_days, timeframe):
+    h, correct, incorrect = _engine_windows(con, "matching_frontend", window_days, timeframe)
+    assert len(h["ts"]) > 100
+    for i in range(len(h["ts"])):
+        ticker = h["tickers"][h["ticker_idx"][i]]
+        rows = [{"rating": r[0], "prev": r[1], "change_pct": r[2], "open": r[3], "price": r[4]}
+                for r in _window_rows(con, ticker, str(h["ts"][i]), window_days, timeframe)]
+        expected = rmod.calculate_accuracy_matching_frontend(rows, None, change_threshold=2.0)
+        assert (int(correct[i]), int(incorrect[i])) == (expected["correct"], expected["incorrect"]), (ticker, h["ts"][i])
+        assert accuracy_engine.accuracy_value(int(correct[i]), int(incorrect[i])) == expected["accuracy"]
+
+
+@pytest.mark.parametrize("window_days", WINDOWS)
+def test_rating_change_every_window(con, window_days):
+    h_d, c_d, i_d = _engine_windows(con, "rating_change", window_days, "daily")
+    h_w, c_w, i_w = _engine_windows(con, "rating_change", window_days, "weekly")
+    cur = con.cursor()
+    for i in range(len(h_d["ts"])):
+        ticker = h_d["tickers"][h_d["ticker_idx"][i]]
+        ts = str(h_d["ts"][i])
+        cur.execute(f"""
+            SELECT daily_rating, daily_prev, weekly_rating, weekly_prev, change_pct
+            FROM rating_history
+            WHERE ticker=? AND timestamp >= datetime(?, '-{window_days} days') AND timestamp <= ?
+            ORDER BY timestamp DESC
+        """, (ticker, ts, ts))
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        expected = rmod.calculate_accuracy_from_rating_change(rows, window_days)
+        assert (int(c_d[i]), int(i_d[i])) == (expected["daily"]["correct"], expected["daily"]["incorrect"])
+        assert (int(c_w[i]), int(i_w[i])) == (expected["weekly"]["correct"], expected["weekly"]["incorrect"])
+        assert accuracy_engine.accuracy_value(int(c_d[i]), int(i_d[i]), "rating_change") == expected["daily"]["accuracy"]
+        assert accuracy_engine.accuracy_value(int(c_w[i]), int(i_w[i]), "rating_change") == expected["weekly"]["accuracy"]
+
+
+@pytest.mark.parametrize("filter_rating", [None, "Buy", "Strong Sell", "strong buy"])
+def test_frontend_logic_whole_history(con, filter_rating, capsys):
+    h = accuracy_engine.load_history(con)
+    with_nb, alone = accuracy_engine.row_outcomes(h, method="frontend_logic", filter_rating=filter_rating)
+    correct, incorrect = accuracy_engine.window_counts(h, with_nb, alone)
+    result = accuracy_engine.latest_by_ticker(h, correct, incorrect, "frontend_logic")
+
+    cur = con.cursor()
+    for ticker in h["tickers"]:
+        cur.execute("""
+            SELECT daily_rating, daily_prev, change_pct FROM rating_history
+            WHERE ticker=? ORDER BY timestamp DESC
+        """, (ticker,))
+        # calculate_accuracy_from_frontend_logic calls .lower() on the rating, so it needs strings
+        history = [{"rating": r[0] or "", "prev": r[1] or "", "change_pct": r[2]} for r in cur.fetchall()]
+        expected = rmod.calculate_accuracy_from_frontend_logic(history, filter_rating)
+        assert result[ticker] == expected, ticker
+    capsys.readouterr()
+
+
+def test_accuracy_all_tickers_latest_window(con):
+    result = accuracy_engine.accuracy_all_tickers(con, window_days=90)
+    cur = con.cursor()
+    for ticker in result:
+        cur.execute("SELECT MAX(timestamp) FROM rating_history WHERE ticker=?", (ticker,))
+        ts = cur.fetchone()[0]
+        rows = [{"daily_rating": r[0], "daily_prev": r[1], "change_pct": r[2], "open": r[3], "price": r[4]}
+                for r in _window_rows(con, ticker, ts, 90)]
+        assert result[ticker] == rmod.calculate_accuracy_matching_frontend(rows, None, change_threshold=2.0)
+
+
+def test_bundled_database_matches():
+    db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ratings.sqlite")
+    if not os.path.exists(db_path):
+        pytest.skip("ratings.sqlite not available")
+    con = sqlite3.connect(f"file:{db_path}?mode=ro&immutable=1", uri=True)
+    try:
+        for method in ("matching_frontend", "rating_change"):
+            h, correct, incorrect = _engine_windows(con, method, 90)
+            for i in range(len(h["ts"])):
+                ticker = h["tickers"][h["ticker_idx"][i]]
+                rows = _window_rows(con, ticker, str(h["ts"][i]), 90)
+                if method == "matching_frontend":
+                    expected = rmod.calculate_accuracy_matching_frontend(
+                        [{"daily_rating": r[0], "daily_prev": r[1], "change_pct": r[2], "open": r[3], "price": r[4]} for r in rows],
+                        None, change_threshold=2.0)
+                else:
+                    expected = rmod.calculate_accuracy_from_rating_change(
+                        [{"daily_rating": r[0], "daily_prev": r[1], "change_pct": r[2]} for r in rows])["daily"]
+                assert (int(correct[i]), int(incorrect[i])) == (expected["correct"], expected["incorrect"]), (method, ticker)
+    finally:
+        con.close()
+
+
+def test_backtest_grid_matches_loop(con):
+    h = accuracy_engine.load_history(con)
+    cells, per_ticker = accuracy_engine.backtest_grid(h, [1.0, 2.0], [1, 3])
+    rows = con.execute("SELECT ticker, daily_rating, daily_prev, price FROM rating_history ORDER BY ticker, timestamp").fetchall()
+    expected = {}
+    for i, (ticker, rating, prev, price) in enumerate(rows):
+        s_now, s_prev = accuracy_engine._strength(rating), accuracy_engine._strength(prev)
+        if (not rating or not prev or rating.lower().strip() == prev.lower().strip()
+                or accuracy_engine.NO_STRENGTH in (s_now, s_prev) or s_now == s_prev):
+            continue
+        for horizon in (1, 3):
+            j = i + horizon
+            if j >= len(rows) or rows[j][0] != ticker or not price or rows[j][3] is None:
+                continue
+            fwd = (rows[j][3] - price) / price * 100
+            for threshold in (1.0, 2.0):
+                c = expected.setdefault((horizon, threshold), [0, 0])
+                c[1] += 1
+                c[0] += (s_now > s_prev and fwd >= threshold) or (s_now < s_prev and fwd <= -threshold)
+    assert [(c["correct"], c["total"]) for c in cells] == [tuple(expected.get((c["horizon"], c["threshold"]), [0, 0])) for c in cells]
+    assert sum(t[0]["total"] for t in per_ticker.values()) == cells[0]["total"]
@@ -0,0 +1,30 @@
+"""
+Tests for history_backfill helpers.
+
+Run:
+    cd backend/API && python -m pytest -q test_history_backfill.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import history_backfill  # noqa: E402
+
+
+def test_field_name_current_session_unchanged():
+    assert history_backfill._field_name("Recommend.All", 0) == "Recommend.All"
+    assert history_backfill._field_name("Recommend.All|1W", 0) == "Recommend.All|1W"
+
+
+def test_field_name_daily_offset():
+    assert history_backfill._field_name("Recommend.All", 3) == "Recommend.All[3]"
+    assert history_backfill._field_name("close", 1) == "close[1]"
+
+
+def test_field_name_weekly_offset_before_interval():
+    # same layout as RSI[1]|1W: offset goes before the interval suffix
+    assert history_backfill._field_name("Recommend.All|1W", 2) == "Recommend.All[2]|1W"
+    cols = {name: history_backfill._field_name(name, 4) for name in history_backfill.WEEKLY_FIELDS}
+    assert cols == {"Recommend.All|1W": "Recommend.All[4]|1W"}
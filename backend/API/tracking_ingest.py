@@ -0,0 +1,188 @@
+"""
+Buffered ingestion for /ratings/api/track
+
+The request handler only dedupes against an in-memory "last event" map and appends to a
+queue; a background flusher writes the queue every FLUSH_INTERVAL_MS (or as soon as
+FLUSH_MAX_EVENTS are waiting) with executemany in one transaction:
+
+- user_tracking: one row per accepted event (same columns as before)
+- user_page_analytics: view_count += number of events per (ip, page) in the batch
+- analytics_rollup: minute/hour/day counters + HyperLogLog visitors (see analytics_rollup.py)
+
+Dedupe rule (unchanged): an event is dropped when the latest accepted event of the same
+session + event_type + page_path carried identical event_data. The map is in memory, so the
+first event per key after a restart is always kept.
+
+Writes go to analytics.sqlite through analytics_db.writer(), never to ratings.sqlite.
+Started from the ratings / unified app lifespan: asyncio.create_task(tracking_ingest.run_flusher()).
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import analytics_db
+import analytics_rollup
+import presence
+
+FLUSH_INTERVAL_MS = int(os.getenv("TRACK_FLUSH_INTERVAL_MS", "500"))
+FLUSH_MAX_EVENTS = int(os.getenv("TRACK_FLUSH_MAX_EVENTS", "500"))
+MAX_QUEUE = int(os.getenv("TRACK_MAX_QUEUE", "50000"))
+DEDUPE_MAX_KEYS = int(os.getenv("TRACK_DEDUPE_MAX_KEYS", "100000"))
+
+# (session_id, event_type, page_path) -> normalized event_data of the last accepted event
+_last_event = OrderedDict()
+# (ip, session_id, event_type, event_data_json, page_path, timestamp, user_agent)
+_queue = deque()
+_flush_lock = threading.Lock()
+_wakeup = None  # asyncio.Event of the running flusher
+_last_maintenance = 0.0
+_maintenance_task = None
+MAINTENANCE_INTERVAL_SECONDS = 3600
+
+_stats = {
+    "accepted": 0,
+    "duplicates": 0,
+    "dropped": 0,
+    "flushed": 0,
+    "flushes": 0,
+    "last_flush_at": None,
+    "last_flush_ms": None,
+    "last_error": None,
+}
+
+
+def enqueue(ip_address, session_id, event_type, event_data, page_path, timestamp, user_agent) -> str:
+    """Dedupe + queue one event. Returns "queued", "duplicate" or "dropped" (queue full)."""
+    presence.touch(session_id, page_path)
+    data_str = json.dumps(event_data, sort_keys=True)
+    key = (session_id, event_type, page_path)
+    if _last_event.get(key) == data_str:
+        _stats["duplicates"] += 1
+        return "duplicate"
+
+    if len(_queue) >= MAX_QUEUE:
+        # writer ตามไม่ทัน -> ทิ้ง event ใหม่ดีกว่าให้ memory โตไม่จำกัด
+        # (ไม่บันทึกเป็น dedupe reference เพื่อให้ retry ครั้งถัดไปไม่ถูกนับเป็น duplicate)
+        _stats["dropped"] += 1
+        return "dropped"
+    _last_event[key] = data_str
+    _last_event.move_to_end(key)
+    if len(_last_event) > DEDUPE_MAX_KEYS:
+        _last_event.popitem(last=False)
+    _queue.append((ip_address, session_id, event_type, data_str, page_path, timestamp, user_agent))
+    _stats["accepted"] += 1
+    if len(_queue) >= FLUSH_MAX_EVENTS and _wakeup is not None:
+        _wakeup.set()
+    return "queued"
+
+
+def flush() -> int:
+    """Write everything queued so far in one transaction. Blocking; returns rows written."""
+    with _flush_lock:
+        n = len(_queue)
+        if not n:
+            return 0
+        batch = [_queue.popleft() for _ in range(n)]
+        views = {}
+        for ev in batch:
+            views[(ev[0], ev[4])] = views.get((ev[0], ev[4]), 0) + 1
+
+        t0 = time.time()
+        con = analytics_db.writer()
+        try:
+            cur = con.cursor()
+            try:
+                cur.executemany("""
+                    INSERT INTO user_tracking
+                    (ip_address, session_id, event_type, event_data, page_path, timestamp, user_agent)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, batch)
+                cur.executemany("""
+                    INSERT INTO user_page_analytics (ip_address, page_path, view_count)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(ip_address, page_path) DO UPDATE SET
+                        view_count = view_count + excluded.view_count
+                """, [(ip, page, cnt) for (ip, page), cnt in views.items()])
+                analytics_rollup.apply(cur, batch)
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
+        except Exception as e:
+            # put the batch back (oldest first) and retry on the next tick
+            _queue.extendleft(reversed(batch))
+            _stats["last_error"] = str(e)
+            print(f"[TrackIngest] Flush failed ({n} events kept): {e}")
+            return 0
+
+        _stats["flushed"] += n
+        _stats["flushes"] += 1
+        _stats["last_flush_at"] = datetime.now().isoformat()
+        _stats["last_flush_ms"] = round((time.time() - t0) * 1000, 2)
+        return n
+
+
+def maintain():
+    """
+    Hourly retention / vacuum of the analytics DB, on the writer (same lock as flush).
+    Deletes in RETENTION_BATCH chunks until the backlog is gone, committing and releasing
+    _flush_lock between chunks so flushes are not blocked behind a large purge.
+    """
+    cutoff = analytics_db.retention_cutoff()
+    if cutoff is None:
+        return
+    total = 0
+    while True:
+        with _flush_lock:
+            con = analytics_db.writer()
+            try:
+                deleted = analytics_db.delete_expired_batch(con.cursor(), cutoff)
+                con.commit()
+            except Exception as e:
+                con.rollback()
+                print(f"[TrackIngest] Maintenance failed: {e}")
+                return
+        total += deleted
+        if deleted < analytics_db.RETENTION_BATCH:
+            break
+        time.sleep(0)  # ปล่อย GIL ให้ flush ที่รอ lock อยู่ได้เข้าไปก่อน
+    if not total:
+        return
+    with _flush_lock:
+        try:
+            analytics_db.vacuum(analytics_db.writer().cursor())
+        except Exception as e:
+            print(f"[TrackIngest] Vacuum failed: {e}")
+    print(f"[TrackIngest] Retention: deleted {total} old user_tracking rows")
+
+
+async def run_flusher():
+    """Flush every FLUSH_INTERVAL_MS, or early when FLUSH_MAX_EVENTS are queued."""
+    global _wakeup, _last_maintenance, _maintenance_task
+    _wakeup = asyncio.Event()
+    print(f"[TrackIngest] Flusher started (every {FLUSH_INTERVAL_MS} ms or {FLUSH_MAX_EVENTS} events)")
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=FLUSH_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+            if _queue:
+                await asyncio.to_thread(flush)
+            if time.time() - _last_maintenance > MAINTENANCE_INTERVAL_SECONDS and (
+                    _maintenance_task is None or _maintenance_task.done()):
+                # แยก task ออกไป: flusher loop ยัง flush ต่อได้ระหว่างที่ retention ลบทีละ batch
+                _last_maintenance = time.time()
+                _maintenance_task = asyncio.create_task(asyncio.to_thread(maintain))
+    finally:
+        # shutdown: ไม่ทิ้ง event ที่ค้างอยู่
+        flush()
+
+
+def get_status() -> dict:
+    return {**_stats, "queued": len(_queue), "dedupe_keys": len(_last_event)}
@@ -222,6 +222,23 @@ const Stats = () => {
         };
     }, [isAuth]);
 
+    // Live presence over SSE (Active Users updates between summary polls)
+    useEffect(() => {
+        if (!isAuth || typeof EventSource === 'undefined') return;
+        const eventSource = new EventSource(`${API_BASE}/api/analytics/presence/stream`);
+        eventSource.onmessage = (event) => {
+            try {
+                const msg = JSON.parse(event.data);
+                if (msg.type !== 'presence') return;
+                setSummary((prev) => ({ ...(prev || {}), active_users: msg.active_users, active_pages: msg.pages }));
+            } catch (e) {
+                // Silent error handling
+            }
+        };
+        // EventSource reconnects on its own; the 10 s summary poll covers any gap
+        return () => eventSource.close();
+    }, [isAuth]);
+
     // Fetch Trend when type switches
     useEffect(() => {
         if (isAuth) {
@@ -5,6 +5,10 @@ import { HistorySkeleton, TableSkeleton, CardSkeleton } from "./SkeletonLoader";
 
 const API_URL = import.meta.env.VITE_DR_LIST_API;
 const RATINGS_API = import.meta.env.VITE_RATINGS_API;
+// /ratings base (delta feed: /changes, /changes/stream)
+const RATINGS_BASE = (RATINGS_API || "").replace(/\/from-dr-api\/?$/, "");
+// Initial load: live DR list + ratings in one round trip
+const PAGE_BUNDLE_API = `${import.meta.env.VITE_DR_LIST_BASE_API}/api/page/suggestion`;
 
 // 🔧 MOCK DATA FLAG - ตั้งเป็น true เพื่อใช้ mock data สำหรับทดสอบ winrate
 // เมื่อต้องการใช้ข้อมูลจริง ให้เปลี่ยนกลับเป็น false
@@ -839,6 +843,10 @@ export default function Suggestion() {
   const [loading, setLoading] = useState(true);
   const [sortConfig, setSortConfig] = useState({ key: null, direction: "asc" });
   const [lastUpdateTime, setLastUpdateTime] = useState(null);
+  // latest ratings per ticker + DR list + cursor of the ratings change feed
+  const ratingMapRef = useRef({});
+  const drJsonRef = useRef(null);
+  const ratingsCursorRef = useRef(null);
 
   const [showCountryMenu, setShowCountryMenu] = useState(false);
   const countryDropdownRef = useRef(null);
@@ -901,138 +909,195 @@ export default function Suggestion() {
 
   useEffect(() => {
     let isMounted = true;
-    async function fetchData() {
-      try {
-        const ratingsApiUrl = USE_MOCK_DATA ? MOCK_RATINGS_API : RATINGS_API;
-        const [resDR, resRating] = await Promise.all([fetch(API_URL), fetch(ratingsApiUrl)]);
 
-        if (!resDR.ok) {
-          throw new Error(`DR API error: ${resDR.status} ${resDR.statusText}`);
-        }
-        if (!resRating.ok) {
-          throw new Error(`Ratings API error: ${resRating.status} ${resRating.statusText}`);
+    const applyUpdatedAt = (updatedAt) => {
+      // Get updated_at from API response
+      if (updatedAt) {
+        const apiDate = new Date(updatedAt);
+        if (!isNaN(apiDate.getTime())) {
+          setLastUpdateTime(apiDate);
+        } else {
+          // Fallback to current time if API date is invalid
+          setLastUpdateTime(new Date());
         }
+      } else {
+        // Fallback to current time if API doesn't provide updated_at
+        setLastUpdateTime(new Date());
+      }
+    };
 
-        const jsonDR = await resDR.json();
-        const jsonRating = await resRating.json();
-        if (!isMounted) return;
+    // Merge a /ratings/changes delta (only tickers that changed since our cursor)
+    const applyRatingChanges = (delta) => {
+      (delta.rows || []).forEach((r) => { if (r.ticker) ratingMapRef.current[r.ticker.toUpperCase()] = r; });
+      (delta.removed || []).forEach((t) => { delete ratingMapRef.current[String(t).toUpperCase()]; });
+      if (delta.cursor) ratingsCursorRef.current = delta.cursor;
+      if ((delta.rows || []).length || (delta.removed || []).length) applyUpdatedAt(delta.updated_at);
+    };
 
-        // Get updated_at from API response
-        if (jsonRating.updated_at) {
-          const apiDate = new Date(jsonRating.updated_at);
-          if (!isNaN(apiDate.getTime())) {
-            setLastUpdateTime(apiDate);
-          } else {
-            // Fallback to current time if API date is invalid
-            setLastUpdateTime(new Date());
-          }
-        } else {
-          // Fallback to current time if API doesn't provide updated_at
-          setLastUpdateTime(new Date());
+    async function fetchRatings(full) {
+      if (!full && !USE_MOCK_DATA && ratingsCursorRef.current) {
+        const resChanges = await fetch(`${RATINGS_BASE}/changes?since=${encodeURIComponent(ratingsCursorRef.current)}`);
+        if (!resChanges.ok) {
+          throw new Error(`Ratings API error: ${resChanges.status} ${resChanges.statusText}`);
         }
+        const delta = await resChanges.json();
+        if (!delta.full) {
+          applyRatingChanges(delta);
+          return;
+        }
+        // cursor unknown (server restart / too old) -> reload everything
+      }
+      const ratingsApiUrl = USE_MOCK_DATA ? MOCK_RATINGS_API : RATINGS_API;
+      const resRating = await fetch(ratingsApiUrl);
+      if (!resRating.ok) {
+        throw new Error(`Ratings API error: ${resRating.status} ${resRating.statusText}`);
+      }
+      const jsonRating = await resRating.json();
+      applyRatings(jsonRating);
+    }
 
-        const ratingMap = {};
-        (jsonRating.rows || []).forEach((r) => { if (r.ticker) ratingMap[r.ticker.toUpperCase()] = r; });
+    function applyRatings(jsonRating) {
+      const ratingMap = {};
+      (jsonRating.rows || []).forEach((r) => { if (r.ticker) ratingMap[r.ticker.toUpperCase()] = r; });
+      ratingMapRef.current = ratingMap;
+      ratingsCursorRef.current = jsonRating.cursor || null;
+      applyUpdatedAt(jsonRating.updated_at);
+    }
 
-        // Build a map of all DRs grouped by underlying
-        const drByUnderlying = new Map();
-        (jsonDR.rows || []).forEach((item) => {
-          // Preserve numeric-only symbols (e.g., '9999') by falling back to raw symbol
-          const rawSym = (item.symbol || "").toUpperCase().trim();
-          const strippedSym = rawSym.replace(/\d+$/, "");
-          const uName = (item.underlying || (strippedSym || rawSym)).toUpperCase().trim();
+    // One request for DR list + ratings; false -> caller falls back to the separate endpoints
+    async function fetchPageBundle() {
+      if (USE_MOCK_DATA || !import.meta.env.VITE_DR_LIST_BASE_API) return false;
+      try {
+        const res = await fetch(PAGE_BUNDLE_API);
+        if (!res.ok) return false;
+        const bundle = await res.json();
+        if (!bundle.dr || !bundle.ratings || !isMounted) return false;
+        drJsonRef.current = bundle.dr;
+        applyRatings(bundle.ratings);
+        return true;
+      } catch (err) {
+        return false;
+      }
+    }
 
-          if (USE_MOCK_DATA && uName !== "AAPL") {
-            return;
-          }
+    function buildData() {
+      const jsonDR = drJsonRef.current || {};
+      const ratingMap = ratingMapRef.current;
+
+      // Build a map of all DRs grouped by underlying
+      const drByUnderlying = new Map();
+      (jsonDR.rows || []).forEach((item) => {
+        // Preserve numeric-only symbols (e.g., '9999') by falling back to raw symbol
+        const rawSym = (item.symbol || "").toUpperCase().trim();
+        const strippedSym = rawSym.replace(/\d+$/, "");
+        const uName = (item.underlying || (strippedSym || rawSym)).toUpperCase().trim();
+
+        if (USE_MOCK_DATA && uName !== "AAPL") {
+          return;
+        }
+
+        if (!drByUnderlying.has(uName)) {
+          drByUnderlying.set(uName, []);
+        }
+        drByUnderlying.get(uName).push(item);
+      });
+
+      const underlyingMap = new Map();
+      drByUnderlying.forEach((drList, uName) => {
 
-          if (!drByUnderlying.has(uName)) {
-            drByUnderlying.set(uName, []);
+        let mostPopularDR = null;
+        let maxVolume = -1;
+        drList.forEach((dr) => {
+          const vol = Number(dr.totalVolume) || 0;
+          if (vol > maxVolume) {
+            maxVolume = vol;
+            mostPopularDR = {
+              symbol: dr.symbol || "",
+              volume: vol
+            };
           }
-          drByUnderlying.get(uName).push(item);
         });
 
-        const underlyingMap = new Map();
-        drByUnderlying.forEach((drList, uName) => {
-
-          let mostPopularDR = null;
-          let maxVolume = -1;
-          drList.forEach((dr) => {
-            const vol = Number(dr.totalVolume) || 0;
-            if (vol > maxVolume) {
-              maxVolume = vol;
-              mostPopularDR = {
-                symbol: dr.symbol || "",
-                volume: vol
-              };
-            }
-          });
-
-          if (!mostPopularDR && drList.length > 0) {
-            mostPopularDR = {
-              symbol: drList[0].symbol || "",
-              volume: 0
+        if (!mostPopularDR && drList.length > 0) {
+          mostPopularDR = {
+            symbol: drList[0].symbol || "",
+            volume: 0
+          };
+        }
+
+        let highSensitivityDR = null;
+        let minBid = Infinity;
+        drList.forEach((dr) => {
+          const bid = Number(dr.bidPrice) || 0;
+          if (bid > 0 && bid < minBid) {
+            minBid = bid;
+            highSensitivityDR = {
+              symbol: dr.symbol || "",
+              bid: bid
             };
           }
+        });
+
+        if (drList.length === 1 && drList[0]) {
+          const singleDR = drList[0];
+          const vol = Number(singleDR.totalVolume) || 0;
+          const bid = Number(singleDR.bidPrice) || 0;
 
-          let highSensitivityDR = null;
-          let minBid = Infinity;
-          drList.forEach((dr) => {
-            const bid = Number(dr.bidPrice) || 0;
-            if (bid > 0 && bid < minBid) {
-              minBid = bid;
-              highSensitivityDR = {
-                symbol: dr.symbol || "",
-                bid: bid
-              };
-            }
-          });
-
-          if (drList.length === 1 && drList[0]) {
-            const singleDR = drList[0];
-            const vol = Number(singleDR.totalVolume) || 0;
-            const bid = Number(singleDR.bidPrice) || 0;
-
-            if (!mostPopularDR) {
-              mostPopularDR = { symbol: singleDR.symbol || "", volume: vol };
-            }
-            if (!highSensitivityDR && bid > 0) {
-              highSensitivityDR = { symbol: singleDR.symbol || "", bid: bid };
-            }
+          if (!mostPopularDR) {
+            mostPopularDR = { symbol: singleDR.symbol || "", volume: vol };
           }
+          if (!highSensitivityDR && bid > 0) {
+            highSensitivityDR = { symbol: singleDR.symbol || "", bid: bid };
+          }
+        }
 
-          const firstItem = drList[0];
-          const rt = ratingMap[uName];
-          underlyingMap.set(uName, {
-            ...firstItem,
-            last: rt?.price || 0,
-            percentChange: rt?.changePercent || 0,
-            change: rt?.change || 0,
-            high: rt?.high || 0,
-            low: rt?.low || 0,
-            displaySymbol: uName,
-            displayName: getShortName(firstItem),
-            ratingDay: rt?.daily?.rating ?? "Unknown",
-            prevDay: rt?.daily?.prev ?? "Unknown",
-            timeDay: rt?.daily?.changed_at,
-            ratingWeek: rt?.weekly?.rating ?? "Unknown",
-            prevWeek: rt?.weekly?.prev ?? "Unknown",
-            timeWeek: rt?.weekly?.changed_at,
-            ratingDayHistory: rt?.daily?.history || [],
-            ratingWeekHistory: rt?.weekly?.history || [],
-            currency: rt?.currency || "",
-            exchangeCountry: getCountryFromExchange(firstItem.underlyingExchange),
-            mostPopularDR: mostPopularDR,
-            highSensitivityDR: highSensitivityDR
-          });
+        const firstItem = drList[0];
+        const rt = ratingMap[uName];
+        underlyingMap.set(uName, {
+          ...firstItem,
+          last: rt?.price || 0,
+          percentChange: rt?.changePercent || 0,
+          change: rt?.change || 0,
+          high: rt?.high || 0,
+          low: rt?.low || 0,
+          displaySymbol: uName,
+          displayName: getShortName(firstItem),
+          ratingDay: rt?.daily?.rating ?? "Unknown",
+          prevDay: rt?.daily?.prev ?? "Unknown",
+          timeDay: rt?.daily?.changed_at,
+          ratingWeek: rt?.weekly?.rating ?? "Unknown",
+          prevWeek: rt?.weekly?.prev ?? "Unknown",
+          timeWeek: rt?.weekly?.changed_at,
+          ratingDayHistory: rt?.daily?.history || [],
+          ratingWeekHistory: rt?.weekly?.history || [],
+          currency: rt?.currency || "",
+          exchangeCountry: getCountryFromExchange(firstItem.underlyingExchange),
+          mostPopularDR: mostPopularDR,
+          highSensitivityDR: highSensitivityDR
         });
-        const arr = Array.from(underlyingMap.values());
-        try {
-          // debug: built underlyingMap entries (removed noisy console output)
-        } catch (err) {
-          // ignore
+      });
+      const arr = Array.from(underlyingMap.values());
+      setData(arr);
+    }
+
+    async function fetchData(fullRatings = false) {
+      try {
+        if (fullRatings && await fetchPageBundle()) {
+          buildData();
+          setLoading(false);
+          return;
         }
-        setData(arr);
+        const [resDR] = await Promise.all([fetch(API_URL), fetchRatings(fullRatings)]);
+
+        if (!resDR.ok) {
+          throw new Error(`DR API error: ${resDR.status} ${resDR.statusText}`);
+        }
+
+        const jsonDR = await resDR.json();
+        if (!isMounted) return;
+
+        drJsonRef.current = jsonDR;
+        buildData();
         setLoading(false);
       } catch (err) {
         if (isMounted) {
@@ -1041,12 +1106,60 @@ export default function Suggestion() {
         }
       }
     }
-    const timeoutId = setTimeout(fetchData, 100);
-    const intervalId = setInterval(fetchData, 60000);
+
+    // SSE: rating/price deltas pushed as soon as a batch is committed on the server
+    let eventSource = null;
+    let reconnectTimeout = null;
+    let reconnectAttempts = 0;
+    const maxReconnectAttempts = 10;
+    const baseReconnectDelay = 1000;
+
+    const connectChanges = () => {
+      if (USE_MOCK_DATA || !isMounted || !ratingsCursorRef.current) return;
+      eventSource = new EventSource(`${RATINGS_BASE}/changes/stream?since=${encodeURIComponent(ratingsCursorRef.current)}`);
+
+      eventSource.onopen = () => {
+        reconnectAttempts = 0;
+      };
+
+      eventSource.onmessage = (event) => {
+        try {
+          const delta = JSON.parse(event.data);
+          if (delta.type !== "changes" || !isMounted) return;
+          if (delta.full) {
+            fetchData(true);
+            return;
+          }
+          applyRatingChanges(delta);
+          if (drJsonRef.current) buildData();
+        } catch (err) {
+          // Silent error handling
+        }
+      };
+
+      eventSource.onerror = () => {
+        eventSource.close();
+        // the 60 s poll below keeps catching up through /changes while disconnected
+        if (isMounted && reconnectAttempts < maxReconnectAttempts) {
+          const delay = baseReconnectDelay * Math.pow(2, reconnectAttempts);
+          reconnectAttempts++;
+          reconnectTimeout = setTimeout(connectChanges, delay);
+        }
+      };
+    };
+
+    const timeoutId = setTimeout(async () => {
+      await fetchData(true);
+      connectChanges();
+    }, 100);
+    // DR list (bid/volume) still polls; ratings only fetch the delta since our cursor
+    const intervalId = setInterval(() => fetchData(false), 60000);
     return () => {
       isMounted = false;
       clearTimeout(timeoutId);
       clearInterval(intervalId);
+      clearTimeout(reconnectTimeout);
+      if (eventSource) eventSource.close();
     };
   }, []);
 
@@ -91,6 +91,46 @@ const normalizePagePath = (path) => {
 // Global cache for deduplication
 const eventCache = new Map();
 
+// ==================== BATCHING ====================
+// Events are queued and sent together to /api/track/batch every FLUSH_INTERVAL_MS
+// (or once FLUSH_MAX_EVENTS are waiting); the rest goes out with sendBeacon when the page is hidden.
+const FLUSH_INTERVAL_MS = 5000;
+const FLUSH_MAX_EVENTS = 20;
+const TRACK_BATCH_URL = `${API_CONFIG.endpoints.ratings.track}/batch`;
+let pendingEvents = [];
+let flushTimer = null;
+
+const flushEvents = (useBeacon = false) => {
+    if (flushTimer) {
+        clearTimeout(flushTimer);
+        flushTimer = null;
+    }
+    if (pendingEvents.length === 0) return;
+    const body = JSON.stringify(pendingEvents);
+    pendingEvents = [];
+
+    // text/plain = simple request (no CORS preflight), also what sendBeacon sends
+    if (useBeacon && navigator.sendBeacon) {
+        if (navigator.sendBeacon(TRACK_BATCH_URL, new Blob([body], { type: 'text/plain' }))) return;
+    }
+    fetch(TRACK_BATCH_URL, {
+        method: 'POST',
+        headers: { 'Content-Type': 'text/plain' },
+        body,
+        keepalive: true
+    }).catch((e) => {
+        // Silently fail to not disturb user
+        if (DEBUG_MODE) console.error('Tracking error:', e);
+    });
+};
+
+if (typeof window !== 'undefined') {
+    window.addEventListener('pagehide', () => flushEvents(true));
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') flushEvents(true);
+    });
+}
+
 const sendTrackingEvent = async (eventType, eventData = {}, pagePath = normalizePagePath(window.location.pathname)) => {
     // Deduplication: if exactly same event was sent in last 1000ms, skip it
     const eventKey = `${eventType}:${JSON.stringify(eventData)}:${pagePath}`;
@@ -113,13 +153,12 @@ const sendTrackingEvent = async (eventType, eventData = {}, pagePath = normalize
             user_agent: navigator.userAgent
         };
 
-        await fetch(API_CONFIG.endpoints.ratings.track, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(payload)
-        });
+        pendingEvents.push(payload);
+        if (pendingEvents.length >= FLUSH_MAX_EVENTS) {
+            flushEvents();
+        } else if (!flushTimer) {
+            flushTimer = setTimeout(() => flushEvents(), FLUSH_INTERVAL_MS);
+        }
 
     } catch (e) {
         // Silently fail to not disturb user